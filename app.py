@@ -8,6 +8,7 @@ import os
 from chat_utils.chat_handler import text_chat_handler, asr_func, user_initiated_chat_recorder
 from chat_utils.chat_manager import ChatManager
 from user_utils.user_management import UserManager
+from models import client_stats, close_clients, scheduler_stats, retry_stats
 
 # set logging level
 logging.basicConfig(level=logging.INFO,
@@ -37,7 +38,7 @@ def send_message(user_id, message):
     :return: None
     """
     to_user_id = get_id(user_id)
-    itchat.send_msg(message, toUserName=to_user_id)
+    itchat.send_async(message, toUserName=to_user_id)
 
 
 def configuration():
@@ -69,7 +70,7 @@ def text_reply(msg):
         return
     return text_chat_handler(msg.text, user_manager, msg.user.NickName, config, 
                              user_chat = chat_manager[msg.user.NickName], 
-                             reply_func=lambda x: itchat.send(x, toUserName=msg['FromUserName']), 
+                             reply_func=lambda x: itchat.send_async(x, toUserName=msg['FromUserName']), 
                              recording=False)
 
 
@@ -77,8 +78,6 @@ def text_reply(msg):
 @itchat.msg_register([RECORDING])
 def download_files(msg):
     logging.info(f"File: {msg.user.NickName}: {msg.fileName}")
-    file_path = os.path.join('tmp', msg.fileName)
-    msg.download(file_path)
     # 判断消息类型
     typeSymbol = {
         PICTURE: 'img',
@@ -87,9 +86,13 @@ def download_files(msg):
 
     # 如果是语音消息，进行ASR处理
     if msg.type == RECORDING:
-        response = asr_func(file_path, config)
+        # 语音下载到内存后直接交给ASR，不经过tmp目录
+        voice = msg.download(None)
+        if not isinstance(voice, bytes):
+            logging.error(f"Failed to download voice message of {msg.user.NickName}: {voice}")
+            return
+        response = asr_func(voice, config, file_name=msg.fileName)
         logging.info(f"Voice Message[{msg.user.NickName}]: {response}")
-        os.remove(file_path)
         if msg['FromUserName'] == get_id(None) and (user_manager.get_user_field(msg.user.NickName, "user_type") == "owner" or user_manager.get_user_field(msg.user.NickName, "user_type") == "star"):
             # 如果主动发出的信息，不用进行处理，仅仅用于记录
             # 该功能仅对标星用户有效
@@ -97,11 +100,12 @@ def download_files(msg):
         else:
             result = text_chat_handler(response, user_manager, msg.user.NickName, config, 
                                        user_chat = chat_manager[msg.user.NickName], 
-                                       reply_func=lambda x: itchat.send(x, toUserName=msg['FromUserName']), 
+                                       reply_func=lambda x: itchat.send_async(x, toUserName=msg['FromUserName']), 
                                        recording=True)
             return result
     else:
         # 对于非语音消息，返回原处理方式
+        msg.download(os.path.join('tmp', msg.fileName))
         return '@%s@%s' % (typeSymbol, msg.fileName)
     
 
@@ -118,6 +122,11 @@ if __name__ == "__main__":
     # 登录
     itchat.auto_login(hotReload=False, enableCmdQR=2, picDir='./tmp/QRCode.png')
     itchat.run(True)
+    # 退出时打印连接复用统计并关闭共享的OpenAI客户端
+    logging.info(f"OpenAI connection stats: {client_stats()}")
+    logging.info(f"LLM scheduler stats: {scheduler_stats()}")
+    logging.info(f"LLM retry stats: {retry_stats()}")
+    close_clients()
 
     # 默认通过环境变量来配置config.ini文件路径， 默认采用./config.ini
     # export PA_CONFIG_PATH=./config_server.ini
@@ -0,0 +1,180 @@
+"""
+联系人存储的压测：构造一个有大量好友和群聊的账号（默认5000个好友、300个群），统计消息处理中常用的查询
+（search_friends / search_chatrooms / search_mps）每次调用的耗时和内存分配。
+
+对比项 deepcopy 为每次查询都深拷贝联系人（即返回只读快照之前的做法）。
+
+--memory 统计群成员列表常驻内存：每个成员一个ChatroomMember字典（ContactList）与列式存储（CompactContactList）对比。
+
+使用方法（在项目根目录下）：
+    python benchmarks/contact_benchmark.py
+    python benchmarks/contact_benchmark.py --friends 5000 --groups 300 --members 200
+    python benchmarks/contact_benchmark.py --memory --memory-members 10000
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.itchat.core import Core
+from lib.itchat.storage.templates import User, ChatroomMember, IndexedContactList, CompactContactList
+from lib.itchat.components.contact import update_local_friends, update_local_chatrooms
+
+NAMES = ["张", "李", "王", "赵", "陈", "刘", "杨", "黄", "周", "吴"]
+
+
+def contact_info(user_name, nick_name, **kwargs):
+    info = {"UserName": user_name, "NickName": nick_name, "RemarkName": "", "Alias": "", "VerifyFlag": 0,
+            "Sex": 1, "Uin": 0, "HeadImgUrl": f"/cgi-bin/mmwebwx-bin/webwxgeticon?username={user_name}",
+            "ContactFlag": 3, "Signature": "", "Province": "广东", "City": "深圳", "StarFriend": 0}
+    info.update(kwargs)
+    return info
+
+
+def build_core(friends=5000, groups=300, members=100, seed=0):
+    """
+    构造测试账号：friends个好友（其中10%为公众号），groups个群，每个群members个成员（成员来自好友）
+    """
+    rng = random.Random(seed)
+    core = Core()
+    core.loginInfo["wxuin"] = "1"
+    core.loginInfo["User"] = User(contact_info("@self", "我"))
+    core.storageClass.userName = "@self"
+    core.memberList.append(core.loginInfo["User"])
+    friend_list = [contact_info(f"@friend{i:05d}", f"{rng.choice(NAMES)}{i}", RemarkName=f"备注{i}" if i % 3 else "",
+                                VerifyFlag=8 if i % 10 == 0 else 0)
+                   for i in range(friends)]
+    update_local_friends(core, friend_list)
+    group_list = []
+    for i in range(groups):
+        member_list = [contact_info(friend["UserName"], friend["NickName"], DisplayName="", AttrStatus=0)
+                       for friend in rng.sample(friend_list, min(members, len(friend_list)))]
+        member_list.append(contact_info("@self", "我", DisplayName="", AttrStatus=0))
+        group_list.append(contact_info(f"@@group{i:04d}", f"项目群{i}", MemberList=member_list,
+                                       ChatRoomOwner=member_list[0]["UserName"], MemberCount=len(member_list)))
+    update_local_chatrooms(core, group_list)
+    return core
+
+
+def member_json(count, seed=0):
+    """
+    按 webwxbatchgetcontact 返回格式生成count个群成员的JSON，解析后每个字符串都是独立的对象
+    """
+    rng = random.Random(seed)
+    members = [{"Uin": 0, "UserName": "@" + "%064x" % rng.getrandbits(256), "NickName": f"{rng.choice(NAMES)}{i}",
+                "AttrStatus": rng.getrandbits(20), "PYInitial": "", "PYQuanPin": "", "RemarkPYInitial": "",
+                "RemarkPYQuanPin": "", "MemberStatus": 0, "DisplayName": f"群昵称{i}" if i % 4 == 0 else "",
+                "KeyWord": ""} for i in range(count)]
+    return json.dumps(members, ensure_ascii=False)
+
+
+def retained_memory(build, data):
+    """
+    :return: build(json.loads(data)) 返回的对象在释放原始数据后占用的内存（字节）
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    members = json.loads(data)
+    result = build(members)
+    del members
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def run_memory(args):
+    data = member_json(args.memory_members)
+
+    def build(contact_list_class):
+        def _build(members):
+            member_list = contact_list_class()
+            member_list.set_default_value(contactClass=ChatroomMember)
+            for member in members:
+                member_list.append(member)
+            return member_list
+        return _build
+
+    per = 10000 / args.memory_members
+    print(f"Resident memory of {args.memory_members} chatroom members (scaled to 10k members):")
+    sizes = {}
+    for name, contact_list_class in (("ContactList of dicts", IndexedContactList),
+                                     ("CompactContactList", CompactContactList)):
+        sizes[name] = retained_memory(build(contact_list_class), data)
+        print(f"{name:<24}{sizes[name] * per / 1024 / 1024:>10.2f} MB/10k members")
+    print(f"reduction: {sizes['ContactList of dicts'] / sizes['CompactContactList']:.1f}x")
+
+
+def measure(fn, calls):
+    """
+    :return: (每次调用的平均耗时（微秒）, 每次调用的平均内存分配峰值（字节）)
+    """
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = (time.perf_counter() - start) / calls * 1e6
+    tracemalloc.start()
+    peak = 0
+    for i in range(min(calls, 200)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn(i)
+        peak += tracemalloc.get_traced_memory()[1] - before
+        del result
+    tracemalloc.stop()
+    return elapsed, peak / min(calls, 200)
+
+
+def run(args):
+    print(f"Building fixture: {args.friends} friends, {args.groups} groups x {args.members} members ...")
+    core = build_core(args.friends, args.groups, args.members)
+    storage = core.storageClass
+    friends = [m["UserName"] for m in core.memberList[1:]]
+    mps = [m["UserName"] for m in core.mpList]
+    groups = [c["UserName"] for c in core.chatroomList]
+
+    def deepcopy_of(contact_list, user_names):
+        def lookup(i):
+            with storage.updateLock:
+                return copy.deepcopy(contact_list.contactIndex.get(user_names[i % len(user_names)]))
+        return lookup
+
+    cases = [
+        ("search_friends() (own account)", lambda i: core.search_friends(),
+         lambda i: copy.deepcopy(core.memberList[0])),
+        ("search_friends(userName=...)", lambda i: core.search_friends(userName=friends[i % len(friends)]),
+         deepcopy_of(core.memberList, friends)),
+        ("search_mps(userName=...)", lambda i: core.search_mps(userName=mps[i % len(mps)]),
+         deepcopy_of(core.mpList, mps)),
+        ("search_chatrooms(userName=...)", lambda i: core.search_chatrooms(userName=groups[i % len(groups)]),
+         deepcopy_of(core.chatroomList, groups)),
+    ]
+    print(f"{'lookup':<34}{'deepcopy us':>14}{'deepcopy B':>14}{'cow copy us':>14}{'cow copy B':>14}")
+    for name, lookup, baseline in cases:
+        # 预热：每个联系人的快照只在第一次查询时创建
+        for i in range(args.calls):
+            lookup(i)
+        base_time, base_bytes = measure(baseline, args.calls)
+        snap_time, snap_bytes = measure(lookup, args.calls)
+        print(f"{name:<34}{base_time:>14.1f}{base_bytes:>14.0f}{snap_time:>14.1f}{snap_bytes:>14.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Allocation benchmark of contact lookups")
+    parser.add_argument("--friends", type=int, default=5000, help="number of friends")
+    parser.add_argument("--groups", type=int, default=300, help="number of chatrooms")
+    parser.add_argument("--members", type=int, default=100, help="members per chatroom")
+    parser.add_argument("--calls", type=int, default=2000, help="lookups per case")
+    parser.add_argument("--memory", action="store_true", help="measure resident memory of chatroom members instead")
+    parser.add_argument("--memory-members", type=int, default=10000, help="members for --memory")
+    args = parser.parse_args()
+    run_memory(args) if args.memory else run(args)
@@ -0,0 +1,218 @@
+"""
+本地的OpenAI兼容服务，用于在不调用真实API的情况下测试消息处理链路的吞吐和延迟。
+
+支持：
+    POST /v1/chat/completions      JSON/文本模式，以及流式返回（SSE）
+    POST /v1/audio/transcriptions  语音识别（返回固定文本）
+
+使用方法：
+    python benchmarks/fake_openai_server.py --port 8765 --latency lognormal:0.8,0.4
+然后在config.ini中设置 [OpenAI] base_url = http://127.0.0.1:8765/v1
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_RESPONSES = {
+    "chat": [
+        "哈哈，最近挺好的，谢谢关心！你呢？",
+        "这个问题我得想一想，晚点回复你。",
+        "好的，没问题。周末有空的话一起吃个饭吧。",
+    ],
+    "meeting": {
+        "summary": "和张三讨论项目进度",
+        "start_time": "{tomorrow} 15:00",
+        "duration": 60,
+        "attendees": ["张三"],
+        "location": "腾讯会议",
+        "is_meeting": True,
+    },
+    "conversation": {"memory": "对方最近在准备项目评审", "tags": "产品经理"},
+    "transcription": "明天下午三点和张三开会讨论项目进度",
+}
+
+
+class LatencyModel:
+    """
+    延迟分布，格式为“分布:参数”（单位为秒）：
+        fixed:0.5  uniform:0.2,1.0  normal:0.8,0.2  lognormal:0.8,0.4（中位数, sigma）
+    """
+    def __init__(self, spec="fixed:0"):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p] or [0.0]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        if self.kind == "normal":
+            return max(random.gauss(self.params[0], self.params[1]), 0.0)
+        if self.kind == "lognormal":
+            median, sigma = self.params[0], self.params[1]
+            return median * random.lognormvariate(0, sigma) if median > 0 else 0.0
+        return self.params[0]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.record(self.path)
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send_json({"error": {"message": "Rate limit reached", "type": "requests"}},
+                                  status=429, headers={"retry-after-ms": str(int(server.retry_after * 1000))})
+        if self.path.endswith("/chat/completions"):
+            return self.chat_completions(json.loads(body or b"{}"))
+        if self.path.endswith("/audio/transcriptions"):
+            time.sleep(server.latency.sample())
+            return self.send_text(server.responses["transcription"])
+        self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def chat_completions(self, request):
+        server = self.server
+        content = self.render(request)
+        if not request.get("stream"):
+            time.sleep(server.latency.sample())
+            return self.send_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        # 流式返回：首个token前等待一次延迟，之后每个分片间隔chunk_delay
+        time.sleep(server.latency.sample())
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i in range(0, len(content), server.chunk_size):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": request.get("model", "fake"),
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + server.chunk_size]},
+                                  "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(server.chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def render(self, request):
+        """
+        根据请求选择固定的返回内容：JSON模式按提示语区分会议信息提取和记忆提取
+        """
+        responses = self.server.responses
+        if (request.get("response_format") or {}).get("type") != "json_object":
+            return random.choice(responses["chat"])
+        prompt = "".join(str(message.get("content", "")) for message in request.get("messages", []))
+        result = responses["meeting"] if "日程创建助理" in prompt else responses["conversation"]
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+        return json.dumps(result, ensure_ascii=False).replace("{tomorrow}", tomorrow)
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, text):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0", chunk_delay=0.02, chunk_size=4,
+                 responses=None, error_rate=0.0, retry_after=1.0):
+        """
+        :param port: 监听端口，0表示随机端口
+        :param latency: 延迟分布，见LatencyModel
+        :param chunk_delay: 流式返回时每个分片的间隔（秒）
+        :param responses: 覆盖DEFAULT_RESPONSES中的固定返回内容
+        :param error_rate: 返回429的概率，用于测试限流处理
+        """
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.latency = LatencyModel(latency)
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.thread = None
+
+    def handle_error(self, request, client_address):
+        # 客户端取消请求（如对冲请求中落后的一方）时连接会被直接关闭，不作为错误输出
+        error = sys.exc_info()[1]
+        if isinstance(error, (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def record(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self):
+        """
+        在后台线程中启动服务
+        """
+        self.thread = threading.Thread(target=self.serve_forever, name="fake-openai-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="latency distribution, see LatencyModel")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="delay between streamed chunks")
+    parser.add_argument("--responses", help="JSON file overriding the canned responses")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of answering with 429")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    responses = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+    server = FakeOpenAIServer(args.host, args.port, latency=args.latency, chunk_delay=args.chunk_delay,
+                              responses=responses, error_rate=args.error_rate)
+    logging.info(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,168 @@
+"""
+JSON 编解码的压测：对 webwxsync、webwxbatchgetcontact、webwxgetcontact 的响应体，以及发送时的请求体，
+对比原来的做法（先 decode 成 str 再 json.loads，json.dumps 后再 encode）与 jsoncodec 中各个编解码器
+每次调用消耗的 CPU 时间，并按每次 webwxsync 折算节省的 CPU。
+
+响应体默认按 --friends/--groups/--members 生成（固定随机种子，每次相同）；--save 把生成的响应体写到目录里，
+--fixtures 从目录读取响应体（每个 .json 文件一个完整的响应，比如用代理抓下来的真实响应，
+文件名以 webwxsync 开头的按 webwxsync 统计）。
+
+使用方法（在项目根目录下）：
+    python benchmarks/json_benchmark.py
+    python benchmarks/json_benchmark.py --friends 5000 --groups 50 --members 500 --messages 20
+    python benchmarks/json_benchmark.py --save benchmarks/fixtures
+    python benchmarks/json_benchmark.py --fixtures benchmarks/fixtures
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.itchat import jsoncodec
+from contact_benchmark import NAMES, contact_info
+
+BASE_RESPONSE = {"Ret": 0, "ErrMsg": ""}
+TEXTS = ["明天下午三点开会，记得带上季度报告", "收到，谢谢！", "[捂脸] 这周的周报发一下？",
+         "会议改到周五上午十点，地点不变 https://meeting.example.com/j/123456", "好的👌"]
+
+
+def sync_key(count=4):
+    return {"Count": count, "List": [{"Key": i + 1, "Val": 700000000 + i} for i in range(count)]}
+
+
+def add_msg(rng, i):
+    return {"MsgId": str(1000000000000000000 + i), "FromUserName": f"@friend{rng.randrange(5000):05d}",
+            "ToUserName": "@self", "MsgType": 1, "Content": rng.choice(TEXTS), "Status": 3, "ImgStatus": 1,
+            "CreateTime": 1700000000 + i, "VoiceLength": 0, "PlayLength": 0, "FileName": "", "FileSize": "",
+            "MediaId": "", "Url": "", "AppMsgType": 0, "StatusNotifyCode": 0, "StatusNotifyUserName": "",
+            "RecommendInfo": {"UserName": "", "NickName": "", "QQNum": 0, "Province": "", "City": "",
+                              "Content": "", "Signature": "", "Alias": "", "Scene": 0, "VerifyFlag": 0,
+                              "AttrStatus": 0, "Sex": 0, "Ticket": "", "OpCode": 0},
+            "ForwardFlag": 0, "AppInfo": {"AppID": "", "Type": 0}, "HasProductId": 0, "Ticket": "",
+            "ImgHeight": 0, "ImgWidth": 0, "SubMsgType": 0, "NewMsgId": 1000000000000000000 + i,
+            "OriContent": "", "EncryFileName": ""}
+
+
+def member(rng, i):
+    return {"Uin": 0, "UserName": f"@member{i:06d}", "NickName": f"{rng.choice(NAMES)}{i}", "AttrStatus": 0,
+            "PYInitial": "", "PYQuanPin": "", "RemarkPYInitial": "", "RemarkPYQuanPin": "", "MemberStatus": 0,
+            "DisplayName": "", "KeyWord": ""}
+
+
+def chatroom(rng, i, members):
+    return contact_info(f"@@group{i:04d}", f"项目群{i}", MemberCount=members, EncryChatRoomId=f"@{i:032x}",
+                        MemberList=[member(rng, i * members + j) for j in range(members)])
+
+
+def build_fixtures(args):
+    """
+    生成各个接口的响应体，返回 {名字: bytes}
+    """
+    rng = random.Random(0)
+    friends = [contact_info(f"@friend{i:05d}", f"{rng.choice(NAMES)}{i}", RemarkName=f"备注{i}" if i % 3 else "",
+                            Signature="每天进步一点点" if i % 4 else "")
+               for i in range(args.friends)]
+    payloads = {
+        "webwxsync": {"BaseResponse": BASE_RESPONSE, "AddMsgCount": args.messages,
+                      "AddMsgList": [add_msg(rng, i) for i in range(args.messages)],
+                      "ModContactCount": 1, "ModContactList": [chatroom(rng, 0, args.members)],
+                      "DelContactCount": 0, "DelContactList": [], "ModChatRoomMemberCount": 0,
+                      "ModChatRoomMemberList": [], "Profile": {}, "ContinueFlag": 0,
+                      "SyncKey": sync_key(), "SyncCheckKey": sync_key(), "SKey": ""},
+        "webwxbatchgetcontact": {"BaseResponse": BASE_RESPONSE, "Count": args.groups,
+                                 "ContactList": [chatroom(rng, i, args.members) for i in range(args.groups)]},
+        "webwxgetcontact": {"BaseResponse": BASE_RESPONSE, "MemberCount": args.friends,
+                            "MemberList": friends, "Seq": 0},
+    }
+    return dict((name, json.dumps(payload, ensure_ascii=False).encode("utf8"))
+                for name, payload in payloads.items())
+
+
+def load_fixtures(directory):
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "rb") as f:
+            fixtures[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return fixtures
+
+
+def save_fixtures(fixtures, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, content in fixtures.items():
+        with open(os.path.join(directory, f"{name}.json"), "wb") as f:
+            f.write(content)
+    print(f"{len(fixtures)} fixtures written to {directory}")
+
+
+def legacy_loads(content):
+    return json.loads(content.decode("utf-8", "replace"))
+
+
+def legacy_dumps(data):
+    return json.dumps(data, ensure_ascii=False).encode("utf8")
+
+
+def cpu_per_call(fn, arg, min_time):
+    """
+    反复调用直到累计 CPU 时间超过 min_time 秒，返回每次调用的 CPU 秒数
+    """
+    calls, start = 0, time.process_time()
+    while True:
+        fn(arg)
+        calls += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def sync_request():
+    return {"BaseRequest": {"Uin": 1, "Sid": "sid", "Skey": "@crypt_skey", "DeviceID": "e123456789012345"},
+            "SyncKey": sync_key(), "rr": ~int(time.time())}
+
+
+def send_request():
+    return {"BaseRequest": {"Uin": 1, "Sid": "sid", "Skey": "@crypt_skey", "DeviceID": "e123456789012345"},
+            "Msg": {"Type": 1, "Content": "明天下午三点开会，记得带上季度报告。" * 10, "FromUserName": "@self",
+                    "ToUserName": "@friend00001", "LocalID": 17000000000000, "ClientMsgId": 17000000000000},
+            "Scene": 0}
+
+
+def run(args):
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else build_fixtures(args)
+    if args.save:
+        save_fixtures(fixtures, args.save)
+    codecs = [("legacy", legacy_loads, legacy_dumps)] + \
+        [(name, loads, dumps) for name, (loads, dumps) in sorted(jsoncodec.CODECS.items())]
+    current = [name for name, _, _ in codecs].index(jsoncodec.name)
+    print(f"codec in use: {jsoncodec.name}")
+    print(f"{'payload':<28}{'KB':>10}" + "".join(f"{name + ' ms':>14}" for name, _, _ in codecs))
+    sync_saved = 0.0
+    for name, content in fixtures.items():
+        results = [cpu_per_call(loads, content, args.min_time) for _, loads, _ in codecs]
+        print(f"{'loads ' + name:<28}{len(content) / 1024:>10.1f}" + "".join(f"{t * 1000:>14.3f}" for t in results))
+        if name.startswith("webwxsync"):
+            sync_saved += results[0] - results[current]
+    for name, data in (("dumps webwxsync", sync_request()), ("dumps webwxsendmsg", send_request())):
+        results = [cpu_per_call(dumps, data, args.min_time) for _, _, dumps in codecs]
+        print(f"{name:<28}{len(legacy_dumps(data)) / 1024:>10.1f}" + "".join(f"{t * 1000:>14.3f}" for t in results))
+        if name == "dumps webwxsync":
+            sync_saved += results[0] - results[current]
+    print(f"CPU saved per webwxsync by {jsoncodec.name}: {sync_saved * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the JSON codecs on webwx payloads")
+    parser.add_argument("--friends", type=int, default=5000, help="contacts in the webwxgetcontact response")
+    parser.add_argument("--groups", type=int, default=50, help="chatrooms in the webwxbatchgetcontact response")
+    parser.add_argument("--members", type=int, default=200, help="members of each chatroom")
+    parser.add_argument("--messages", type=int, default=20, help="messages in the webwxsync response")
+    parser.add_argument("--fixtures", help="read the responses from the .json files of this directory")
+    parser.add_argument("--save", help="write the responses to this directory")
+    parser.add_argument("--min-time", type=float, default=0.5, help="CPU seconds spent on each measurement")
+    args = parser.parse_args()
+    run(args)
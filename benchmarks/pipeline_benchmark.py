@@ -0,0 +1,225 @@
+"""
+消息处理链路的端到端压测：text_chat_handler -> Chat -> analyze_chat -> 本地的OpenAI兼容服务（fake_openai_server）。
+
+模拟多个标星联系人按泊松过程发送消息（以及一定比例的语音消息），统计
+    吞吐（msgs/sec）、从收到消息到发出回复的延迟（p50/p99）以及峰值线程数。
+
+使用方法（在项目根目录下）：
+    python benchmarks/pipeline_benchmark.py --contacts 50 --messages 5 --rate 20
+    python benchmarks/pipeline_benchmark.py --contacts 200 --async-llm --stream --latency lognormal:1.0,0.5
+
+压测在临时目录中运行，使用独立的配置和用户数据库；会议邮件不会真正发送。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openai_server import FakeOpenAIServer
+
+CONFIG_TEMPLATE = """[OpenAI]
+api_key = sk-benchmark
+base_url = {base_url}
+chat_model = gpt-3.5-turbo-1106
+instruct_model = gpt-3.5-turbo-1106
+tts_model = whisper-1
+
+[WeChat]
+welcome = welcome
+help = help
+owner_key = owner
+star_key = star
+
+[Assistant]
+assistant_description = benchmark assistant
+chat_lifespan = {chat_lifespan}
+delay_time = 0
+async_llm = {async_llm}
+stream_reply = {stream}
+
+[UserManagement]
+user_db_path = {workdir}/users.db
+owner = owner
+
+[Cache]
+meeting_cache_path = {workdir}/meeting_cache.db
+
+[Email]
+sender_email = benchmark@example.com
+sender_password = benchmark
+
+[Connection]
+"""
+
+MESSAGES = [
+    "最近怎么样？", "周末有什么安排吗", "上次说的那本书我看完了", "哈哈哈太好笑了",
+    "你觉得这个方案可行吗？", "今天好累啊", "晚上吃什么好呢", "下次一起去爬山吧",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class ReplyTracker:
+    """
+    记录每个联系人尚未得到回复的消息，收到回复时计算这些消息的延迟（多条消息可能合并为一次回复）
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.latencies = []
+        self.replies = 0
+        self.done = threading.Condition(self.lock)
+
+    def sent(self, contact):
+        with self.lock:
+            self.pending.setdefault(contact, []).append(time.monotonic())
+
+    def replied(self, contact):
+        now = time.monotonic()
+        with self.lock:
+            self.replies += 1
+            self.latencies.extend(now - sent for sent in self.pending.pop(contact, []))
+            self.done.notify_all()
+
+    def wait(self, total, timeout):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while len(self.latencies) < total and time.monotonic() < deadline:
+                self.done.wait(0.1)
+            return len(self.latencies)
+
+
+class ThreadMonitor:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run(args):
+    server = FakeOpenAIServer(latency=args.latency, chunk_delay=args.chunk_delay,
+                              error_rate=args.error_rate, retry_after=0.5).start()
+    workdir = tempfile.mkdtemp(prefix="calagent-benchmark-")
+    config_path = os.path.join(workdir, "config.ini")
+    with open(config_path, "w", encoding="utf-8") as f:
+        f.write(CONFIG_TEMPLATE.format(base_url=server.base_url, chat_lifespan=args.chat_lifespan,
+                                       async_llm=str(args.async_llm).lower(), stream=str(args.stream).lower(),
+                                       workdir=workdir))
+    # 各模块在导入时读取配置，因此需要先设置配置路径
+    os.environ["PA_CONFIG_PATH"] = config_path
+    os.chdir(workdir)
+    os.makedirs("tmp", exist_ok=True)
+
+    import configparser
+    from chat_utils import chat_handler
+    from chat_utils.chat_handler import text_chat_handler, asr_func
+    from chat_utils.chat_manager import ChatManager
+    from user_utils.user_management import UserManager
+    from models import client_stats, close_clients, scheduler_stats
+
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    # 压测时不真正发送会议邮件
+    chat_handler.send_email = lambda *a, **kw: "Email skipped in benchmark."
+
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding="utf-8")
+    user_manager = UserManager(config["UserManagement"]["user_db_path"], owner_id=config["UserManagement"]["owner"])
+    contacts = [f"contact-{i}" for i in range(args.contacts)]
+    for contact in contacts:
+        user_manager.set_user_field(contact, "user_type", "star")
+    chat_manager = ChatManager(config, user_manager, chat_lifespan=args.chat_lifespan)
+    # 与app.download_files一样，语音以bytes形式交给ASR
+    voice = b"\x00" * 1024
+
+    tracker = ReplyTracker()
+    monitor = ThreadMonitor().start()
+    baseline_threads = threading.active_count()
+    total = args.contacts * args.messages
+    schedule = [contact for contact in contacts for _ in range(args.messages)]
+    random.shuffle(schedule)
+    voice_messages = 0
+
+    start = time.monotonic()
+    # 与itchat一样，在单个接收线程中依次调用消息处理函数
+    for contact in schedule:
+        recording = random.random() < args.voice_ratio
+        if recording:
+            voice_messages += 1
+            text = asr_func(voice, config)
+        else:
+            text = random.choice(MESSAGES)
+        tracker.sent(contact)
+        # 语音中的会议信息会直接返回结果，与普通回复一样计入延迟
+        result = text_chat_handler(text, user_manager, contact, config,
+                                   user_chat=chat_manager[contact],
+                                   reply_func=lambda x, contact=contact: tracker.replied(contact),
+                                   recording=recording)
+        if result:
+            tracker.replied(contact)
+        if args.rate:
+            time.sleep(random.expovariate(args.rate))
+    sent_elapsed = time.monotonic() - start
+    replied = tracker.wait(total, args.timeout)
+    elapsed = time.monotonic() - start
+    monitor.stop()
+
+    latencies = tracker.latencies
+    print(f"Mode: {'async' if args.async_llm else 'threads'}{' + stream' if args.stream else ''}, "
+          f"latency: {args.latency}")
+    print(f"Contacts: {args.contacts}, messages: {total} (voice: {voice_messages}), "
+          f"replies: {tracker.replies}, answered: {replied}/{total}")
+    print(f"Send phase: {sent_elapsed:.2f}s, total: {elapsed:.2f}s, throughput: {replied / elapsed:.1f} msgs/sec")
+    print(f"Reply latency: p50 {percentile(latencies, 50):.3f}s, p99 {percentile(latencies, 99):.3f}s, "
+          f"max {max(latencies, default=0):.3f}s")
+    print(f"Threads: baseline {baseline_threads}, peak {monitor.peak}")
+    print(f"Fake server requests: {server.requests}")
+    print(f"Scheduler: {scheduler_stats()}")
+    if args.verbose:
+        print(f"Connections: {client_stats()}")
+    # 等待聊天过期（过期时会调用模型提取记忆），再关闭服务
+    deadline = time.monotonic() + args.chat_lifespan + args.timeout
+    while chat_manager.active_chats and time.monotonic() < deadline:
+        time.sleep(0.5)
+    close_clients()
+    server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the message pipeline")
+    parser.add_argument("--contacts", type=int, default=20, help="number of star contacts")
+    parser.add_argument("--messages", type=int, default=3, help="messages per contact")
+    parser.add_argument("--rate", type=float, default=50.0, help="arrival rate in msgs/sec (0: as fast as possible)")
+    parser.add_argument("--voice-ratio", type=float, default=0.0, help="fraction of voice messages")
+    parser.add_argument("--latency", default="lognormal:0.5,0.3", help="fake server latency distribution")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--async-llm", action="store_true", help="use the shared event loop instead of threads")
+    parser.add_argument("--stream", action="store_true", help="stream replies sentence by sentence")
+    parser.add_argument("--chat-lifespan", type=int, default=5, help="chat lifespan in seconds")
+    parser.add_argument("--timeout", type=float, default=120.0, help="max seconds to wait for replies")
+    parser.add_argument("--verbose", action="store_true")
+    run(parser.parse_args())
@@ -0,0 +1,165 @@
+"""
+文件上传的压测：在本地启动一个模拟 webwxuploadmedia 的服务（每个分片固定延迟，可按比例随机失败），
+用 itchat 的 upload_file 上传一个测试文件，对比逐个分片上传（--workers 1）与并发上传的耗时。
+
+--fail-rate 让服务随机拒绝分片，用于观察分片重试；--resume 先让上传在中途失败，再上传同一个文件，
+验证只补传未确认的分片。
+
+使用方法（在项目根目录下）：
+    python benchmarks/upload_benchmark.py
+    python benchmarks/upload_benchmark.py --size-mb 20 --latency 0.1 --workers 1 4 8
+    python benchmarks/upload_benchmark.py --fail-rate 0.1
+    python benchmarks/upload_benchmark.py --resume
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.itchat import config
+from lib.itchat.core import Core
+from lib.itchat.components import messages
+
+
+class UploadServer:
+    """
+    模拟 webwxuploadmedia：收齐所有分片后，最后一个分片的返回中带 MediaId
+    """
+    def __init__(self, latency=0.05, fail_rate=0.0, fail_after=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_after = fail_after  # 收到这么多个分片后拒绝所有请求
+        self.lock = threading.Lock()
+        self.received = 0
+        self.rejected = 0
+        self.chunks = {}  # ClientMediaId -> 已收到的分片
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(server.latency)
+                self.reply(server.handle(body))
+
+            def reply(self, result):
+                data = json.dumps(result).encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @staticmethod
+    def field(body, name):
+        marker = f'name="{name}"\r\n\r\n'.encode()
+        start = body.find(marker)
+        if start < 0:
+            return None
+        start += len(marker)
+        return body[start:body.find(b"\r\n", start)].decode("utf8")
+
+    def handle(self, body):
+        with self.lock:
+            if (self.fail_after is not None and self.received >= self.fail_after) or \
+                    random.random() < self.fail_rate:
+                self.rejected += 1
+                return {"BaseResponse": {"Ret": 1, "ErrMsg": "busy"}, "MediaId": ""}
+            self.received += 1
+            request = json.loads(self.field(body, "uploadmediarequest"))
+            chunk, chunks = int(self.field(body, "chunk") or 0), int(self.field(body, "chunks") or 1)
+            received = self.chunks.setdefault(request["ClientMediaId"], set())
+            received.add(chunk)
+            if len(received) < chunks:
+                return {"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MediaId": ""}
+            return {"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MediaId": f"@crypt_{request['ClientMediaId']}"}
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def build_core(url):
+    core = Core()
+    core.loginInfo.update({"url": url, "fileUrl": url, "pass_ticket": "ticket",
+                           "BaseRequest": {"Uin": 1, "Sid": "sid", "Skey": "skey", "DeviceID": "e1"}})
+    core.storageClass.userName = "@self"
+    core.s.cookies.set("webwx_data_ticket", "data_ticket")
+    return core
+
+
+def make_file(size_mb):
+    f = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    f.write(os.urandom(int(size_mb * 1024 * 1024)))
+    f.close()
+    return f.name
+
+
+def run_upload(core, path):
+    start = time.perf_counter()
+    r = core.upload_file(path)
+    return r, time.perf_counter() - start
+
+
+def run(args):
+    path = make_file(args.size_mb)
+    chunks = int((os.path.getsize(path) - 1) / messages.CHUNK_SIZE) + 1
+    print(f"Uploading {args.size_mb}MB ({chunks} chunks), {args.latency * 1000:.0f}ms per chunk, "
+          f"fail rate {args.fail_rate:.0%}")
+    print(f"{'workers':>8}{'seconds':>10}{'MB/s':>10}{'rejected':>10}  result")
+    try:
+        for workers in args.workers:
+            config.UPLOAD_WORKERS = workers
+            server = UploadServer(args.latency, args.fail_rate).start()
+            r, elapsed = run_upload(build_core(server.url), path)
+            print(f"{workers:>8}{elapsed:>10.2f}{args.size_mb / elapsed:>10.1f}{server.rejected:>10}  "
+                  f"{r.get('MediaId') or r['BaseResponse']['RawMsg']}")
+            server.stop()
+    finally:
+        os.remove(path)
+
+
+def run_resume(args):
+    path = make_file(args.size_mb)
+    chunks = int((os.path.getsize(path) - 1) / messages.CHUNK_SIZE) + 1
+    config.UPLOAD_WORKERS, config.UPLOAD_RETRIES = args.workers[-1], 0
+    server = UploadServer(args.latency, fail_after=chunks // 2).start()
+    core = build_core(server.url)
+    try:
+        r, elapsed = run_upload(core, path)
+        print(f"first upload failed after {server.received} of {chunks} chunks in {elapsed:.2f}s: "
+              f"{r['BaseResponse']['RawMsg']}")
+        server.fail_after, received = None, server.received
+        r, elapsed = run_upload(core, path)
+        print(f"resumed upload sent {server.received - received} chunks in {elapsed:.2f}s: {r.get('MediaId')}")
+    finally:
+        server.stop()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of chunked file upload against a local server")
+    parser.add_argument("--size-mb", type=float, default=20, help="size of the uploaded file")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the server takes per chunk")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="UPLOAD_WORKERS to compare")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of chunks the server rejects")
+    parser.add_argument("--resume", action="store_true", help="fail an upload halfway and resume it")
+    args = parser.parse_args()
+    run_resume(args) if args.resume else run(args)
@@ -1,118 +1,383 @@
 import configparser
-from openai import OpenAI
+import asyncio
 import json
+import re
 from datetime import datetime, timedelta
 import pytz
-import httpx
 import os
+import time
+import itertools
 import logging
+from openai import RateLimitError
+
+from models import openai_client as shared_openai_client
+from models import async_openai_client as shared_async_openai_client
+from models import async_twin
+from models import run_coroutine
+from models.event_loop import event_loop
+from models.scheduler import get_scheduler, INTERACTIVE, MEETING, BACKGROUND
+from models.retry import get_retry_policy, RETRYABLE_ERRORS
+from models.tokenizer import count_message_tokens
+from utils.time_parser import parse_time_expression
 
 
 config_file_path = os.getenv('PA_CONFIG_PATH', './config.ini')
 config = configparser.ConfigParser()
 config.read(config_file_path, encoding='utf-8')
 
+# 调度器按此预留回复的token数
+COMPLETION_TOKENS = 256
+# 滚动总结作为系统消息发送给模型，以此前缀与系统提示区分
+SUMMARY_PREFIX = "此前的聊天总结："
+
+class SentenceSplitter:
+    """
+    将流式返回的文本按句子切分（支持中英文标点），每得到一个完整的句子即可发送
+    """
+    # 中文句末标点及换行直接断句；英文句号后需跟空白，避免把小数、网址等切开
+    BOUNDARY = re.compile(r'(?:[。！？；!?;…\n]+|\.(?=\s))[”’"\'）)]*')
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """
+        追加新的文本片段
+        :param text: 模型返回的增量文本
+        :return: 已经完整的句子列表
+        """
+        self.buffer += text
+        segments = []
+        start = 0
+        for match in self.BOUNDARY.finditer(self.buffer):
+            segment = self.buffer[start:match.end()].strip()
+            if segment:
+                segments.append(segment)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return segments
+
+    def flush(self):
+        """
+        返回缓冲区中剩余的（没有句末标点的）文本
+        """
+        segment, self.buffer = self.buffer.strip(), ""
+        return segment
+
+def estimate_tokens(chat_content, chat_model):
+    """
+    估算一次调用消耗的token数（提示语 + 预留的回复长度），用于调度器的TPM限制
+    """
+    return sum(count_message_tokens(message, chat_model) for message in chat_content) + COMPLETION_TOKENS
+
 def analyze_chat(chat_content, 
                  openai_client=None, 
                  chat_model="gpt-3.5-turbo-1106", 
-                 response_format="text"):
+                 response_format="text",
+                 stream=False,
+                 on_segment=None,
+                 priority=INTERACTIVE):
     """
     调用ChatGPT API分析聊天记录，并提取关键信息
     :param chat_content: 聊天内容的字符串
+    :param stream: 是否使用流式返回，流式返回时每生成一个完整句子就调用一次on_segment
+    :param on_segment: 流式模式下处理单个句子的函数（如发送微信消息）
+    :param priority: 调度优先级（INTERACTIVE/MEETING/BACKGROUND），同时决定调用的时间预算，见models.retry
     :return: 一个包含提取出的关键信息的字典
     """
+    policy = get_retry_policy(config)
+    deadline = policy.deadline(priority)
     if not openai_client:
-        if config["Connection"].get("http_port", None):
-            if config["Connection"].get("proxy_username", None):
-                http_proxy = f"http://{config['Connection']['proxy_username']}:{config['Connection']['proxy_password']}@{config['Connection']['proxy']}:{config['Connection']['http_port']}"
-            else:
-                http_proxy = f"http://{config['Connection']['proxy']}:{config['Connection']['http_port']}"
-            httpx_client = httpx.Client(proxies={"http://": http_proxy, "https://": http_proxy})
-        else:
-            httpx_client = None
-        openai_client = OpenAI(api_key=config["OpenAI"]["api_key"], http_client=httpx_client)
+        openai_client = shared_openai_client(config)
+    if policy.hedge_delay(chat_model, priority, stream) is not None and not event_loop.in_loop():
+        # 对冲请求需要能取消落后的请求，因此交给共享事件循环执行，
+        # 使用与openai_client配置相同的异步客户端和同一个时间预算；没有对应的异步客户端时不对冲
+        async_client = async_twin(openai_client)
+        if async_client is not None:
+            return run_coroutine(analyze_chat_async(chat_content, openai_client=async_client, chat_model=chat_model, 
+                                                    response_format=response_format, priority=priority, 
+                                                    deadline=deadline)).result()
+    # 重试由调度器和重试策略统一处理，以便429时暂停同一模型的其他请求
+    openai_client = openai_client.with_options(max_retries=0)
+    scheduler = get_scheduler(config)
+    tokens = estimate_tokens(chat_content, chat_model)
+    emitted = []
+
+    def emit(segment):
+        emitted.append(segment)
+        on_segment(segment)
 
-    # Check https://platform.openai.com/docs/models/gpt-3-5 for most updated model name
-    completion = openai_client.chat.completions.create(
-        model=chat_model,
-        messages=chat_content,
-        timeout=60,
-        response_format= {"type":response_format}
-    )
+    for attempt in itertools.count():
+        try:
+            with scheduler.slot(chat_model, priority, tokens, timeout=deadline.remaining()):
+                start = time.monotonic()
+                # Check https://platform.openai.com/docs/models/gpt-3-5 for most updated model name
+                completion = openai_client.chat.completions.create(
+                    model=chat_model,
+                    messages=chat_content,
+                    timeout=deadline.remaining(),
+                    response_format= {"type":response_format},
+                    stream=stream
+                )
+                if not stream:
+                    policy.record(chat_model, priority, time.monotonic() - start)
+                    text = completion.choices[0].message.content
+                    return text
+                return consume_stream(completion, emit)
+        except RETRYABLE_ERRORS as e:
+            # 已经发出部分句子的流式回复不能重试，否则对方会收到重复的内容
+            delay = None if emitted else policy.retry_delay(e, attempt, deadline)
+            if delay is None:
+                raise
+            if isinstance(e, RateLimitError):
+                scheduler.rate_limited_for(chat_model, delay)
+            else:
+                logging.warning(f"Chat completion failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
 
-    text = completion.choices[0].message.content
-    return text
+def consume_stream(completion, on_segment):
+    # 流式返回：按句子切分后立即发送，最终返回完整文本用于记录聊天历史
+    splitter = SentenceSplitter()
+    pieces = []
+    for chunk in completion:
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        pieces.append(chunk.choices[0].delta.content)
+        for segment in splitter.feed(chunk.choices[0].delta.content):
+            on_segment(segment)
+    segment = splitter.flush()
+    if segment:
+        on_segment(segment)
+    return "".join(pieces)
 
-def analyze_meeting_chat(chat_content, openai_client=None, chat_model="gpt-3.5-turbo-1106"):
+async def analyze_chat_async(chat_content, 
+                             openai_client=None, 
+                             chat_model="gpt-3.5-turbo-1106", 
+                             response_format="text",
+                             stream=False,
+                             on_segment=None,
+                             priority=INTERACTIVE,
+                             deadline=None):
     """
-    调用ChatGPT API分析聊天记录，并提取关键信息
+    analyze_chat的异步版本，需在共享事件循环（models.event_loop）中执行
     :param chat_content: 聊天内容的字符串
+    :param stream: 是否使用流式返回
+    :param on_segment: 流式模式下处理单个句子的（同步）函数，在线程池中按顺序执行
+    :param priority: 调度优先级（INTERACTIVE/MEETING/BACKGROUND），同时决定调用的时间预算，见models.retry
+    :param deadline: 调用的时间预算（models.retry.Deadline），默认按priority新建
+    :return: 模型返回的文本
+    """
+    if not openai_client:
+        openai_client = shared_async_openai_client(config)
+    openai_client = openai_client.with_options(max_retries=0)
+    scheduler = get_scheduler(config)
+    policy = get_retry_policy(config)
+    tokens = estimate_tokens(chat_content, chat_model)
+    if deadline is None:
+        deadline = policy.deadline(priority)
+    emitted = []
+
+    def emit(segment):
+        emitted.append(segment)
+        on_segment(segment)
+
+    async def request():
+        async with scheduler.slot_async(chat_model, priority, tokens, timeout=deadline.remaining()):
+            start = time.monotonic()
+            completion = await openai_client.chat.completions.create(
+                model=chat_model,
+                messages=chat_content,
+                timeout=deadline.remaining(),
+                response_format= {"type":response_format},
+                stream=stream
+            )
+            if not stream:
+                policy.record(chat_model, priority, time.monotonic() - start)
+                text = completion.choices[0].message.content
+                return text
+            return await consume_stream_async(completion, emit)
+
+    for attempt in itertools.count():
+        try:
+            hedge_delay = policy.hedge_delay(chat_model, priority, stream)
+            if hedge_delay is None:
+                return await request()
+            return await policy.hedged(request, hedge_delay)
+        except RETRYABLE_ERRORS as e:
+            delay = None if emitted else policy.retry_delay(e, attempt, deadline)
+            if delay is None:
+                raise
+            if isinstance(e, RateLimitError):
+                scheduler.rate_limited_for(chat_model, delay)
+            else:
+                logging.warning(f"Chat completion failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+async def consume_stream_async(completion, on_segment):
+    loop = asyncio.get_running_loop()
+    splitter = SentenceSplitter()
+    pieces = []
+    async for chunk in completion:
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        pieces.append(chunk.choices[0].delta.content)
+        for segment in splitter.feed(chunk.choices[0].delta.content):
+            await loop.run_in_executor(None, on_segment, segment)
+    segment = splitter.flush()
+    if segment:
+        await loop.run_in_executor(None, on_segment, segment)
+    return "".join(pieces)
+
+def generate_meeting_assistant_prompt(chat_content, resolved_time=None):
+    """
+    根据聊天内容生成适合ChatGPT的提示语
+    :param chat_content: 原始的聊天内容字符串
+    :param resolved_time: 本地解析出的开始时间（datetime），提供时不再需要模型推算日期
+    :return: 生成的提示语
+    """
+    now = datetime.now()
+    date_time_str = now.strftime("%Y-%m-%d %H:%M:%S") + " " + now.strftime("%A")
+    if resolved_time is not None:
+        start_time_rule = f'"start_time": （开始时间已解析为 {resolved_time.strftime("%Y-%m-%d %H:%M")}，请直接输出该值）,'
+    else:
+        start_time_rule = '"start_time": （提取开始时间，格式为YYYY-MM-DD HH:MM; 如果时间没有具体到小时和分钟，则假定为当天的9:00; 如果收到信息的时间是凌晨0点到4点之间，且聊天中使用例如"明天/后天"这样的相对日期，则默认将时间提前一天）,'
+
+    return f"你作为日程创建助理，根据提供的聊天记录提取会议的关键信息用于日程创建，请注意当前收到信息的时间是 {date_time_str}, 以JSON格式输出会议信息，请不要脑补聊天记录中没有的信息。\n\n" + """期望的输出格式如下：{
+        "summary": （根据聊天内容提取日程/提醒的主题，需要包含【参与对象】、【做什么事】等，例如“和XXX一起做XXX”或者“XX小组讨论会”等， 如果不涉及则返回空）,
+        """ + start_time_rule + """
+        "duration": （持续时长，单位为分钟，如果没有说明时间，则根据类别选择，会议默认为60分钟、吃饭等娱乐活动默认2小时、提醒则默认为15分钟）,
+        "attendees": （参会者，所有提到的名字、邮箱都被列为参会者，不用包含自己）,
+        "location": （参会地址或者所用会议工具，如Zoom（包含会议号或链接）、腾讯会议（包含会议号或链接）、微信语音、电话号码（包含电话号码）等，如果未提及，则输出'待定'）,
+        "is_meeting": （根据聊天判断是否可以需要预定日程或者设置提醒，满足其一则返回True，否则返回False),
+        }\n
+        """ + f"聊天记录为: \n{chat_content}\n请输出："
+
+def parse_meeting_info(text, chat_content=None, received_time=None):
+    """
+    解析ChatGPT返回的文本，提取关键信息
+    :param text: ChatGPT返回的文本
+    :param chat_content: 原始的聊天内容，提供时用本地解析的时间校验模型给出的开始时间和时长
+    :param received_time: 收到消息的时间，默认为当前时间
     :return: 一个包含提取出的关键信息的字典
     """
-    def generate_meeting_assistant_prompt(chat_content):
-        """
-        根据聊天内容生成适合ChatGPT的提示语
-        :param chat_content: 原始的聊天内容字符串
-        :return: 生成的提示语
-        """
-        now = datetime.now()
-        date_time_str = now.strftime("%Y-%m-%d %H:%M:%S") + " " + now.strftime("%A")
-
-        return f"你作为日程创建助理，根据提供的聊天记录提取会议的关键信息用于日程创建，请注意当前收到信息的时间是 {date_time_str}, 以JSON格式输出会议信息，请不要脑补聊天记录中没有的信息。\n\n" + """期望的输出格式如下：{
-            "summary": （根据聊天内容提取日程/提醒的主题，需要包含【参与对象】、【做什么事】等，例如“和XXX一起做XXX”或者“XX小组讨论会”等， 如果不涉及则返回空）,
-            "start_time": （提取开始时间，格式为YYYY-MM-DD HH:MM; 如果时间没有具体到小时和分钟，则假定为当天的9:00; 如果收到信息的时间是凌晨0点到4点之间，且聊天中使用例如"明天/后天"这样的相对日期，则默认将时间提前一天）,
-            "duration": （持续时长，单位为分钟，如果没有说明时间，则根据类别选择，会议默认为60分钟、吃饭等娱乐活动默认2小时、提醒则默认为15分钟）,
-            "attendees": （参会者，所有提到的名字、邮箱都被列为参会者，不用包含自己）,
-            "location": （参会地址或者所用会议工具，如Zoom（包含会议号或链接）、腾讯会议（包含会议号或链接）、微信语音、电话号码（包含电话号码）等，如果未提及，则输出'待定'）,
-            "is_meeting": （根据聊天判断是否可以需要预定日程或者设置提醒，满足其一则返回True，否则返回False),
-            }\n
-            """ + f"聊天记录为: \n{chat_content}\n请输出："
+    info = json.loads(text)
+    local = parse_time_expression(chat_content, received_time) if chat_content else None
+    try:
+        start_time = datetime.strptime(str(info.get("start_time")), "%Y-%m-%d %H:%M")
+    except ValueError:
+        start_time = None
+    # 本地解析没有歧义（只提到一个日期和时间，且说明了上午还是下午）时才以本地为准，否则保留模型的结果
+    local_start = local["start_time"] if local and not local["ambiguous"] else None
+    if local_start and (start_time is None or local["time_resolved"] and local_start != start_time):
+        logging.info(f"Meeting start time corrected by local parser: {info.get('start_time')} -> {local['start_time']}")
+        start_time = local["start_time"]
+    if start_time is None:
+        raise ValueError(f"Invalid meeting start time: {info.get('start_time')}")
+    info["start_time"] = start_time
+    if local and local["duration"] and not local["duration_ambiguous"] and local["duration"] != info.get("duration"):
+        logging.info(f"Meeting duration corrected by local parser: {info.get('duration')} -> {local['duration']}")
+        info["duration"] = local["duration"]
+    # # 如果是凌晨4点之前，则在开始时间上提前一天
+    # if datetime.now().hour < 4:
+    #     info["start_time"] = info["start_time"] - timedelta(days=1)
+    # 如果开始时间晚于当前时间，则选择当前时间后1一小时的整点开始
+    if info["start_time"] < datetime.now():
+        info["start_time"] = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
     
-    chat_content = [{"role": "user", "content": generate_meeting_assistant_prompt(chat_content)}]
-    text = analyze_chat(chat_content, 
-                        openai_client=openai_client, 
-                        chat_model=chat_model, 
-                        response_format="json_object")
-    def parse_info(text):
-        """
-        解析ChatGPT返回的文本，提取关键信息
-        :param text: ChatGPT返回的文本
-        :return: 一个包含提取出的关键信息的字典
-        """
-        info = json.loads(text)
-        info["start_time"] = datetime.strptime(info["start_time"], "%Y-%m-%d %H:%M")
-        # # 如果是凌晨4点之前，则在开始时间上提前一天
-        # if datetime.now().hour < 4:
-        #     info["start_time"] = info["start_time"] - timedelta(days=1)
-        # 如果开始时间晚于当前时间，则选择当前时间后1一小时的整点开始
-        if info["start_time"] < datetime.now():
-            info["start_time"] = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
-        
-        ## 指定为国内时区（未来增加时区感知）
-        ## 标准做法是"Asia/Shanghai"，如果使用"UTC+8"，则在识别上会有问题（也有夏令时的问题）
-        tz_utc_8 = pytz.timezone('Asia/Shanghai')
-        info["start_time"] = info["start_time"].replace(tzinfo=tz_utc_8)
-        info["duration"] = timedelta(minutes=info["duration"])
-        info["body"] = text
-        return info
+    ## 指定为国内时区（未来增加时区感知）
+    ## 标准做法是"Asia/Shanghai"，如果使用"UTC+8"，则在识别上会有问题（也有夏令时的问题）
+    tz_utc_8 = pytz.timezone('Asia/Shanghai')
+    info["start_time"] = info["start_time"].replace(tzinfo=tz_utc_8)
+    info["duration"] = timedelta(minutes=info["duration"])
+    info["body"] = text
+    return info
+
+def meeting_request(chat_content, chat_model, lite_model=None):
+    """
+    生成会议信息提取的请求：本地已解析出开始时间时使用更短的提示语，并可改用更轻量的模型
+    :return: (提示消息列表, 使用的模型)
+    """
+    resolved = parse_time_expression(chat_content)
+    resolved_time = resolved["start_time"] if resolved["time_resolved"] and not resolved["ambiguous"] else None
+    if resolved_time is not None and lite_model:
+        chat_model = lite_model
+    prompt = generate_meeting_assistant_prompt(chat_content, resolved_time)
+    return [{"role": "user", "content": prompt}], chat_model
 
+def analyze_meeting_chat(chat_content, openai_client=None, chat_model="gpt-3.5-turbo-1106", cache=None, lite_model=None):
+    """
+    调用ChatGPT API分析聊天记录，并提取关键信息
+    :param chat_content: 聊天内容的字符串
+    :param cache: 会议信息缓存（MeetingCache），命中时不再调用模型
+    :param lite_model: 本地已解析出开始时间时使用的轻量模型，不提供则使用chat_model
+    :return: 一个包含提取出的关键信息的字典
+    """
+    # 缓存键使用实际调用的模型（本地解析出时间时可能是lite_model），不同模型的结果互不混用
+    messages, model = meeting_request(chat_content, chat_model, lite_model)
+    cache_key = cache.make_key(chat_content, model) if cache else None
+    text = cache.get(cache_key) if cache else None
+    if text is None:
+        text = analyze_chat(messages, 
+                            openai_client=openai_client, 
+                            chat_model=model, 
+                            response_format="json_object", 
+                            priority=MEETING)
+        if cache:
+            cache.set(cache_key, text)
+    else:
+        logging.info(f"Meeting cache hit: {cache.stats()}")
     # 解析text以提取需要的信息
-    info = parse_info(text)
+    info = parse_meeting_info(text, chat_content)
     return info
 
-def analyze_conversation(conversation_history: list, 
-                         user_tags: list,
-                         openai_client=None, 
-                         chat_model="gpt-3.5-turbo-1106") -> dict:
+async def analyze_meeting_chat_async(chat_content, openai_client=None, chat_model="gpt-3.5-turbo-1106", cache=None, lite_model=None):
     """
-    分析本轮聊天历史记录，分析是否有关于聊天对象的重要记忆或对于聊天对象的新的认知（标签）
+    analyze_meeting_chat的异步版本
+    :param chat_content: 聊天内容的字符串
+    :param cache: 会议信息缓存（MeetingCache），命中时不再调用模型
+    :param lite_model: 本地已解析出开始时间时使用的轻量模型，不提供则使用chat_model
+    :return: 一个包含提取出的关键信息的字典
+    """
+    # 缓存键使用实际调用的模型（本地解析出时间时可能是lite_model），不同模型的结果互不混用
+    messages, model = meeting_request(chat_content, chat_model, lite_model)
+    cache_key = cache.make_key(chat_content, model) if cache else None
+    text = cache.get(cache_key) if cache else None
+    if text is None:
+        text = await analyze_chat_async(messages, 
+                                        openai_client=openai_client, 
+                                        chat_model=model, 
+                                        response_format="json_object", 
+                                        priority=MEETING)
+        if cache:
+            cache.set(cache_key, text)
+    else:
+        logging.info(f"Meeting cache hit: {cache.stats()}")
+    return parse_meeting_info(text, chat_content)
+
+def format_conversation(messages: list):
+    """
+    将聊天记录转换为提示语中的文本：去掉系统提示，滚动总结以summary的身份保留
+    :param messages: list 聊天记录，可以包含get_history返回的系统提示和滚动总结
+    :return: 每行一条消息的文本
+    """
+    lines = []
+    for item in messages:
+        if item["role"] != "system":
+            lines.append(f"{item['role']}: {item['content']}")
+        elif item["content"].startswith(SUMMARY_PREFIX):
+            lines.append(f"summary: {item['content'][len(SUMMARY_PREFIX):]}")
+    return "\n".join(lines)
+
+def generate_conversation_prompt(conversation_history: list, user_tags: list):
+    """
+    根据本轮聊天历史记录及已有的用户标签生成记忆提取的提示语
     :param conversation_history: list 聊天历史记录
     :param user_tags: list 用户标签
-    :return: 一个包含提取出的关键信息的字典
+    :return: 生成的提示语
     """
     now = datetime.now()
     date_time_str = now.strftime("%Y-%m-%d %H:%M:%S") + " " + now.strftime("%A")
-    conversation_history = "\n".join([f"{item['role']}: {item['content']}" for item in conversation_history if item['role'] != "system"])
+    conversation_history = format_conversation(conversation_history)
     user_tags = ", ".join(user_tags)
     logging.debug(f"Conversation history: \n{conversation_history}")
     prompt = f"当前时间为：{date_time_str} 请根据提供的聊天记录，从聊天中提取跟聊天对象(user)的重要信息，请不要补充聊天记录中没有提及的信息，但可以根据聊天记录推测user的标签。你的身份是assistant。\n\n" \
@@ -126,13 +391,84 @@ def analyze_conversation(conversation_history: list,
     else:
         prompt += "请输出："
     logging.debug(f"Conversation history: \n{prompt}")
-    chat_content = [{"role": "user", "content": prompt}]
+    return prompt
+
+def analyze_conversation(conversation_history: list, 
+                         user_tags: list,
+                         openai_client=None, 
+                         chat_model="gpt-3.5-turbo-1106") -> dict:
+    """
+    分析本轮聊天历史记录，分析是否有关于聊天对象的重要记忆或对于聊天对象的新的认知（标签）
+    :param conversation_history: list 聊天历史记录
+    :param user_tags: list 用户标签
+    :return: 一个包含提取出的关键信息的字典
+    """
+    chat_content = [{"role": "user", "content": generate_conversation_prompt(conversation_history, user_tags)}]
     conversation_summary = analyze_chat(chat_content, 
                         openai_client=openai_client, 
                         chat_model=chat_model, 
-                        response_format="json_object")
+                        response_format="json_object", 
+                        priority=BACKGROUND)
+    return json.loads(conversation_summary)
+
+async def analyze_conversation_async(conversation_history: list, 
+                                     user_tags: list,
+                                     openai_client=None, 
+                                     chat_model="gpt-3.5-turbo-1106") -> dict:
+    """
+    analyze_conversation的异步版本
+    :param conversation_history: list 聊天历史记录
+    :param user_tags: list 用户标签
+    :return: 一个包含提取出的关键信息的字典
+    """
+    chat_content = [{"role": "user", "content": generate_conversation_prompt(conversation_history, user_tags)}]
+    conversation_summary = await analyze_chat_async(chat_content, 
+                                                    openai_client=openai_client, 
+                                                    chat_model=chat_model, 
+                                                    response_format="json_object", 
+                                                    priority=BACKGROUND)
     return json.loads(conversation_summary)
 
+def generate_history_summary_prompt(summary, messages: list):
+    """
+    生成滚动总结的提示语：把较早的聊天记录合并进已有的总结中
+    :param summary: 已有的总结，没有时为None
+    :param messages: list 需要合并进总结的聊天记录
+    :return: 生成的提示语
+    """
+    conversation_history = format_conversation(messages)
+    prompt = "请将以下聊天记录合并进已有的聊天总结中，保留聊天对象(user)提到的事实、请求、约定和尚未解决的问题，省略寒暄，总结不超过200字，直接输出总结内容。\n\n"
+    if summary:
+        prompt += f"已有的聊天总结为：[[{summary}]]\n"
+    prompt += f"新的聊天记录为: \n[[{conversation_history}]]\n请输出："
+    return prompt
+
+def summarize_history(summary, messages: list, openai_client=None, chat_model="gpt-3.5-turbo-1106") -> str:
+    """
+    将较早的聊天记录增量合并进滚动总结，用于在控制上下文长度的同时保留早期的聊天内容
+    :param summary: 已有的总结，没有时为None
+    :param messages: list 需要合并进总结的聊天记录
+    :return: 新的总结
+    """
+    chat_content = [{"role": "user", "content": generate_history_summary_prompt(summary, messages)}]
+    return analyze_chat(chat_content, 
+                        openai_client=openai_client, 
+                        chat_model=chat_model, 
+                        response_format="text", 
+                        priority=BACKGROUND).strip()
+
+async def summarize_history_async(summary, messages: list, openai_client=None, chat_model="gpt-3.5-turbo-1106") -> str:
+    """
+    summarize_history的异步版本
+    """
+    chat_content = [{"role": "user", "content": generate_history_summary_prompt(summary, messages)}]
+    text = await analyze_chat_async(chat_content, 
+                                    openai_client=openai_client, 
+                                    chat_model=chat_model, 
+                                    response_format="text", 
+                                    priority=BACKGROUND)
+    return text.strip()
+
 
 # 示例使用
 if __name__ == "__main__":
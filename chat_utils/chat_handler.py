@@ -4,11 +4,13 @@ import os
 import configparser
 import time
 
-from chat_utils.chat_analysis import analyze_meeting_chat, analyze_chat
+from chat_utils.chat_analysis import analyze_meeting_chat, analyze_chat, analyze_chat_async
+from chat_utils.meeting_cache import get_meeting_cache
+from chat_utils.meeting_classifier import should_skip_meeting_analysis
 from utils.calendar_generator import generate_ics
 from utils.email_service import send_email
 
-from models import openai_client
+from models import openai_client, async_openai_client
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -27,6 +29,7 @@ def text_chat_handler(msg,
     :param user_id: 用户的ID
     """
     # 特殊字符直接触发特殊指令
+    raw_msg = msg
     if recording:
         msg = '[语音识别结果，可能需要联系上下文理解并修正，尤其是涉及姓名]'+ msg
     if msg.startswith("@bind"):
@@ -56,7 +59,13 @@ def text_chat_handler(msg,
     # 语音信息
     elif recording and user_chat.status == 0:
         # 语音聊天的逻辑是：如果是会议邀请相关，则不影响过去的聊天记录，直接处理会议邀请；否则认为是正常的聊天
-        result = process_meeting_info(user_manager.get_user_field(user_id, "email"), msg, openai_client(config), config)
+        # 先用本地规则过滤明显不是会议信息的语音，省去一次模型调用
+        if config['Assistant'].getboolean('meeting_pre_classifier', True) and \
+                should_skip_meeting_analysis(raw_msg, config['Assistant'].getfloat('meeting_skip_confidence', 0.8)):
+            logging.info("语音信息不涉及会议，跳过会议信息提取")
+            result = None
+        else:
+            result = process_meeting_info(user_manager.get_user_field(user_id, "email"), msg, openai_client(config), config)
         logging.info("语音信息分析后的结果" + result if result else "")
         if result:
             return result
@@ -69,10 +78,19 @@ def text_chat_handler(msg,
         if not user_chat.user_initiated:
             time.sleep(config['Assistant'].getint('delay_time', 0))
             # 加入处理队列，并传入如何处理该聊天及如何回复的函数
-            analyze_func = lambda x:analyze_chat(x, openai_client=openai_client(config), chat_model=config["OpenAI"]["chat_model"], response_format="text")
+            stream = config['Assistant'].getboolean('stream_reply', False)
+            if config['Assistant'].getboolean('async_llm', False):
+                # 异步模式下在共享事件循环中等待模型返回，不占用线程
+                async def analyze_func(x, on_segment=None):
+                    return await analyze_chat_async(x, openai_client=async_openai_client(config), chat_model=config["OpenAI"]["chat_model"], response_format="text", 
+                                                    stream=stream, on_segment=on_segment)
+            else:
+                analyze_func = lambda x, on_segment=None:analyze_chat(x, openai_client=openai_client(config), chat_model=config["OpenAI"]["chat_model"], response_format="text", 
+                                                                      stream=stream, on_segment=on_segment)
             user_chat.process_message(msg, 
                                       analyze_func, 
-                                      reply_func)
+                                      reply_func,
+                                      stream=stream)
             return 
         else:
             return user_initiated_chat_recorder(msg, user_chat, role = "user")
@@ -92,20 +110,44 @@ def user_initiated_chat_recorder(msg, user_chat, role = "assistant"):
     logging.info( f"Chat recorded: {msg}")
     return None
 
-def asr_func(voice_file_path, config):
+def _asr_file(voice, file_name):
+    """
+    :param voice: 语音文件路径，或语音内容（bytes）
+    :param file_name: voice为bytes时的文件名，语音识别根据扩展名判断音频格式
+    :return: transcriptions.create的file参数，bytes直接上传，不写入磁盘
+    """
+    if isinstance(voice, bytes):
+        return (file_name, voice)
+    with open(voice, "rb") as f:
+        return (os.path.basename(voice), f.read())
+
+def asr_func(voice, config, file_name="voice.mp3"):
     """
     处理用户的语音请求
-    :param voice_file_name: 用户的语音文件名
-    :param user_id: 用户的ID
+    :param voice: 用户的语音文件路径，或语音内容（bytes）
+    :param file_name: voice为bytes时的文件名
+    """
+    response = openai_client(config).audio.transcriptions.create(
+        model=config["OpenAI"]["tts_model"], 
+        file=_asr_file(voice, file_name),
+        response_format="text"
+    )
+    logging.info(f"Recording: {response}")
+    return response 
+
+async def asr_func_async(voice, config, file_name="voice.mp3"):
+    """
+    asr_func的异步版本，需在共享事件循环（models.event_loop）中执行
+    :param voice: 用户的语音文件路径，或语音内容（bytes）
+    :param file_name: voice为bytes时的文件名
     """
-    with open(voice_file_path, "rb") as f:
-            response = openai_client(config).audio.transcriptions.create(
-                model=config["OpenAI"]["tts_model"], 
-                file=f,
-                response_format="text"
-            )
-            logging.info(f"Recording: {response}")
-            return response 
+    response = await async_openai_client(config).audio.transcriptions.create(
+        model=config["OpenAI"]["tts_model"], 
+        file=_asr_file(voice, file_name),
+        response_format="text"
+    )
+    logging.info(f"Recording: {response}")
+    return response
 # def process_general_chat(msg, 
 #                          user_chat, 
 #                          config):
@@ -128,7 +170,8 @@ def process_meeting_info(
         config, 
         ):
     #分析聊天内容
-    meeting_info = analyze_meeting_chat(response, openai_client=openai_client, chat_model=config["OpenAI"]["chat_model"])
+    meeting_info = analyze_meeting_chat(response, openai_client=openai_client, chat_model=config["OpenAI"]["chat_model"], 
+                                        cache=get_meeting_cache(config), lite_model=config["OpenAI"].get("meeting_lite_model"))
     if not meeting_info["is_meeting"]:
         return None
     if meeting_info["attendees"]:
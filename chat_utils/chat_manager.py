@@ -1,13 +1,22 @@
 import time
 from datetime import datetime
+import asyncio
 import threading
 import logging
 from queue import Queue, Empty
 import os
 import configparser
-from chat_utils.chat_analysis import analyze_conversation
+from chat_utils.chat_analysis import analyze_conversation, analyze_conversation_async
+from chat_utils.chat_analysis import summarize_history, summarize_history_async, SUMMARY_PREFIX
 from chat_utils.chat_handler import analyze_chat
-from models import openai_client
+from models import openai_client, async_openai_client, run_coroutine
+from models.tokenizer import count_message_tokens
+from utils.timer_scheduler import TimerScheduler
+
+# 消息合并（防抖）：最后一条消息后安静quiet秒再处理，但第一条消息最多等待max_wait秒，
+# 连续发送的多条消息合并为一次模型调用
+DEBOUNCE_QUIET = 1.5
+DEBOUNCE_MAX_WAIT = 6.0
 
 # 定义 Chat 类来处理单个聊天的逻辑
 class Chat:
@@ -15,11 +24,34 @@ class Chat:
                  max_conv_history:int = 20, 
                  assistant_description = "个人助理",
                  chat_description = None,
-                 lifespan:int=1800):
+                 lifespan:int=1800,
+                 token_budget:int=2000,
+                 model="gpt-3.5-turbo",
+                 summarize_handler=None,
+                 on_message=None,
+                 debounce_quiet=DEBOUNCE_QUIET,
+                 debounce_max_wait=DEBOUNCE_MAX_WAIT):
+        """
+        :param max_conv_history: 上下文中最多保留的最近消息条数
+        :param token_budget: 上下文（系统提示、滚动总结及最近的消息）的token上限
+        :param model: 用于计算token数的模型名称
+        :param summarize_handler: 将较早的消息合并进滚动总结的函数(已有总结, 消息列表) -> 新的总结，可以是协程函数；
+                                  不提供时超出预算的较早消息直接丢弃
+        :param on_message: 有新消息加入处理队列时的回调函数(chat)，用于安排消息处理
+        :param debounce_quiet: 最后一条消息后等待多久（秒）没有新消息时开始处理
+        :param debounce_max_wait: 第一条未处理的消息最多等待多久（秒）
+        """
         self.user_id = user_id
         self.lifespan = lifespan
-        self.start_time = time.time()
+        self.created = time.time()
+        self.start_time = self.created
         self.chat_history = []
+        # 与chat_history一一对应的token数，避免每次构建上下文时重新计算
+        self.history_tokens = []
+        self.summary = None
+        self.token_budget = token_budget
+        self.model = model
+        self.summarize_handler = summarize_handler
         self.expired = False  # 添加一个标志来标记聊天是否过期
         self.max_conversation_history = max_conv_history
         self.system_message = {"role": "system", 
@@ -27,6 +59,18 @@ class Chat:
         # Store the message to process
         self.message_queue = Queue()
         self.lock = threading.Lock()
+        self.on_message = on_message
+        self.debounce_quiet = debounce_quiet
+        self.debounce_max_wait = debounce_max_wait
+        # 第一条未处理消息的到达时间，以及已安排的处理任务
+        self.pending_since = None
+        self.flush_handle = None
+        self.finished = False
+        # 是否正在把较早的消息合并进总结，同一聊天同时只进行一次
+        self.folding = False
+        # 保证同一聊天的消息处理和过期处理不会同时执行
+        self.process_lock = threading.Lock()
+        self.process_lock_async = asyncio.Lock()
         # Define the status of Chat
         # 0: Specific Function Mode
         # 1: Chat Mode
@@ -44,6 +88,7 @@ class Chat:
         with self.lock:
             if not self.expired:
                 self.chat_history.append(message)
+                self.history_tokens.append(count_message_tokens(message, self.model))
                 self.start_time = time.time()
                 logging.info(f"Message added to {self.user_id}: {message}")
             else:
@@ -53,32 +98,172 @@ class Chat:
         # when some conversation history added, switch to chat mode
         self.status = 1
 
-    def process_message(self, message, process_handler, reply_func):
-        self.message_queue.put([message, process_handler, reply_func])
+    def process_message(self, message, process_handler, reply_func, stream=False):
+        """
+        将消息加入处理队列
+        :param process_handler: 处理聊天记录的函数，stream为True时需接受(聊天记录, 回复函数)，并在生成过程中逐句回复
+        :param reply_func: 回复函数
+        :param stream: 是否流式回复
+        """
+        self.message_queue.put([message, process_handler, reply_func, stream])
+        if self.on_message:
+            self.on_message(self)
 
-    def _process_message(self):
+    def _collect_messages(self):
+        """
+        取出队列中所有待处理的消息，合并为一条用户消息加入聊天记录
+        :return: (聊天记录, 处理函数, 回复函数, 是否流式回复)，没有待处理消息时返回None
+        """
         messages = []
         process_handler = None
         reply_func = None
+        stream = False
         while True:
             try:
-                message, process_handler, reply_func = self.message_queue.get_nowait()
+                message, process_handler, reply_func, stream = self.message_queue.get_nowait()
                 messages.append(message)
             except Empty:
                 break
-        if len(messages) > 0:
-            messages = {"role": "user", "content": "\n\n".join(messages)}
-            self.add_message(messages)
-            chat_history = self.get_history()
-            logging.info(f"Entire chat history:\n{chat_history}")
-            response = process_handler(chat_history)
-            self.add_message({"role": "assistant", "content": response})
-            logging.info(f"Response generated: {response}")
+        if len(messages) == 0:
+            return None
+        messages = {"role": "user", "content": "\n\n".join(messages)}
+        self.add_message(messages)
+        chat_history = self.get_history()
+        logging.info(f"Entire chat history:\n{chat_history}")
+        return chat_history, process_handler, reply_func, stream
+
+    def _reply(self, response, reply_func):
+        self.add_message({"role": "assistant", "content": response})
+        logging.info(f"Response generated: {response}")
+        # 流式回复时各句子已在生成过程中发出，这里只记录完整回复
+        if reply_func:
             reply_func(response)
 
+    def _process_message(self):
+        batch = self._collect_messages()
+        if batch is None:
+            return
+        chat_history, process_handler, reply_func, stream = batch
+        if stream:
+            response = process_handler(chat_history, reply_func)
+            self._reply(response, None)
+        else:
+            response = process_handler(chat_history)
+            self._reply(response, reply_func)
+
+    async def _process_message_async(self):
+        """
+        _process_message的异步版本，process_handler可以是协程函数（如analyze_chat_async）
+        """
+        batch = self._collect_messages()
+        if batch is None:
+            return
+        chat_history, process_handler, reply_func, stream = batch
+        loop = asyncio.get_running_loop()
+        args = (chat_history, reply_func) if stream else (chat_history,)
+        if asyncio.iscoroutinefunction(process_handler):
+            response = await process_handler(*args)
+        else:
+            response = await loop.run_in_executor(None, process_handler, *args)
+        # 回复需要调用微信接口发送消息，放到线程池中执行以免阻塞事件循环
+        await loop.run_in_executor(None, self._reply, response, None if stream else reply_func)
+
     def get_history(self):
+        """
+        获取发送给模型的上下文：系统提示、较早消息的滚动总结，以及在token预算内的最近消息
+        """
         with self.lock:
-            return [self.system_message,  *self.chat_history[:self.max_conversation_history]]
+            history = [self.system_message]
+            if self.summary:
+                history.append(self._summary_message())
+            start = self._window_start(self._turn_budget())
+            return history + self.chat_history[start:]
+
+    def _summary_message(self):
+        return {"role": "system", "content": f"{SUMMARY_PREFIX}{self.summary}"}
+
+    def _turn_budget(self):
+        # 扣除系统提示和滚动总结后，留给最近消息的token数
+        budget = self.token_budget - count_message_tokens(self.system_message, self.model)
+        if self.summary:
+            budget -= count_message_tokens(self._summary_message(), self.model)
+        return budget
+
+    def _window_start(self, budget):
+        """
+        从最新的消息往前累加，返回在预算和条数限制内能保留的第一条消息的位置（至少保留最后一条消息）
+        """
+        start = len(self.chat_history)
+        total = 0
+        while start > 0 and len(self.chat_history) - start < self.max_conversation_history:
+            total += self.history_tokens[start - 1]
+            if total > budget and start < len(self.chat_history):
+                break
+            start -= 1
+        return start
+
+    def _take_folding(self):
+        """
+        消息总量超出预算时，取出需要合并进总结的较早消息（保留约一半预算的最近消息，避免每轮都重新总结）
+        :return: 需要合并的消息列表，无需合并时返回None
+        """
+        with self.lock:
+            if self.folding:
+                return None
+            budget = self._turn_budget()
+            if sum(self.history_tokens) <= budget and len(self.chat_history) <= self.max_conversation_history:
+                return None
+            start = min(self._window_start(budget // 2), len(self.chat_history) - self.max_conversation_history // 2)
+            if start <= 0:
+                return None
+            folding = self.chat_history[:start]
+            if self.summarize_handler is None:
+                self._remove_folded(len(folding), self.summary)
+                return None
+            self.folding = True
+            return folding
+
+    def _remove_folded(self, count, summary):
+        # 新消息只会追加在末尾，因此被合并的消息仍位于开头；调用时需持有self.lock
+        del self.chat_history[:count]
+        del self.history_tokens[:count]
+        self.summary = summary
+        logging.info(f"Folded {count} messages of {self.user_id} into the chat summary.")
+
+    def _finish_folding(self, folding, summary):
+        # summary为None表示总结失败，保留原消息，下一轮再试（上下文仍受预算限制）
+        with self.lock:
+            self.folding = False
+            if summary is not None:
+                self._remove_folded(len(folding), summary)
+
+    def _fold_history(self):
+        folding = self._take_folding()
+        if folding is None:
+            return
+        summary = None
+        try:
+            summary = self.summarize_handler(self.summary, folding)
+        except Exception as e:
+            logging.warning(f"Failed to summarize chat history of {self.user_id}: {e}")
+        self._finish_folding(folding, summary)
+
+    async def _fold_history_async(self):
+        """
+        _fold_history的异步版本，summarize_handler可以是协程函数
+        """
+        folding = self._take_folding()
+        if folding is None:
+            return
+        summary = None
+        try:
+            if asyncio.iscoroutinefunction(self.summarize_handler):
+                summary = await self.summarize_handler(self.summary, folding)
+            else:
+                summary = await asyncio.get_running_loop().run_in_executor(None, self.summarize_handler, self.summary, folding)
+        except Exception as e:
+            logging.warning(f"Failed to summarize chat history of {self.user_id}: {e}")
+        self._finish_folding(folding, summary)
     
     def chat_on_hold(self):
         self.on_hold = True
@@ -95,6 +280,16 @@ class ChatManager:
         self.description = config["Assistant"]["assistant_description"]
         self.config = config
         self.chat_callback = chat_callback
+        # 异步模式下所有聊天的定时任务都在共享事件循环中执行，
+        # 否则由一个定时器线程统一管理，到期的任务交给有界线程池执行，不再为每个聊天启动线程；
+        # 聊天过期和历史总结等后台模型调用使用单独的小线程池，不占用回复消息的线程
+        self.async_llm = config["Assistant"].getboolean("async_llm", False)
+        self.timers = None
+        self.background = None
+        if not self.async_llm:
+            self.timers = TimerScheduler(max_workers=config["Assistant"].getint("chat_workers", 8), name="chat").start()
+            self.background = TimerScheduler(max_workers=config["Assistant"].getint("chat_background_workers", 2), 
+                                             name="chat-background").start()
 
     def __getitem__(self, user_id):
         return self.get_chat(user_id)
@@ -113,30 +308,174 @@ class ChatManager:
             else:
                 user_tags = "对于该聊天对象，暂无用户标签信息"
             logging.info(f"Creating new chat for user: {user_id}")
-            chat = Chat(user_id, max_conv_history = 10, 
+            debounce_quiet, debounce_max_wait = self._debounce_settings(user_id)
+            chat = Chat(user_id, max_conv_history = self.config["Assistant"].getint("max_conversation_history", 20), 
                  assistant_description = self.description,
                  chat_description = user_tags,
-                 lifespan=self.chat_lifespan)
+                 lifespan=self.chat_lifespan,
+                 token_budget=self.config["Assistant"].getint("history_token_budget", 2000),
+                 model=self.config["OpenAI"]["chat_model"],
+                 summarize_handler=self._summarize_handler(),
+                 on_message=self._schedule_flush,
+                 debounce_quiet=debounce_quiet,
+                 debounce_max_wait=debounce_max_wait)
             self.active_chats[user_id] = chat
-            # 启动一个线程来管理聊天的生命周期
-            threading.Thread(target=self._expire_chat, args=(user_id,)).start()
+            # 聊天到期时检查是否仍然活跃，活跃则顺延，否则结束聊天
+            self._call_later(chat.lifespan, self._check_expiry_async if self.async_llm else self._check_expiry, 
+                             user_id, chat, background=True)
             return chat
 
-    def _expire_chat(self, user_id):
-        # 管理聊天的生命周期
-        while self.active_chats[user_id].is_active():
-            time.sleep(3)
-            # 一段时间进行一次消息处理
-            self.active_chats[user_id]._process_message()
+    def _call_later(self, delay, callback, *args, background=False):
+        """
+        在delay秒后执行callback(*args)：异步模式下callback为协程函数，在共享事件循环中执行
+        :param background: 非异步模式下是否在后台线程池中执行，用于聊天过期等不需要及时完成的任务
+        """
+        if self.async_llm:
+            future = run_coroutine(self._run_later(delay, callback, *args))
+            future.add_done_callback(self._log_task_failure)
+            return future
+        return (self.background if background else self.timers).call_later(delay, callback, *args)
 
-        if len(self.active_chats[user_id].get_history()) <= 1:
-            del self.active_chats[user_id]
+    async def _run_later(self, delay, callback, *args):
+        await asyncio.sleep(delay)
+        await callback(*args)
+
+    def _debounce_settings(self, user_id):
+        """
+        按用户类型读取消息合并的等待时间，如 star.debounce_quiet = 1，未设置时使用 debounce_quiet / debounce_max_wait
+        """
+        assistant = self.config["Assistant"]
+        user_type = self.user_manager.get_user_field(user_id, "user_type") or "regular"
+        quiet = assistant.getfloat(f"{user_type}.debounce_quiet", assistant.getfloat("debounce_quiet", DEBOUNCE_QUIET))
+        max_wait = assistant.getfloat(f"{user_type}.debounce_max_wait", assistant.getfloat("debounce_max_wait", DEBOUNCE_MAX_WAIT))
+        return quiet, max(max_wait, quiet)
+
+    def _schedule_flush(self, chat):
+        # 每收到一条消息都把处理时间推迟到安静期之后，但不晚于第一条消息到达后的最长等待时间
+        now = time.time()
+        with chat.lock:
+            if chat.pending_since is None:
+                chat.pending_since = now
+            due = min(now + chat.debounce_quiet, chat.pending_since + chat.debounce_max_wait)
+            if chat.flush_handle is not None:
+                chat.flush_handle.cancel()
+            chat.flush_handle = self._call_later(due - now, self._flush_async if self.async_llm else self._flush, chat)
+
+    def _flush(self, chat):
+        with chat.lock:
+            chat.pending_since = chat.flush_handle = None
+        with chat.process_lock:
+            if chat.finished:
+                self._requeue(chat)
+                return
+            chat._process_message()
+        # 较早的消息在后台合并为总结，不阻塞后续消息的回复
+        self._call_later(0, chat._fold_history, background=True)
+
+    async def _flush_async(self, chat):
+        with chat.lock:
+            chat.pending_since = chat.flush_handle = None
+        async with chat.process_lock_async:
+            if chat.finished:
+                self._requeue(chat)
+                return
+            await chat._process_message_async()
+        future = run_coroutine(chat._fold_history_async())
+        future.add_done_callback(self._log_task_failure)
+
+    def _requeue(self, chat):
+        # 聊天刚结束时才处理到的消息转交给该用户的新聊天，而不是丢弃
+        while True:
+            try:
+                item = chat.message_queue.get_nowait()
+            except Empty:
+                return
+            logging.info(f"Chat with {chat.user_id} has ended, passing the message to a new chat.")
+            self.get_chat(chat.user_id).process_message(*item)
+
+    def _check_expiry(self, user_id, chat):
+        with chat.process_lock:
+            # 先处理尚未处理的消息，处理后聊天可能重新变为活跃
+            chat._process_message()
+            if chat.is_active():
+                self._call_later(chat.start_time + chat.lifespan - time.time(), self._check_expiry, user_id, chat, 
+                                 background=True)
+                return
+            chat.finished = True
+        self._expire_chat(user_id, chat)
+
+    async def _check_expiry_async(self, user_id, chat):
+        async with chat.process_lock_async:
+            await chat._process_message_async()
+            if chat.is_active():
+                self._call_later(chat.start_time + chat.lifespan - time.time(), self._check_expiry_async, user_id, chat, 
+                                 background=True)
+                return
+            chat.finished = True
+        await self._expire_chat_async(user_id, chat)
+
+    def _summarize_handler(self):
+        # 较早的聊天记录合并为滚动总结，配置 history_summary = false 时直接丢弃
+        if not self.config["Assistant"].getboolean("history_summary", True):
+            return None
+        chat_model = self.config["OpenAI"]["instruct_model"]
+        if self.async_llm:
+            async def summarize(summary, messages):
+                return await summarize_history_async(summary, messages, 
+                                                     openai_client=async_openai_client(self.config, timeout_profile="background"), 
+                                                     chat_model=chat_model)
+            return summarize
+        return lambda summary, messages: summarize_history(summary, messages, 
+                                                           openai_client=openai_client(self.config, timeout_profile="background"), 
+                                                           chat_model=chat_model)
+
+    def _expire_chat(self, user_id, chat):
+        # 聊天过期：提取记忆和标签后删除聊天
+        if len(chat.get_history()) <= 1:
+            self._remove_chat(user_id, chat)
             logging.info(f"Chat expired and deleted for user: {user_id}")
             return
-        result = analyze_conversation(self.active_chats[user_id].get_history(), 
+        result = analyze_conversation(chat.get_history(), 
                                               self.user_manager.get_user_field(user_id, "tags"),
-                                              openai_client=openai_client(self.config), 
+                                              openai_client=openai_client(self.config, timeout_profile="background"), 
                                               chat_model=self.config["OpenAI"]["instruct_model"])
+        summary = self._save_conversation_result(user_id, result)
+        self._remove_chat(user_id, chat)
+        if self.chat_callback:
+            self.chat_callback(summary)
+        logging.info(f"Chat expired and deleted for user: {user_id}")
+
+    async def _expire_chat_async(self, user_id, chat):
+        # _expire_chat的异步版本
+        if len(chat.get_history()) <= 1:
+            self._remove_chat(user_id, chat)
+            logging.info(f"Chat expired and deleted for user: {user_id}")
+            return
+        result = await analyze_conversation_async(chat.get_history(), 
+                                                  self.user_manager.get_user_field(user_id, "tags"),
+                                                  openai_client=async_openai_client(self.config, timeout_profile="background"), 
+                                                  chat_model=self.config["OpenAI"]["instruct_model"])
+        summary = self._save_conversation_result(user_id, result)
+        self._remove_chat(user_id, chat)
+        if self.chat_callback:
+            await asyncio.get_running_loop().run_in_executor(None, self.chat_callback, summary)
+        logging.info(f"Chat expired and deleted for user: {user_id}")
+
+    def _remove_chat(self, user_id, chat):
+        # 只删除本聊天，避免误删同一用户新建的聊天
+        if self.active_chats.get(user_id) is chat:
+            del self.active_chats[user_id]
+
+    def _log_task_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error("Chat task failed", exc_info=future.exception())
+
+    def _save_conversation_result(self, user_id, result):
+        """
+        将聊天结束时提取的记忆和标签存储到用户信息中
+        :param result: analyze_conversation的返回结果
+        :return: 本轮聊天的总结
+        """
         summary = f"Chat with {user_id} ended."
         memory = result['memory']
         logging.info(f"Memory extracted from chat with {user_id}: {memory}")
@@ -153,10 +492,7 @@ class ChatManager:
             existing_tags.append(tags)
             self.user_manager.set_user_field(user_id, "tags", existing_tags)
             summary += f"\nNew Tags: {tags}"
-        del self.active_chats[user_id]
-        if self.chat_callback:
-            self.chat_callback(summary)
-        logging.info(f"Chat expired and deleted for user: {user_id}")
+        return summary
 
 def test():
     logging.basicConfig(level=logging.DEBUG,
@@ -0,0 +1,151 @@
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import re
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from sqlite3 import Error
+
+
+class MeetingCache:
+    """
+    会议信息提取结果的缓存：内存中为带过期时间的LRU，同时写入本地SQLite以便重启后继续使用。
+    缓存的是模型返回的原始JSON文本，命中后仍会重新解析（包括“过去时间”的修正），
+    缓存键包含提示语中嵌入的“当前时间”所在的时间段，因此“明天”等相对日期跨天后不会命中旧结果。
+    """
+    def __init__(self, db_file=None, max_size=256, ttl=7200, bucket_minutes=60):
+        self.db_file = db_file
+        self.max_size = max_size
+        self.ttl = ttl
+        # 时间段需要能整除4小时，保证凌晨0点到4点（相对日期提前一天的规则）不会和其他时间落在同一段
+        if bucket_minutes <= 0 or 240 % bucket_minutes != 0:
+            logging.warning(f"Invalid time bucket ({bucket_minutes} minutes), using 60 minutes instead.")
+            bucket_minutes = 60
+        self.bucket_minutes = bucket_minutes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.db_file:
+            try:
+                with self.connect() as conn:
+                    conn.execute('''
+                    CREATE TABLE IF NOT EXISTS meeting_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        created REAL NOT NULL
+                    )''')
+                    conn.execute("DELETE FROM meeting_cache WHERE created < ?", (time.time() - self.ttl,))
+            except Error as e:
+                logging.error(e)
+                self.db_file = None
+
+    def connect(self):
+        return sqlite3.connect(self.db_file)
+
+    @staticmethod
+    def normalize(text):
+        """
+        规范化消息文本：统一全角/半角、大小写并合并空白
+        """
+        text = unicodedata.normalize("NFKC", text).lower()
+        return re.sub(r"\s+", " ", text).strip()
+
+    def time_bucket(self, now=None):
+        now = now or datetime.now()
+        return f"{now.strftime('%Y-%m-%d')}#{(now.hour * 60 + now.minute) // self.bucket_minutes}"
+
+    def make_key(self, text, chat_model, now=None):
+        """
+        生成缓存键：规范化后的文本 + 模型名称 + 当前时间段
+        """
+        raw = "\x00".join([self.normalize(text), chat_model, self.time_bucket(now)])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+        value = self._load(key, now)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, value[0], value[1])
+            return value[0]
+
+    def set(self, key, value):
+        created = time.time()
+        with self.lock:
+            self._remember(key, value, created)
+        if self.db_file:
+            try:
+                with self.connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO meeting_cache(cache_key, value, created) VALUES(?,?,?)",
+                                 (key, value, created))
+            except Error as e:
+                logging.error(e)
+
+    def _remember(self, key, value, created):
+        self.entries[key] = (value, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _load(self, key, now):
+        if not self.db_file:
+            return None
+        try:
+            with self.connect() as conn:
+                row = conn.execute("SELECT value, created FROM meeting_cache WHERE cache_key = ?", (key,)).fetchone()
+        except Error as e:
+            logging.error(e)
+            return None
+        if row is None or now - row[1] >= self.ttl:
+            return None
+        return row
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self.entries),
+            }
+
+
+meeting_cache = None
+meeting_cache_lock = threading.Lock()
+
+def get_meeting_cache(config):
+    """
+    根据配置获取全局共享的会议信息缓存，配置 [Cache] meeting_cache = false 时返回None
+    :param config: configuration dictionary
+    """
+    global meeting_cache
+    cache_config = config["Cache"] if "Cache" in config else {}
+    if str(cache_config.get("meeting_cache", "true")).lower() in ("false", "0", "no", "off"):
+        return None
+    with meeting_cache_lock:
+        if meeting_cache is None:
+            meeting_cache = MeetingCache(cache_config.get("meeting_cache_path", "data/meeting_cache.db"),
+                                         max_size=int(cache_config.get("meeting_cache_size", 256)),
+                                         ttl=int(cache_config.get("meeting_cache_ttl", 7200)),
+                                         bucket_minutes=int(cache_config.get("time_bucket_minutes", 60)))
+        return meeting_cache
@@ -0,0 +1,100 @@
+import re
+import json
+import time
+import logging
+
+MEETING = "meeting"
+NOT_MEETING = "not_meeting"
+UNCERTAIN = "uncertain"
+
+# 时间表达（中文/英文），只需判断“是否出现”，具体解析由模型完成
+CN_NUMBER = "[0-9零一二两三四五六七八九十]"
+TIME_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"(今|明|后|大后|前|昨)(天|晚|早|日)",
+    r"(上|下|这|本|下下)?(周|星期|礼拜)[一二三四五六日天1-7末]",
+    r"(下|这|本)(周|星期|礼拜|个月)",
+    r"(早上|上午|中午|下午|傍晚|晚上|凌晨|今晚|明早)",
+    CN_NUMBER + r"{1,3}\s*(点|时)(半|钟|" + CN_NUMBER + r"{1,2}分?)?",
+    r"\d{1,2}\s*[:：]\s*\d{2}",
+    CN_NUMBER + r"{1,2}\s*月\s*" + CN_NUMBER + r"{1,3}\s*(日|号)",
+    r"\d{4}[-/.]\d{1,2}[-/.]\d{1,2}",
+    r"(半|" + CN_NUMBER + r"{1,3}|几)\s*(个)?\s*(小时|分钟|天)(后|以后|之后)",
+    r"(几点|什么时候|何时|改天|回头|周末|月底|月初)",
+    r"\b(today|tonight|tomorrow|yesterday|weekend)\b",
+    r"\b(mon|tues|wednes|thurs|fri|satur|sun)day\b",
+    r"\bnext\s+(week|month|mon|tue|wed|thu|fri|sat|sun)",
+    r"\b\d{1,2}(:\d{2})?\s*(am|pm|a\.m\.|p\.m\.)",
+    r"\b(at|by|before|after)\s+\d{1,2}(:\d{2})?\b",
+    r"\bo'clock\b",
+    r"\bin\s+(an?|\d+)\s+(hour|minute|day)s?\b",
+)]
+
+# 会议/日程/提醒相关的关键词
+MEETING_KEYWORDS = [re.compile(p, re.IGNORECASE) for p in (
+    r"(会议|开会|例会|周会|评审|讨论|沟通|对齐|汇报|复盘|面试|面谈|拜访|见面|碰面|碰头|聚会|聚餐)",
+    r"(约|预约|预定|预订|安排|日程|行程|提醒|记得|别忘)",
+    r"(吃饭|午饭|晚饭|早饭|饭局|喝茶|喝咖啡|咖啡|打球|看电影|出发|接机|送机)",
+    r"(电话|视频|语音通话|腾讯会议|飞书|钉钉|zoom|teams|webex|会议号|会议室)",
+    r"\b(meeting|meet|call|sync|schedule|appointment|interview|lunch|dinner|breakfast|coffee|remind|reminder|catch up|conference)\b",
+)]
+
+
+def classify_meeting(text):
+    """
+    基于规则判断消息是否可能是会议/日程信息，用于在调用模型前过滤明显无关的消息
+    :param text: 消息文本（如语音识别结果）
+    :return: (label, confidence)，label为MEETING/NOT_MEETING/UNCERTAIN，confidence为0-1之间的置信度
+    """
+    time_hits = sum(1 for p in TIME_PATTERNS if p.search(text))
+    keyword_hits = sum(1 for p in MEETING_KEYWORDS if p.search(text))
+    if time_hits and keyword_hits:
+        return MEETING, min(0.6 + 0.1 * (time_hits + keyword_hits), 0.95)
+    if time_hits or keyword_hits:
+        # 只有时间或只有关键词时无法确定，仍交给模型判断
+        return UNCERTAIN, 0.5
+    # 既没有时间表达也没有关键词：消息越长，漏判的可能性越大
+    return NOT_MEETING, 0.95 if len(text) <= 80 else 0.85
+
+
+def should_skip_meeting_analysis(text, threshold=0.8):
+    """
+    判断是否可以跳过模型的会议信息提取
+    :param text: 消息文本
+    :param threshold: 判定为非会议信息的最低置信度
+    """
+    label, confidence = classify_meeting(text)
+    logging.debug(f"Meeting pre-classifier: {label} ({confidence:.2f})")
+    return label == NOT_MEETING and confidence >= threshold
+
+
+# 示例使用：在标注语料上评估可跳过的模型调用比例及单条消息的耗时
+if __name__ == "__main__":
+    corpus_path = "data/meeting_corpus.jsonl"
+    with open(corpus_path, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    skipped = wrongly_skipped = 0
+    labels = {MEETING: 0, NOT_MEETING: 0, UNCERTAIN: 0}
+    for sample in corpus:
+        label, confidence = classify_meeting(sample["text"])
+        labels[label] += 1
+        if should_skip_meeting_analysis(sample["text"]):
+            skipped += 1
+            if sample["is_meeting"]:
+                wrongly_skipped += 1
+                print(f"Meeting wrongly skipped: {sample['text']}")
+
+    rounds = 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for sample in corpus:
+            classify_meeting(sample["text"])
+    elapsed = (time.perf_counter() - start) / (rounds * len(corpus))
+
+    meetings = sum(1 for sample in corpus if sample["is_meeting"])
+    print(f"Samples: {len(corpus)} (meetings: {meetings}, others: {len(corpus) - meetings})")
+    print(f"Labels: {labels}")
+    print(f"LLM calls avoided: {skipped}/{len(corpus)} ({skipped / len(corpus):.1%}), "
+          f"non-meeting messages skipped: {skipped - wrongly_skipped}/{len(corpus) - meetings}")
+    print(f"Meetings wrongly skipped: {wrongly_skipped}")
+    print(f"Latency per message: {elapsed * 1e6:.1f} us")
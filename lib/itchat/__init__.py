@@ -80,6 +80,7 @@ send_file                   = instance.send_file
 send_image                  = instance.send_image
 send_video                  = instance.send_video
 send                        = instance.send
+send_async                  = instance.send_async
 revoke                      = instance.revoke
 # components.hotreload
 dump_login_status           = instance.dump_login_status
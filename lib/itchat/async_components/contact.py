@@ -3,7 +3,7 @@ import json, copy
 import logging
 
 from .. import config, utils
-from ..components.contact import accept_friend
+from ..components.contact import accept_friend, update_local_members
 from ..returnvalues import ReturnValue
 from ..storage import contact_change
 from ..utils import update_info_dict
@@ -115,36 +115,14 @@ def update_local_chatrooms(core, l):
             if 'RemarkName' in member:
                 utils.emoji_formatter(member, 'RemarkName')
         # update it to old chatrooms
-        oldChatroom = utils.search_dict_list(
-            core.chatroomList, 'UserName', chatroom['UserName'])
+        oldChatroom = core.chatroomList.contactIndex.get(chatroom['UserName'])
         if oldChatroom:
             update_info_dict(oldChatroom, chatroom)
-            #  - update other values
-            memberList = chatroom.get('MemberList', [])
-            oldMemberList = oldChatroom['MemberList']
-            if memberList:
-                for member in memberList:
-                    oldMember = utils.search_dict_list(
-                        oldMemberList, 'UserName', member['UserName'])
-                    if oldMember:
-                        update_info_dict(oldMember, member)
-                    else:
-                        oldMemberList.append(member)
+            #  - update members
+            update_local_members(oldChatroom['MemberList'], chatroom.get('MemberList', []))
         else:
             core.chatroomList.append(chatroom)
-            oldChatroom = utils.search_dict_list(
-                core.chatroomList, 'UserName', chatroom['UserName'])
-        # delete useless members
-        if len(chatroom['MemberList']) != len(oldChatroom['MemberList']) and \
-                chatroom['MemberList']:
-            existsUserNames = [member['UserName'] for member in chatroom['MemberList']]
-            delList = []
-            for i, member in enumerate(oldChatroom['MemberList']):
-                if member['UserName'] not in existsUserNames:
-                    delList.append(i)
-            delList.sort(reverse=True)
-            for i in delList:
-                del oldChatroom['MemberList'][i]
+            oldChatroom = core.chatroomList.contactIndex.get(chatroom['UserName'])
         #  - update OwnerUin
         if oldChatroom.get('ChatRoomOwner') and oldChatroom.get('MemberList'):
             owner = utils.search_dict_list(oldChatroom['MemberList'],
@@ -160,6 +138,7 @@ def update_local_chatrooms(core, l):
         newSelf = utils.search_dict_list(oldChatroom['MemberList'],
             'UserName', core.storageClass.userName)
         oldChatroom['Self'] = newSelf or copy.deepcopy(core.loginInfo['User'])
+        core.chatroomList.reindex(oldChatroom)
     return {
         'Type'         : 'System',
         'Text'         : [chatroom['UserName'] for chatroom in l],
@@ -172,7 +151,6 @@ def update_local_friends(core, l):
     '''
         get a list of friends or mps for updating local contact
     '''
-    fullList = core.memberList + core.mpList
     for friend in l:
         if 'NickName' in friend:
             utils.emoji_formatter(friend, 'NickName')
@@ -180,8 +158,8 @@ def update_local_friends(core, l):
             utils.emoji_formatter(friend, 'DisplayName')
         if 'RemarkName' in friend:
             utils.emoji_formatter(friend, 'RemarkName')
-        oldInfoDict = utils.search_dict_list(
-            fullList, 'UserName', friend['UserName'])
+        oldInfoDict = core.memberList.contactIndex.get(friend['UserName']) or \
+            core.mpList.contactIndex.get(friend['UserName'])
         if oldInfoDict is None:
             oldInfoDict = copy.deepcopy(friend)
             if oldInfoDict['VerifyFlag'] & 8 == 0:
@@ -190,6 +168,8 @@ def update_local_friends(core, l):
                 core.mpList.append(oldInfoDict)
         else:
             update_info_dict(oldInfoDict, friend)
+            core.memberList.reindex(oldInfoDict)
+            core.mpList.reindex(oldInfoDict)
 
 @contact_change
 def update_local_uin(core, msg):
@@ -212,12 +192,11 @@ def update_local_uin(core, msg):
         if 0 < len(uins) == len(usernames):
             for uin, username in zip(uins, usernames):
                 if not '@' in username: continue
-                fullContact = core.memberList + core.chatroomList + core.mpList
-                userDicts = utils.search_dict_list(fullContact,
-                    'UserName', username)
+                userDicts = core.storageClass.search_contact(username)
                 if userDicts:
                     if userDicts.get('Uin', 0) == 0:
                         userDicts['Uin'] = uin
+                        core.storageClass.reindex(userDicts)
                         usernameChangedList.append(username)
                         logger.debug('Uin fetched: %s, %s' % (username, uin))
                     else:
@@ -229,8 +208,7 @@ def update_local_uin(core, msg):
                         core.storageClass.updateLock.release()
                         update_chatroom(core, username)
                         core.storageClass.updateLock.acquire()
-                        newChatroomDict = utils.search_dict_list(
-                            core.chatroomList, 'UserName', username)
+                        newChatroomDict = core.chatroomList.contactIndex.get(username)
                         if newChatroomDict is None:
                             newChatroomDict = utils.struct_friend_info({
                                 'UserName': username,
@@ -239,12 +217,12 @@ def update_local_uin(core, msg):
                             core.chatroomList.append(newChatroomDict)
                         else:
                             newChatroomDict['Uin'] = uin
+                            core.storageClass.reindex(newChatroomDict)
                     elif '@' in username:
                         core.storageClass.updateLock.release()
                         update_friend(core, username)
                         core.storageClass.updateLock.acquire()
-                        newFriendDict = utils.search_dict_list(
-                            core.memberList, 'UserName', username)
+                        newFriendDict = core.memberList.contactIndex.get(username)
                         if newFriendDict is None:
                             newFriendDict = utils.struct_friend_info({
                                 'UserName': username,
@@ -252,6 +230,7 @@ def update_local_uin(core, msg):
                             core.memberList.append(newFriendDict)
                         else:
                             newFriendDict['Uin'] = uin
+                            core.storageClass.reindex(newFriendDict)
                     usernameChangedList.append(username)
                     logger.debug('Uin fetched: %s, %s' % (username, uin))
         else:
@@ -319,8 +298,7 @@ def get_mps(self, update=False):
     return utils.contact_deep_copy(self, self.mpList)
 
 def set_alias(self, userName, alias):
-    oldFriendInfo = utils.search_dict_list(
-        self.memberList, 'UserName', userName)
+    oldFriendInfo = self.memberList.contactIndex.get(userName)
     if oldFriendInfo is None:
         return ReturnValue({'BaseResponse': {
             'Ret': -1001, }})
@@ -337,6 +315,7 @@ def set_alias(self, userName, alias):
     r = ReturnValue(rawResponse=r)
     if r:
         oldFriendInfo['RemarkName'] = alias
+        self.memberList.reindex(oldFriendInfo)
     return r
 
 def set_pinned(self, userName, isPinned=True):
@@ -1,17 +1,19 @@
 import time
 import re
 import io
-import json
 import copy
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from .. import config, utils
+from .. import config, utils, jsoncodec
 from ..returnvalues import ReturnValue
 from ..storage import contact_change
 from ..utils import update_info_dict
 
 logger = logging.getLogger('itchat')
 
+MAX_GET_NUMBER = 50
+
 
 def load_contact(core):
     core.update_chatroom = update_chatroom
@@ -30,52 +32,69 @@ def load_contact(core):
     core.add_member_into_chatroom = add_member_into_chatroom
 
 
+def batch_get_contact(core, batches):
+    '''
+        post every batch (a list of webwxbatchgetcontact items) to the server
+        batches are fetched concurrently by at most config.FETCH_WORKERS threads
+        and a failed batch is retried config.FETCH_RETRIES times
+        return ContactList of each batch in order, None for a batch that kept failing
+    '''
+    headers = {
+        'ContentType': 'application/json; charset=UTF-8',
+        'User-Agent': config.USER_AGENT, }
+
+    def fetch(batch):
+        data = {
+            'BaseRequest': core.loginInfo['BaseRequest'],
+            'Count': len(batch),
+            'List': batch, }
+        for retry in range(config.FETCH_RETRIES + 1):
+            url = '%s/webwxbatchgetcontact?type=ex&r=%s' % (
+                core.loginInfo['url'], int(time.time()))
+            try:
+                r = core.s.post(url, data=jsoncodec.dumps(data), headers=headers,
+                                timeout=config.TIMEOUT)
+                return jsoncodec.loads(r.content).get('ContactList') or []
+            except Exception as e:
+                if retry < config.FETCH_RETRIES:
+                    logger.debug('Failed to fetch %s contacts, retrying: %s' % (len(batch), e))
+                    time.sleep(0.5 * 2 ** retry)
+                else:
+                    logger.warning('Failed to fetch %s contacts: %s' % (len(batch), e))
+    if len(batches) < 2 or config.FETCH_WORKERS < 2:
+        return [fetch(batch) for batch in batches]
+    with ThreadPoolExecutor(min(config.FETCH_WORKERS, len(batches))) as executor:
+        return list(executor.map(fetch, batches))
+
+
 def update_chatroom(self, userName, detailedMember=False):
     if not isinstance(userName, list):
         userName = [userName]
-    url = '%s/webwxbatchgetcontact?type=ex&r=%s' % (
-        self.loginInfo['url'], int(time.time()))
-    headers = {
-        'ContentType': 'application/json; charset=UTF-8',
-        'User-Agent': config.USER_AGENT}
-    data = {
-        'BaseRequest': self.loginInfo['BaseRequest'],
-        'Count': len(userName),
-        'List': [{
-            'UserName': u,
-            'ChatRoomId': '', } for u in userName], }
-    chatroomList = json.loads(self.s.post(url, data=json.dumps(data), headers=headers
-                                          ).content.decode('utf8', 'replace')).get('ContactList')
+    batches = [[{
+        'UserName': u,
+        'ChatRoomId': '', } for u in userName[i:i+MAX_GET_NUMBER]]
+        for i in range(0, len(userName), MAX_GET_NUMBER)]
+    chatroomList = [c for r in batch_get_contact(self, batches) if r for c in r]
     if not chatroomList:
         return ReturnValue({'BaseResponse': {
             'ErrMsg': 'No chatroom found',
             'Ret': -1001, }})
 
     if detailedMember:
-        def get_detailed_member_info(encryChatroomId, memberList):
-            url = '%s/webwxbatchgetcontact?type=ex&r=%s' % (
-                self.loginInfo['url'], int(time.time()))
-            headers = {
-                'ContentType': 'application/json; charset=UTF-8',
-                'User-Agent': config.USER_AGENT, }
-            data = {
-                'BaseRequest': self.loginInfo['BaseRequest'],
-                'Count': len(memberList),
-                'List': [{
-                    'UserName': member['UserName'],
-                    'EncryChatRoomId': encryChatroomId}
-                    for member in memberList], }
-            return json.loads(self.s.post(url, data=json.dumps(data), headers=headers
-                                          ).content.decode('utf8', 'replace'))['ContactList']
-        MAX_GET_NUMBER = 50
+        # members of all the chatrooms are fetched together, MAX_GET_NUMBER per request
+        batches, batchMembers = [], []
         for chatroom in chatroomList:
-            totalMemberList = []
-            for i in range(int(len(chatroom['MemberList']) / MAX_GET_NUMBER + 1)):
-                memberList = chatroom['MemberList'][i *
-                                                    MAX_GET_NUMBER: (i+1)*MAX_GET_NUMBER]
-                totalMemberList += get_detailed_member_info(
-                    chatroom['EncryChatRoomId'], memberList)
-            chatroom['MemberList'] = totalMemberList
+            for i in range(0, len(chatroom['MemberList']), MAX_GET_NUMBER):
+                memberList = chatroom['MemberList'][i:i+MAX_GET_NUMBER]
+                batches.append([{
+                    'UserName': member['UserName'],
+                    'EncryChatRoomId': chatroom['EncryChatRoomId']}
+                    for member in memberList])
+                batchMembers.append((chatroom, memberList))
+            chatroom['MemberList'] = []
+        for (chatroom, memberList), r in zip(batchMembers, batch_get_contact(self, batches)):
+            # keep the brief member info of a batch that failed
+            chatroom['MemberList'].extend(memberList if r is None else r)
 
     update_local_chatrooms(self, chatroomList)
     r = [self.storageClass.search_chatrooms(userName=c['UserName'])
@@ -97,8 +116,8 @@ def update_friend(self, userName):
         'List': [{
             'UserName': u,
             'EncryChatRoomId': '', } for u in userName], }
-    friendList = json.loads(self.s.post(url, data=json.dumps(data), headers=headers
-                                        ).content.decode('utf8', 'replace')).get('ContactList')
+    friendList = jsoncodec.loads(self.s.post(url, data=jsoncodec.dumps(data), headers=headers
+                                             ).content).get('ContactList')
 
     update_local_friends(self, friendList)
     r = [self.storageClass.search_friends(userName=f['UserName'])
@@ -123,37 +142,14 @@ def update_local_chatrooms(core, l):
             if 'RemarkName' in member:
                 utils.emoji_formatter(member, 'RemarkName')
         # update it to old chatrooms
-        oldChatroom = utils.search_dict_list(
-            core.chatroomList, 'UserName', chatroom['UserName'])
+        oldChatroom = core.chatroomList.contactIndex.get(chatroom['UserName'])
         if oldChatroom:
             update_info_dict(oldChatroom, chatroom)
-            #  - update other values
-            memberList = chatroom.get('MemberList', [])
-            oldMemberList = oldChatroom['MemberList']
-            if memberList:
-                for member in memberList:
-                    oldMember = utils.search_dict_list(
-                        oldMemberList, 'UserName', member['UserName'])
-                    if oldMember:
-                        update_info_dict(oldMember, member)
-                    else:
-                        oldMemberList.append(member)
+            #  - update members
+            update_local_members(oldChatroom['MemberList'], chatroom.get('MemberList', []))
         else:
             core.chatroomList.append(chatroom)
-            oldChatroom = utils.search_dict_list(
-                core.chatroomList, 'UserName', chatroom['UserName'])
-        # delete useless members
-        if len(chatroom['MemberList']) != len(oldChatroom['MemberList']) and \
-                chatroom['MemberList']:
-            existsUserNames = [member['UserName']
-                               for member in chatroom['MemberList']]
-            delList = []
-            for i, member in enumerate(oldChatroom['MemberList']):
-                if member['UserName'] not in existsUserNames:
-                    delList.append(i)
-            delList.sort(reverse=True)
-            for i in delList:
-                del oldChatroom['MemberList'][i]
+            oldChatroom = core.chatroomList.contactIndex.get(chatroom['UserName'])
         #  - update OwnerUin
         if oldChatroom.get('ChatRoomOwner') and oldChatroom.get('MemberList'):
             owner = utils.search_dict_list(oldChatroom['MemberList'],
@@ -169,6 +165,7 @@ def update_local_chatrooms(core, l):
         newSelf = utils.search_dict_list(oldChatroom['MemberList'],
                                          'UserName', core.storageClass.userName)
         oldChatroom['Self'] = newSelf or copy.deepcopy(core.loginInfo['User'])
+        core.chatroomList.reindex(oldChatroom)
     return {
         'Type': 'System',
         'Text': [chatroom['UserName'] for chatroom in l],
@@ -177,12 +174,36 @@ def update_local_chatrooms(core, l):
         'ToUserName': core.storageClass.userName, }
 
 
+def update_local_members(oldMemberList, memberList):
+    '''
+        merge the member list of a chatroom into the local one by UserName
+        new members are appended, known members updated in place
+        and members missing from a non-empty memberList removed
+    '''
+    if not memberList:
+        return
+    if hasattr(oldMemberList, 'merge'):
+        # CompactContactList merges inside its table
+        return oldMemberList.merge(memberList)
+    existsUserNames = set()
+    for member in memberList:
+        existsUserNames.add(member['UserName'])
+        oldMember = utils.search_dict_list(
+            oldMemberList, 'UserName', member['UserName'])
+        if oldMember:
+            update_info_dict(oldMember, member)
+        else:
+            oldMemberList.append(member)
+    if len(oldMemberList) != len(existsUserNames):
+        oldMemberList[:] = [member for member in oldMemberList
+                            if member['UserName'] in existsUserNames]
+
+
 @contact_change
 def update_local_friends(core, l):
     '''
         get a list of friends or mps for updating local contact
     '''
-    fullList = core.memberList + core.mpList
     for friend in l:
         if 'NickName' in friend:
             utils.emoji_formatter(friend, 'NickName')
@@ -190,8 +211,8 @@ def update_local_friends(core, l):
             utils.emoji_formatter(friend, 'DisplayName')
         if 'RemarkName' in friend:
             utils.emoji_formatter(friend, 'RemarkName')
-        oldInfoDict = utils.search_dict_list(
-            fullList, 'UserName', friend['UserName'])
+        oldInfoDict = core.memberList.contactIndex.get(friend['UserName']) or \
+            core.mpList.contactIndex.get(friend['UserName'])
         if oldInfoDict is None:
             oldInfoDict = copy.deepcopy(friend)
             if oldInfoDict['VerifyFlag'] & 8 == 0:
@@ -200,6 +221,8 @@ def update_local_friends(core, l):
                 core.mpList.append(oldInfoDict)
         else:
             update_info_dict(oldInfoDict, friend)
+            core.memberList.reindex(oldInfoDict)
+            core.mpList.reindex(oldInfoDict)
 
 
 @contact_change
@@ -224,12 +247,11 @@ def update_local_uin(core, msg):
             for uin, username in zip(uins, usernames):
                 if not '@' in username:
                     continue
-                fullContact = core.memberList + core.chatroomList + core.mpList
-                userDicts = utils.search_dict_list(fullContact,
-                                                   'UserName', username)
+                userDicts = core.storageClass.search_contact(username)
                 if userDicts:
                     if userDicts.get('Uin', 0) == 0:
                         userDicts['Uin'] = uin
+                        core.storageClass.reindex(userDicts)
                         usernameChangedList.append(username)
                         logger.debug('Uin fetched: %s, %s' % (username, uin))
                     else:
@@ -241,8 +263,7 @@ def update_local_uin(core, msg):
                         core.storageClass.updateLock.release()
                         update_chatroom(core, username)
                         core.storageClass.updateLock.acquire()
-                        newChatroomDict = utils.search_dict_list(
-                            core.chatroomList, 'UserName', username)
+                        newChatroomDict = core.chatroomList.contactIndex.get(username)
                         if newChatroomDict is None:
                             newChatroomDict = utils.struct_friend_info({
                                 'UserName': username,
@@ -251,12 +272,12 @@ def update_local_uin(core, msg):
                             core.chatroomList.append(newChatroomDict)
                         else:
                             newChatroomDict['Uin'] = uin
+                            core.storageClass.reindex(newChatroomDict)
                     elif '@' in username:
                         core.storageClass.updateLock.release()
                         update_friend(core, username)
                         core.storageClass.updateLock.acquire()
-                        newFriendDict = utils.search_dict_list(
-                            core.memberList, 'UserName', username)
+                        newFriendDict = core.memberList.contactIndex.get(username)
                         if newFriendDict is None:
                             newFriendDict = utils.struct_friend_info({
                                 'UserName': username,
@@ -264,6 +285,7 @@ def update_local_uin(core, msg):
                             core.memberList.append(newFriendDict)
                         else:
                             newFriendDict['Uin'] = uin
+                            core.storageClass.reindex(newFriendDict)
                     usernameChangedList.append(username)
                     logger.debug('Uin fetched: %s, %s' % (username, uin))
         else:
@@ -290,10 +312,11 @@ def get_contact(self, update=False):
         except:
             logger.info(
                 'Failed to fetch contact, that may because of the amount of your chatrooms')
-            for chatroom in self.get_chatrooms():
-                self.update_chatroom(chatroom['UserName'], detailedMember=True)
+            chatroomList = [c['UserName'] for c in self.get_chatrooms()]
+            if chatroomList:
+                self.update_chatroom(chatroomList, detailedMember=True)
             return 0, []
-        j = json.loads(r.content.decode('utf-8', 'replace'))
+        j = jsoncodec.loads(r.content)
         return j.get('Seq', 0), j.get('MemberList')
     seq, memberList = 0, []
     while 1:
@@ -339,8 +362,7 @@ def get_mps(self, update=False):
 
 
 def set_alias(self, userName, alias):
-    oldFriendInfo = utils.search_dict_list(
-        self.memberList, 'UserName', userName)
+    oldFriendInfo = self.memberList.contactIndex.get(userName)
     if oldFriendInfo is None:
         return ReturnValue({'BaseResponse': {
             'Ret': -1001, }})
@@ -352,11 +374,12 @@ def set_alias(self, userName, alias):
         'RemarkName': alias,
         'BaseRequest': self.loginInfo['BaseRequest'], }
     headers = {'User-Agent': config.USER_AGENT}
-    r = self.s.post(url, json.dumps(data, ensure_ascii=False).encode('utf8'),
+    r = self.s.post(url, jsoncodec.dumps(data),
                     headers=headers)
     r = ReturnValue(rawResponse=r)
     if r:
         oldFriendInfo['RemarkName'] = alias
+        self.memberList.reindex(oldFriendInfo)
     return r
 
 
@@ -390,7 +413,7 @@ def accept_friend(self, userName, v4='', autoUpdate=True):
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT}
     r = self.s.post(url, headers=headers,
-                    data=json.dumps(data, ensure_ascii=False).encode('utf8', 'replace'))
+                    data=jsoncodec.dumps(data))
     if autoUpdate:
         self.update_friend(userName)
     return ReturnValue(rawResponse=r)
@@ -455,7 +478,7 @@ def create_chatroom(self, memberList, topic=''):
         'content-type': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT}
     r = self.s.post(url, headers=headers,
-                    data=json.dumps(data, ensure_ascii=False).encode('utf8', 'ignore'))
+                    data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
 
 
@@ -470,7 +493,7 @@ def set_chatroom_name(self, chatroomUserName, name):
         'content-type': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT}
     r = self.s.post(url, headers=headers,
-                    data=json.dumps(data, ensure_ascii=False).encode('utf8', 'ignore'))
+                    data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
 
 
@@ -484,7 +507,7 @@ def delete_member_from_chatroom(self, chatroomUserName, memberList):
     headers = {
         'content-type': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT}
-    r = self.s.post(url, data=json.dumps(data), headers=headers)
+    r = self.s.post(url, data=jsoncodec.dumps(data), headers=headers)
     return ReturnValue(rawResponse=r)
 
 
@@ -515,5 +538,5 @@ def add_member_into_chatroom(self, chatroomUserName, memberList,
     headers = {
         'content-type': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT}
-    r = self.s.post(url, data=json.dumps(params), headers=headers)
+    r = self.s.post(url, data=jsoncodec.dumps(params), headers=headers)
     return ReturnValue(rawResponse=r)
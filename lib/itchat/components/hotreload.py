@@ -6,6 +6,7 @@ import requests
 from ..config import VERSION
 from ..returnvalues import ReturnValue
 from ..storage import templates
+from ..storage.statestore import StateStore
 from .contact import update_local_chatrooms, update_local_friends
 from .messages import produce_msg
 
@@ -16,27 +17,37 @@ def load_hotreload(core):
     core.load_login_status = load_login_status
 
 def dump_login_status(self, fileDir=None):
+    ''' write a snapshot the first time, later only the journal is appended
+        the StateStore keeps appending it in background while logged in
+    '''
     fileDir = fileDir or self.hotReloadDir
-    try:
-        with open(fileDir, 'w') as f:
-            f.write('itchat - DELETE THIS')
-        os.remove(fileDir)
-    except:
-        raise Exception('Incorrect fileDir')
-    status = {
-        'version'   : VERSION,
-        'loginInfo' : self.loginInfo,
-        'cookies'   : self.s.cookies.get_dict(),
-        'storage'   : self.storageClass.dumps()}
-    with open(fileDir, 'wb') as f:
-        pickle.dump(status, f)
+    store = self.stateStore
+    if store is None or store.fileDir != fileDir or not store.alive:
+        try:
+            with open(fileDir, 'w') as f:
+                f.write('itchat - DELETE THIS')
+            os.remove(fileDir)
+        except:
+            raise Exception('Incorrect fileDir')
+        store = self.stateStore = StateStore(self, fileDir)
+    store.flush()
+    if self.alive:
+        store.start()
     logger.debug('Dump login status for hot reload successfully.')
 
 def load_login_status(self, fileDir,
         loginCallback=None, exitCallback=None):
+    store = StateStore(self, fileDir)
     try:
-        with open(fileDir, 'rb') as f:
-            j = pickle.load(f)
+        status = store.read()
+        if status is None: # dumped in one pickle by an older version
+            with open(fileDir, 'rb') as f:
+                j = pickle.load(f)
+        else:
+            j = {
+                'version'   : status['version'],
+                'loginInfo' : status['session']['loginInfo'],
+                'cookies'   : status['session']['cookies'], }
     except Exception as e:
         logger.debug('No such file, loading login status failed.')
         return ReturnValue({'BaseResponse': {
@@ -54,7 +65,10 @@ def load_login_status(self, fileDir,
     self.loginInfo['User'] = templates.User(self.loginInfo['User'])
     self.loginInfo['User'].core = self
     self.s.cookies = requests.utils.cookiejar_from_dict(j['cookies'])
-    self.storageClass.loads(j['storage'])
+    if status is None:
+        self.storageClass.loads(j['storage'])
+    else:
+        store.restore(status)
     try:
         msgList, contactList = self.get_msg()
     except:
@@ -77,6 +91,8 @@ def load_login_status(self, fileDir,
             msgList = produce_msg(self, msgList)
             for msg in msgList: self.msgList.put(msg)
         self.start_receiving(exitCallback)
+        # status of an older version is rewritten as a snapshot on the first flush
+        self.stateStore = store.start()
         logger.debug('loading login status succeeded.')
         if hasattr(loginCallback, '__call__'):
             loginCallback()
@@ -3,7 +3,6 @@ import time
 import re
 import io
 import threading
-import json
 import xml.dom.minidom
 import random
 import traceback
@@ -16,7 +15,8 @@ except ImportError:
 import requests
 from pyqrcode import QRCode
 
-from .. import config, utils
+from .. import config, utils, jsoncodec
+from ..pipeline import Stage
 from ..returnvalues import ReturnValue
 from ..storage.templates import wrap_user_dict
 from .contact import update_local_chatrooms, update_local_friends
@@ -99,7 +99,7 @@ def push_login(core):
         url = '%s/cgi-bin/mmwebwx-bin/webwxpushloginurl?uin=%s' % (
             config.BASE_URL, cookiesDict['wxuin'])
         headers = {'User-Agent': config.USER_AGENT}
-        r = core.s.get(url, headers=headers).json()
+        r = jsoncodec.loads(core.s.get(url, headers=headers).content)
         if 'uuid' in r and r.get('ret') in (0, '0'):
             core.uuid = r['uuid']
             return r['uuid']
@@ -237,8 +237,8 @@ def web_init(self):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT, }
-    r = self.s.post(url, params=params, data=json.dumps(data), headers=headers)
-    dic = json.loads(r.content.decode('utf-8', 'replace'))
+    r = self.s.post(url, params=params, data=jsoncodec.dumps(data), headers=headers)
+    dic = jsoncodec.loads(r.content)
     # deal with login info
     utils.emoji_formatter(dic['User'], 'NickName')
     self.loginInfo['InviteStartCount'] = int(dic['InviteStartCount'])
@@ -281,13 +281,45 @@ def show_mobile_login(self):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT, }
-    r = self.s.post(url, data=json.dumps(data), headers=headers)
+    r = self.s.post(url, data=jsoncodec.dumps(data), headers=headers)
     return ReturnValue(rawResponse=r)
 
 
 def start_receiving(self, exitCallback=None, getReceivingFnOnly=False):
     self.alive = True
 
+    def update_contacts(contactList):
+        chatroomList, otherList = [], []
+        for contact in contactList:
+            if '@@' in contact['UserName']:
+                chatroomList.append(contact)
+            else:
+                otherList.append(contact)
+        chatroomMsg = update_local_chatrooms(
+            self, chatroomList)
+        chatroomMsg['User'] = self.loginInfo['User']
+        self.msgList.put(chatroomMsg)
+        update_local_friends(self, otherList)
+
+    def handle_batch(batch):
+        msgList, contactList = batch
+        if msgList:
+            msgList = produce_msg(self, msgList)
+            for msg in msgList:
+                self.msgList.put(msg)
+        if contactList:
+            update_contacts(contactList)
+
+    if config.RECEIVE_QUEUE_SIZE > 0:
+        # the receiving thread only polls, batches are handled by one stage behind it
+        # messages of a batch are formatted after the contacts of the batches before are merged
+        receiveStage = Stage('receive', handle_batch)
+        self.receiveStages = [receiveStage.start()]
+        put_batch = receiveStage.put
+    else:
+        self.receiveStages = []
+        put_batch = handle_batch
+
     def maintain_loop():
         retryCount = 0
         while self.alive:
@@ -298,23 +330,7 @@ def start_receiving(self, exitCallback=None, getReceivingFnOnly=False):
                 elif i == '0':
                     pass
                 else:
-                    msgList, contactList = self.get_msg()
-                    if msgList:
-                        msgList = produce_msg(self, msgList)
-                        for msg in msgList:
-                            self.msgList.put(msg)
-                    if contactList:
-                        chatroomList, otherList = [], []
-                        for contact in contactList:
-                            if '@@' in contact['UserName']:
-                                chatroomList.append(contact)
-                            else:
-                                otherList.append(contact)
-                        chatroomMsg = update_local_chatrooms(
-                            self, chatroomList)
-                        chatroomMsg['User'] = self.loginInfo['User']
-                        self.msgList.put(chatroomMsg)
-                        update_local_friends(self, otherList)
+                    put_batch(self.get_msg())
                 retryCount = 0
             except requests.exceptions.ReadTimeout:
                 pass
@@ -327,6 +343,8 @@ def start_receiving(self, exitCallback=None, getReceivingFnOnly=False):
                     self.alive = False
                 else:
                     time.sleep(1)
+        for stage in self.receiveStages:
+            stage.stop(timeout=10)
         self.logout()
         if hasattr(exitCallback, '__call__'):
             exitCallback()
@@ -387,9 +405,9 @@ def get_msg(self):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent': config.USER_AGENT}
-    r = self.s.post(url, data=json.dumps(data),
+    r = self.s.post(url, data=jsoncodec.dumps(data),
                     headers=headers, timeout=config.TIMEOUT)
-    dic = json.loads(r.content.decode('utf-8', 'replace'))
+    dic = jsoncodec.loads(r.content)
     if dic['BaseResponse']['Ret'] != 0:
         return None, None
     self.loginInfo['SyncKey'] = dic['SyncKey']
@@ -409,6 +427,9 @@ def logout(self):
         self.s.get(url, params=params, headers=headers)
         self.alive = False
     self.isLogging = False
+    if self.stateStore is not None:
+        # keep the hot reload status from recording the cleared storage
+        self.stateStore.stop()
     self.s.cookies.clear()
     del self.chatroomList[:]
     del self.memberList[:]
@@ -1,18 +1,24 @@
-import os, time, re, io
+import os, time, re, io, threading
 import json
-import mimetypes, hashlib
+import mimetypes, hashlib, mmap
 import logging
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 
-from .. import config, utils
+from .. import config, utils, jsoncodec
 from ..returnvalues import ReturnValue
 from ..storage import templates
 from .contact import update_local_uin
 
 logger = logging.getLogger('itchat')
 
+CHUNK_SIZE = 524288
+DOWNLOAD_BLOCK = 262144
+uploadProgress = {} # (core id, file md5, size, type, toUserName) -> progress of failed uploads
+uploadProgressLock = threading.Lock()
+
 def load_messages(core):
     core.send_raw_msg = send_raw_msg
     core.send_msg     = send_msg
@@ -21,27 +27,115 @@ def load_messages(core):
     core.send_image   = send_image
     core.send_video   = send_video
     core.send         = send
+    core.send_async   = send_async
     core.revoke       = revoke
 
+def download_media(core, url, params, sink=None, headers=None,
+        maxSize=None, withPostFix=False):
+    ''' stream url into sink, DOWNLOAD_BLOCK bytes at a time
+        for sink
+            - None: the content is returned as bytes
+            - file name: downloaded into a part file next to it, which replaces the file
+              once complete, a part file left by a failed download of the same media
+              is resumed from its size with a Range request
+            - file like object: passed to its write()
+            - writable buffer (bytearray, memoryview): filled from its start
+        for options
+            - maxSize: downloads larger than it are aborted, config.DOWNLOAD_MAX_SIZE by default
+            - withPostFix: put the postfix of the image type in 'PostFix'
+        'Size' of the returned value is the size of the whole content
+    '''
+    maxSize = maxSize or config.DOWNLOAD_MAX_SIZE
+    headers = dict(headers or {}, **{ 'User-Agent' : config.USER_AGENT })
+    offset, partDir = 0, None
+    if isinstance(sink, str):
+        partDir = '%s.%s.part' % (sink, download_key(url, params))
+        if os.path.exists(partDir):
+            offset = os.path.getsize(partDir)
+            if offset:
+                headers['Range'] = 'bytes=%s-' % offset
+    r = core.s.get(url, params=params, stream=True, headers=headers)
+    try:
+        if r.status_code == 416 and offset: # nothing left
+            os.replace(partDir, sink)
+            with open(sink, 'rb') as f:
+                return download_result(offset, f.read(20), withPostFix)
+        if r.status_code >= 400:
+            return ReturnValue({'BaseResponse': {
+                'ErrMsg': 'Download failed with status %s' % r.status_code,
+                'Ret': -1003, }})
+        if r.status_code != 206: # the server ignored Range
+            offset = 0
+        if offset + int(r.headers.get('Content-Length') or 0) > maxSize:
+            if offset:
+                os.remove(partDir)
+            return download_too_large(maxSize)
+        if sink is None:
+            blocks = []
+            write = blocks.append
+        elif partDir is not None:
+            f = open(partDir, 'ab' if offset else 'wb')
+            write = f.write
+        elif hasattr(sink, 'write'):
+            write = sink.write
+        else:
+            view = memoryview(sink).cast('B')
+            maxSize = min(maxSize, len(view))
+            def write(block):
+                view[size:size + len(block)] = block
+        size, head, tooLarge = offset, b'', False
+        try:
+            for block in r.iter_content(DOWNLOAD_BLOCK):
+                if size + len(block) > maxSize:
+                    tooLarge = True
+                    break
+                if len(head) < 20:
+                    head += block[:20 - len(head)]
+                write(block)
+                size += len(block)
+        finally:
+            if partDir is not None:
+                f.close()
+        if tooLarge:
+            if partDir is not None:
+                os.remove(partDir)
+            return download_too_large(maxSize)
+        if partDir is not None:
+            os.replace(partDir, sink)
+    finally:
+        r.close()
+    if sink is None:
+        return b''.join(blocks)
+    if offset and withPostFix:
+        with open(sink, 'rb') as f:
+            head = f.read(20)
+    return download_result(size, head, withPostFix)
+
+def download_key(url, params):
+    ''' tells the part files of different media apart, skey changes with each login '''
+    key = url + repr(sorted((k, v) for k, v in (params or {}).items() if k != 'skey'))
+    return hashlib.md5(key.encode('utf8')).hexdigest()[:12]
+
+def download_result(size, head, withPostFix):
+    r = ReturnValue({'BaseResponse': {
+        'ErrMsg': 'Successfully downloaded',
+        'Ret': 0, },
+        'Size': size, })
+    if withPostFix:
+        r['PostFix'] = utils.get_image_postfix(head)
+    return r
+
+def download_too_large(maxSize):
+    return ReturnValue({'BaseResponse': {
+        'ErrMsg': 'Download is larger than %s bytes' % maxSize,
+        'Ret': -1005, }})
+
 def get_download_fn(core, url, msgId):
     def download_fn(downloadDir=None):
         params = {
             'msgid': msgId,
             'skey': core.loginInfo['skey'],}
-        headers = { 'User-Agent' : config.USER_AGENT }
-        r = core.s.get(url, params=params, stream=True, headers = headers)
-        tempStorage = io.BytesIO()
-        for block in r.iter_content(1024):
-            tempStorage.write(block)
-        if downloadDir is None:
-            return tempStorage.getvalue()
-        with open(downloadDir, 'wb') as f:
-            f.write(tempStorage.getvalue())
-        tempStorage.seek(0)
-        return ReturnValue({'BaseResponse': {
-            'ErrMsg': 'Successfully downloaded',
-            'Ret': 0, },
-            'PostFix': utils.get_image_postfix(tempStorage.read(20)), })
+        return download_media(core, url, params, downloadDir, withPostFix=True)
     return download_fn
 
 def produce_msg(core, msgList):
@@ -124,18 +218,8 @@ def produce_msg(core, msgList):
                 params = {
                     'msgid': msgId,
                     'skey': core.loginInfo['skey'],}
-                headers = {'Range': 'bytes=0-', 'User-Agent' : config.USER_AGENT }
-                r = core.s.get(url, params=params, headers=headers, stream=True)
-                tempStorage = io.BytesIO()
-                for block in r.iter_content(1024):
-                    tempStorage.write(block)
-                if videoDir is None:
-                    return tempStorage.getvalue()
-                with open(videoDir, 'wb') as f:
-                    f.write(tempStorage.getvalue())
-                return ReturnValue({'BaseResponse': {
-                    'ErrMsg': 'Successfully downloaded',
-                    'Ret': 0, }})
+                return download_media(core, url, params, videoDir,
+                    headers={'Range': 'bytes=0-'})
             msg = {
                 'Type': 'Video',
                 'FileName' : '%s.mp4' % time.strftime('%y%m%d-%H%M%S', time.localtime()),
@@ -157,18 +241,7 @@ def produce_msg(core, msgList):
                         'fromuser': core.loginInfo['wxuin'],
                         'pass_ticket': 'undefined',
                         'webwx_data_ticket': cookiesList['webwx_data_ticket'],}
-                    headers = { 'User-Agent' : config.USER_AGENT }
-                    r = core.s.get(url, params=params, stream=True, headers=headers)
-                    tempStorage = io.BytesIO()
-                    for block in r.iter_content(1024):
-                        tempStorage.write(block)
-                    if attaDir is None:
-                        return tempStorage.getvalue()
-                    with open(attaDir, 'wb') as f:
-                        f.write(tempStorage.getvalue())
-                    return ReturnValue({'BaseResponse': {
-                        'ErrMsg': 'Successfully downloaded',
-                        'Ret': 0, }})
+                    return download_media(core, url, params, attaDir)
                 msg = {
                     'Type': 'Attachment',
                     'Text': download_atta, }
@@ -260,7 +333,8 @@ def produce_group_chat(core, msg):
     msg['Content']        = content
     utils.msg_formatter(msg, 'Content')
 
-def send_raw_msg(self, msgType, content, toUserName):
+def send_raw_msg(self, msgType, content, toUserName, clientMsgId=None):
+    clientMsgId = clientMsgId or int(time.time() * 1e4)
     url = '%s/webwxsendmsg' % self.loginInfo['url']
     data = {
         'BaseRequest': self.loginInfo['BaseRequest'],
@@ -269,13 +343,13 @@ def send_raw_msg(self, msgType, content, toUserName):
             'Content': content,
             'FromUserName': self.storageClass.userName,
             'ToUserName': (toUserName if toUserName else self.storageClass.userName),
-            'LocalID': int(time.time() * 1e4),
-            'ClientMsgId': int(time.time() * 1e4),
+            'LocalID': clientMsgId,
+            'ClientMsgId': clientMsgId,
             },
         'Scene': 0, }
     headers = { 'ContentType': 'application/json; charset=UTF-8', 'User-Agent' : config.USER_AGENT }
     r = self.s.post(url, headers=headers,
-        data=json.dumps(data, ensure_ascii=False).encode('utf8'))
+        data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
 
 def send_msg(self, msg='Test Message', toUserName=None):
@@ -298,10 +372,14 @@ def _prepare_file(fileDir, file_=None):
                 'ErrMsg': 'No file found in specific dir',
                 'Ret': -1002, }})
         with open(fileDir, 'rb') as f:
-            file_ = f.read()
+            # chunks are sliced from the mapped file instead of reading it all into memory
+            if os.fstat(f.fileno()).st_size:
+                file_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                file_ = b''
     fileDict['fileSize'] = len(file_)
     fileDict['fileMd5'] = hashlib.md5(file_).hexdigest()
-    fileDict['file_'] = io.BytesIO(file_)
+    fileDict['file_'] = file_ if isinstance(file_, mmap.mmap) else io.BytesIO(file_)
     return fileDict
 
 def upload_file(self, fileDir, isPicture=False, isVideo=False,
@@ -315,12 +393,25 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
     fileSize, fileMd5, file_ = \
         preparedFile['fileSize'], preparedFile['fileMd5'], preparedFile['file_']
     fileSymbol = 'pic' if isPicture else 'video' if isVideo else'doc'
-    chunks = int((fileSize - 1) / 524288) + 1
-    clientMediaId = int(time.time() * 1e4)
+    chunks = int((fileSize - 1) / CHUNK_SIZE) + 1
+    progress = get_upload_progress(self, (fileMd5, fileSize, fileSymbol, toUserName))
+    r = None
+    try:
+        r = _upload_chunks(self, fileDir, toUserName, fileSize, fileMd5, file_,
+            fileSymbol, chunks, progress)
+    finally:
+        release_upload_progress(progress, bool(r))
+    return r
+
+def _upload_chunks(self, fileDir, toUserName, fileSize, fileMd5, file_,
+        fileSymbol, chunks, progress):
+    if progress['acked']:
+        logger.info('Resuming upload of %s from %s of %s chunks.' % (
+            fileDir, len(progress['acked']), chunks))
     uploadMediaRequest = json.dumps(OrderedDict([
         ('UploadType', 2),
         ('BaseRequest', self.loginInfo['BaseRequest']),
-        ('ClientMediaId', clientMediaId),
+        ('ClientMediaId', progress['clientMediaId']),
         ('TotalLen', fileSize),
         ('StartPos', 0),
         ('DataLen', fileSize),
@@ -329,24 +420,81 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
         ('ToUserName', toUserName),
         ('FileMd5', fileMd5)]
         ), separators = (',', ':'))
-    r = {'BaseResponse': {'Ret': -1005, 'ErrMsg': 'Empty file detected'}}
-    for chunk in range(chunks):
-        r = upload_chunk_file(self, fileDir, fileSymbol, fileSize,
-            file_, chunk, chunks, uploadMediaRequest)
-    file_.close()
-    if isinstance(r, dict):
-        return ReturnValue(r)
-    return ReturnValue(rawResponse=r)
-
-def upload_chunk_file(core, fileDir, fileSymbol, fileSize,
-        file_, chunk, chunks, uploadMediaRequest):
-    url = core.loginInfo.get('fileUrl', core.loginInfo['url']) + \
+    url = self.loginInfo.get('fileUrl', self.loginInfo['url']) + \
         '/webwxuploadmedia?f=json'
-    # save it on server
+    fields = upload_fields(self, fileDir, fileSymbol, fileSize, uploadMediaRequest)
+    data = file_ if isinstance(file_, mmap.mmap) else file_.getvalue()
+    def upload(chunk):
+        return upload_chunk_file(self, url, fields, data, chunk, chunks)
+    try:
+        # the server finishes the file on its last chunk, so that one goes after all the others
+        pending = [chunk for chunk in range(chunks - 1) if chunk not in progress['acked']]
+        r = None
+        if pending:
+            with ThreadPoolExecutor(min(config.UPLOAD_WORKERS, len(pending))) as executor:
+                futures = dict((executor.submit(upload, chunk), chunk) for chunk in pending)
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    elif future.result():
+                        progress['acked'].add(futures[future])
+                    elif r is None:
+                        # give up the chunks not started yet, they are sent on resuming
+                        r = future.result()
+                        for f in futures:
+                            f.cancel()
+        if r is None:
+            r = upload(chunks - 1)
+    finally:
+        file_.close()
+    return r
+
+def get_upload_progress(core, key):
+    ''' progress of an upload, kept until it succeeds
+        a failed upload of the same file to the same user is resumed
+        with the same ClientMediaId, skipping chunks already acknowledged
+        the progress belongs to one upload at a time, while it is in use
+        another upload of the same file starts fresh and is not kept
+        it has to be given back with release_upload_progress
+    '''
+    now = time.time()
+    key = (id(core),) + key
+    with uploadProgressLock:
+        for k, v in list(uploadProgress.items()):
+            if not v['inUse'] and v['time'] + config.UPLOAD_RESUME_TIME < now:
+                del uploadProgress[k]
+        progress = uploadProgress.get(key)
+        if progress is None:
+            progress = uploadProgress[key] = {
+                'key': key,
+                'clientMediaId': int(now * 1e4),
+                'acked': set(), }
+        elif progress['inUse']:
+            logger.debug('The same file is being uploaded, uploading it again from the start.')
+            return {
+                'key': None,
+                'clientMediaId': int(now * 1e4) + 1,
+                'acked': set(),
+                'inUse': True,
+                'time': now, }
+        progress['inUse'] = True
+        progress['time'] = now
+    return progress
+
+def release_upload_progress(progress, done):
+    ''' give back the progress of an upload, dropped once the upload succeeded '''
+    with uploadProgressLock:
+        progress['inUse'] = False
+        progress['time'] = time.time()
+        if done and uploadProgress.get(progress['key']) is progress:
+            del uploadProgress[progress['key']]
+
+def upload_fields(core, fileDir, fileSymbol, fileSize, uploadMediaRequest):
+    ''' form fields shared by all chunks of a file '''
     cookiesList = {name:data for name,data in core.s.cookies.items()}
     fileType = mimetypes.guess_type(fileDir)[0] or 'application/octet-stream'
     fileName = utils.quote(os.path.basename(fileDir))
-    files = OrderedDict([
+    return OrderedDict([
         ('id', (None, 'WU_FILE_0')),
         ('name', (None, fileName)),
         ('type', (None, fileType)),
@@ -358,13 +506,33 @@ def upload_chunk_file(core, fileDir, fileSymbol, fileSize,
         ('uploadmediarequest', (None, uploadMediaRequest)),
         ('webwx_data_ticket', (None, cookiesList['webwx_data_ticket'])),
         ('pass_ticket', (None, core.loginInfo['pass_ticket'])),
-        ('filename' , (fileName, file_.read(524288), 'application/octet-stream'))])
+        ('filename' , (fileName, None, 'application/octet-stream'))])
+
+def upload_chunk_file(core, url, fields, data, chunk, chunks):
+    ''' post one chunk of data, a failed chunk is retried config.UPLOAD_RETRIES times '''
+    files = OrderedDict(fields)
     if chunks == 1:
         del files['chunk']; del files['chunks']
     else:
         files['chunk'], files['chunks'] = (None, str(chunk)), (None, str(chunks))
+    files['filename'] = (fields['filename'][0],
+        data[chunk * CHUNK_SIZE:(chunk + 1) * CHUNK_SIZE], 'application/octet-stream')
     headers = { 'User-Agent' : config.USER_AGENT }
-    return core.s.post(url, files=files, headers=headers, timeout=config.TIMEOUT)
+    for retry in range(config.UPLOAD_RETRIES + 1):
+        try:
+            r = ReturnValue(rawResponse=core.s.post(url, files=files,
+                headers=headers, timeout=config.TIMEOUT))
+        except requests.exceptions.RequestException as e:
+            r = ReturnValue({'BaseResponse': {
+                'ErrMsg': 'Failed to upload chunk %s: %s' % (chunk, e),
+                'Ret': -1003, }})
+        if r:
+            return r
+        if retry < config.UPLOAD_RETRIES:
+            time.sleep(0.5 * 2 ** retry)
+    logger.warning('Failed to upload chunk %s of %s: %s' % (
+        chunk + 1, chunks, r['BaseResponse']['RawMsg']))
+    return r
 
 def send_file(self, fileDir, toUserName=None, mediaId=None, file_=None):
     logger.debug('Request to send a file(mediaId: %s) to %s: %s' % (
@@ -403,7 +571,7 @@ def send_file(self, fileDir, toUserName=None, mediaId=None, file_=None):
         'User-Agent': config.USER_AGENT,
         'Content-Type': 'application/json;charset=UTF-8', }
     r = self.s.post(url, headers=headers,
-        data=json.dumps(data, ensure_ascii=False).encode('utf8'))
+        data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
 
 def send_image(self, fileDir=None, toUserName=None, mediaId=None, file_=None):
@@ -445,7 +613,7 @@ def send_image(self, fileDir=None, toUserName=None, mediaId=None, file_=None):
         'User-Agent': config.USER_AGENT,
         'Content-Type': 'application/json;charset=UTF-8', }
     r = self.s.post(url, headers=headers,
-        data=json.dumps(data, ensure_ascii=False).encode('utf8'))
+        data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
 
 def send_video(self, fileDir=None, toUserName=None, mediaId=None, file_=None):
@@ -484,7 +652,7 @@ def send_video(self, fileDir=None, toUserName=None, mediaId=None, file_=None):
         'User-Agent' : config.USER_AGENT,
         'Content-Type': 'application/json;charset=UTF-8', }
     r = self.s.post(url, headers=headers,
-        data=json.dumps(data, ensure_ascii=False).encode('utf8'))
+        data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
 
 def send(self, msg, toUserName=None, mediaId=None):
@@ -513,6 +681,10 @@ def send(self, msg, toUserName=None, mediaId=None):
         r = self.send_msg(msg, toUserName)
     return r
 
+def send_async(self, msg, toUserName=None, mediaId=None):
+    logger.debug('Request to queue a message to %s: %s' % (toUserName, msg))
+    return self.outbox.submit(msg, toUserName or self.storageClass.userName, mediaId)
+
 def revoke(self, msgId, toUserName, localId=None):
     url = '%s/webwxrevokemsg' % self.loginInfo['url']
     data = {
@@ -524,5 +696,5 @@ def revoke(self, msgId, toUserName, localId=None):
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent' : config.USER_AGENT }
     r = self.s.post(url, headers=headers,
-        data=json.dumps(data, ensure_ascii=False).encode('utf8'))
+        data=jsoncodec.dumps(data))
     return ReturnValue(rawResponse=r)
@@ -7,6 +7,8 @@ except ImportError:
 from ..log import set_logging
 from ..utils import test_connect
 from ..storage import templates
+from ..dispatcher import Dispatcher
+from .. import config
 
 logger = logging.getLogger('itchat')
 
@@ -50,21 +52,35 @@ def configured_reply(self):
     except Queue.Empty:
         pass
     else:
-        if isinstance(msg['User'], templates.User):
-            replyFn = self.functionDict['FriendChat'].get(msg['Type'])
-        elif isinstance(msg['User'], templates.MassivePlatform):
-            replyFn = self.functionDict['MpChat'].get(msg['Type'])
-        elif isinstance(msg['User'], templates.Chatroom):
-            replyFn = self.functionDict['GroupChat'].get(msg['Type'])
-        if replyFn is None:
-            r = None
+        if self.dispatcher is not None and self.dispatcher.alive:
+            self.dispatcher.submit(contact_key(self, msg), msg)
         else:
-            try:
-                r = replyFn(msg)
-                if r is not None:
-                    self.send(r, msg.get('FromUserName'))
-            except:
-                logger.warning(traceback.format_exc())
+            reply_msg(self, msg)
+
+def reply_msg(core, msg):
+    ''' call the registered function of msg and send its return value back '''
+    replyFn = None
+    if isinstance(msg['User'], templates.User):
+        replyFn = core.functionDict['FriendChat'].get(msg['Type'])
+    elif isinstance(msg['User'], templates.MassivePlatform):
+        replyFn = core.functionDict['MpChat'].get(msg['Type'])
+    elif isinstance(msg['User'], templates.Chatroom):
+        replyFn = core.functionDict['GroupChat'].get(msg['Type'])
+    if replyFn is None:
+        r = None
+    else:
+        try:
+            r = replyFn(msg)
+            if r is not None:
+                core.send(r, msg.get('FromUserName'))
+        except:
+            logger.warning(traceback.format_exc())
+
+def contact_key(core, msg):
+    ''' the other side of the conversation, messages sent by myself belong to the receiver '''
+    if msg.get('FromUserName') == core.storageClass.userName:
+        return msg.get('ToUserName')
+    return msg.get('FromUserName')
 
 def msg_register(self, msgType, isFriendChat=False, isGroupChat=False, isMpChat=False):
     ''' a decorator constructor
@@ -88,6 +104,8 @@ def run(self, debug=False, blockThread=True):
     logger.info('Start auto replying.')
     if debug:
         set_logging(loggingLevel=logging.DEBUG)
+    if config.DISPATCH_WORKERS > 0:
+        self.dispatcher = Dispatcher(lambda msg: reply_msg(self, msg)).start()
     def reply_fn():
         try:
             while self.alive:
@@ -98,6 +116,17 @@ def run(self, debug=False, blockThread=True):
             self.alive = False
             logger.debug('itchat received an ^C and exit.')
             logger.info('Bye~')
+        finally:
+            if self.dispatcher is not None:
+                logger.info('Dispatcher stats: %s' % self.dispatcher.stats())
+                self.dispatcher.stop(timeout=10)
+            if self.receiveStages:
+                logger.info('Receive stats: %s' % dict(
+                    (stage.name, stage.stats()) for stage in self.receiveStages))
+            logger.info('Outbox stats: %s' % self.outbox.stats())
+            self.outbox.stop(timeout=10)
+            if hasattr(self.s, 'stats'):
+                logger.info('Transport stats: %s' % self.s.stats())
     if blockThread:
         reply_fn()
     else:
@@ -11,6 +11,62 @@ DIR = os.getcwd()
 DEFAULT_QR = 'QR.png'
 TIMEOUT = (10, 60)
 
+# message handlers run on a pool of workers, messages of one contact keep their order
+# set ITCHAT_DISPATCH_WORKERS=0 to handle messages inline on the receiving thread
+DISPATCH_WORKERS = int(os.environ.get('ITCHAT_DISPATCH_WORKERS', 8))
+DISPATCH_MAX_PENDING = int(os.environ.get('ITCHAT_DISPATCH_MAX_PENDING', 100))
+
+# webwxsync batches are formatted and merged in order by a stage behind the receiving thread,
+# which queues at most RECEIVE_QUEUE_SIZE batches
+# set ITCHAT_RECEIVE_QUEUE_SIZE=0 to handle them inline on the receiving thread
+RECEIVE_QUEUE_SIZE = int(os.environ.get('ITCHAT_RECEIVE_QUEUE_SIZE', 100))
+
+# contact batches of webwxbatchgetcontact are fetched on a pool of workers
+# a failed batch is retried FETCH_RETRIES times before it is given up
+FETCH_WORKERS = int(os.environ.get('ITCHAT_FETCH_WORKERS', 4))
+FETCH_RETRIES = int(os.environ.get('ITCHAT_FETCH_RETRIES', 2))
+
+# hot reload status: contact changes are appended to a journal every HOTRELOAD_FLUSH_INTERVAL seconds
+# and the snapshot is rewritten once the journal grows past max(HOTRELOAD_JOURNAL_MIN, snapshot size)
+HOTRELOAD_FLUSH_INTERVAL = float(os.environ.get('ITCHAT_HOTRELOAD_FLUSH_INTERVAL', 10))
+HOTRELOAD_JOURNAL_MIN = int(os.environ.get('ITCHAT_HOTRELOAD_JOURNAL_MIN', 1 << 20))
+
+# connections kept alive per host by each channel of the transport (see transport.py)
+# the api pool should cover DISPATCH_WORKERS + FETCH_WORKERS to avoid reconnecting
+POLL_POOL_SIZE = int(os.environ.get('ITCHAT_POLL_POOL_SIZE', 2))
+API_POOL_SIZE = int(os.environ.get('ITCHAT_API_POOL_SIZE', 16))
+MEDIA_POOL_SIZE = int(os.environ.get('ITCHAT_MEDIA_POOL_SIZE', 8))
+# (connect, read) timeouts of each channel for calls not giving one
+POLL_TIMEOUT = TIMEOUT
+API_TIMEOUT = (10, 60)
+MEDIA_TIMEOUT = (10, 120)
+
+# chunks of a file are uploaded by at most UPLOAD_WORKERS requests at a time,
+# an upload failed after UPLOAD_RETRIES retries of a chunk is resumed
+# if the same file is sent to the same user within UPLOAD_RESUME_TIME seconds
+UPLOAD_WORKERS = int(os.environ.get('ITCHAT_UPLOAD_WORKERS', 4))
+UPLOAD_RETRIES = int(os.environ.get('ITCHAT_UPLOAD_RETRIES', 2))
+UPLOAD_RESUME_TIME = 3600
+
+# downloads of media and attachments larger than this are aborted
+DOWNLOAD_MAX_SIZE = int(os.environ.get('ITCHAT_DOWNLOAD_MAX_SIZE', 100 << 20))
+
+# send_async queues messages for SEND_WORKERS workers (see outbox.py), paced to SEND_RATE
+# messages a second in all and SEND_USER_RATE a second to each user, with bursts of up to
+# SEND_BURST and SEND_USER_BURST messages; queued texts of one user are joined while the
+# result stays within SEND_COALESCE_SIZE characters, set it to 0 to send them apart
+SEND_WORKERS = int(os.environ.get('ITCHAT_SEND_WORKERS', 2))
+SEND_RATE = float(os.environ.get('ITCHAT_SEND_RATE', 5))
+SEND_BURST = int(os.environ.get('ITCHAT_SEND_BURST', 10))
+SEND_USER_RATE = float(os.environ.get('ITCHAT_SEND_USER_RATE', 1))
+SEND_USER_BURST = int(os.environ.get('ITCHAT_SEND_USER_BURST', 3))
+SEND_COALESCE_SIZE = int(os.environ.get('ITCHAT_SEND_COALESCE_SIZE', 300))
+SEND_RETRIES = int(os.environ.get('ITCHAT_SEND_RETRIES', 2))
+
+# json of requests and responses goes through orjson when it is installed (see jsoncodec.py)
+# set ITCHAT_JSON_CODEC=json to use the standard library
+JSON_CODEC = os.environ.get('ITCHAT_JSON_CODEC', 'orjson')
+
 USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2840.71 Safari/537.36'
 
 UOS_PATCH_CLIENT_VERSION = '2.0.0'
@@ -1,6 +1,6 @@
-import requests
-
 from . import storage
+from .transport import Transport
+from .outbox import Outbox
 
 class Core(object):
     def __init__(self):
@@ -21,11 +21,15 @@ class Core(object):
         self.chatroomList = self.storageClass.chatroomList
         self.msgList = self.storageClass.msgList
         self.loginInfo = {}
-        self.s = requests.Session()
+        self.s = Transport()
         self.uuid = None
         self.functionDict = {'FriendChat': {}, 'GroupChat': {}, 'MpChat': {}}
         self.useHotReload, self.hotReloadDir = False, 'itchat.pkl'
         self.receivingRetryCount = 5
+        self.dispatcher = None
+        self.receiveStages = []
+        self.stateStore = None
+        self.outbox = Outbox(self)
     def login(self, enableCmdQR=False, picDir=None, qrCallback=None,
             loginCallback=None, exitCallback=None):
         ''' log in like web wechat does
@@ -287,7 +291,7 @@ class Core(object):
             it is defined in components/contact.py
         '''
         raise NotImplementedError()
-    def send_raw_msg(self, msgType, content, toUserName):
+    def send_raw_msg(self, msgType, content, toUserName, clientMsgId=None):
         ''' many messages are sent in a common way
             for demo
                 .. code:: python
@@ -351,6 +355,7 @@ class Core(object):
                 - mediaId: mediaId for file. 
                     - if set, file will not be uploaded twice
                 - toUserName: 'UserName' key of friend dict
+                - clientMsgId: sent as LocalID and ClientMsgId, pass the same one to resend a message
             it is defined in components/messages.py
         '''
         raise NotImplementedError()
@@ -366,6 +371,14 @@ class Core(object):
             it is defined in components/messages.py
         '''
         raise NotImplementedError()
+    def send_async(self, msg, toUserName=None, mediaId=None):
+        ''' queue a message to be sent like send, without waiting for the network
+            returns a concurrent.futures.Future of the ReturnValue
+                - messages to one user keep their order and are paced (see outbox.py)
+                - short texts queued for one user may be joined into one message
+            it is defined in components/messages.py
+        '''
+        raise NotImplementedError()
     def revoke(self, msgId, toUserName, localId=None):
         ''' revoke message with its and msgId
             for options
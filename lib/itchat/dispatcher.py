@@ -0,0 +1,97 @@
+import logging, threading, time, traceback
+from collections import deque
+
+from . import config
+
+logger = logging.getLogger('itchat')
+
+class Dispatcher(object):
+    ''' run message handlers on a pool of worker threads
+        messages of the same contact are handled one by one in FIFO order
+        while different contacts are handled in parallel
+            - workerCount: number of worker threads
+            - maxPending: max queued messages per contact, newer ones are dropped
+    '''
+    def __init__(self, handler, workerCount=None, maxPending=None):
+        self.handler = handler
+        self.workerCount = workerCount or config.DISPATCH_WORKERS
+        self.maxPending = maxPending or config.DISPATCH_MAX_PENDING
+        self.lock = threading.Condition()
+        self.pending = {}  # key -> deque of (msg, enqueuedTime)
+        self.ready = deque()  # keys with pending messages and no running handler
+        self.running = set()
+        self.workers = []
+        self.alive = False
+        self.dispatched = self.dropped = 0
+        self.totalWait = self.maxWait = 0.0
+    def start(self):
+        with self.lock:
+            if self.alive:
+                return self
+            self.alive = True
+        for i in range(self.workerCount):
+            worker = threading.Thread(target=self._work, name='itchat-dispatcher-%s' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+        logger.info('Dispatcher started with %s workers.' % self.workerCount)
+        return self
+    def stop(self, timeout=None):
+        with self.lock:
+            self.alive = False
+            self.lock.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+    def submit(self, key, msg):
+        ''' queue msg for the contact identified by key
+            returns False if the contact already has too many pending messages
+        '''
+        with self.lock:
+            queue = self.pending.setdefault(key, deque())
+            if len(queue) >= self.maxPending:
+                self.dropped += 1
+                logger.warning('Too many pending messages from %s, message dropped.' % key)
+                return False
+            queue.append((msg, time.time()))
+            if key not in self.running and len(queue) == 1:
+                self.ready.append(key)
+                self.lock.notify()
+            return True
+    def _work(self):
+        while True:
+            with self.lock:
+                while self.alive and not self.ready:
+                    self.lock.wait()
+                if not self.alive:
+                    return
+                key = self.ready.popleft()
+                msg, enqueuedTime = self.pending[key].popleft()
+                self.running.add(key)
+                wait = time.time() - enqueuedTime
+                self.dispatched += 1
+                self.totalWait += wait
+                self.maxWait = max(self.maxWait, wait)
+            try:
+                self.handler(msg)
+            except:
+                logger.warning(traceback.format_exc())
+            finally:
+                with self.lock:
+                    self.running.discard(key)
+                    if self.pending[key]:
+                        # let other contacts go first before the next message of this contact
+                        self.ready.append(key)
+                        self.lock.notify()
+                    else:
+                        del self.pending[key]
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workerCount,
+                'dispatched': self.dispatched,
+                'dropped': self.dropped,
+                'queued': sum(len(q) for q in self.pending.values()),
+                'busyContacts': len(self.running),
+                'avgQueueWait': self.totalWait / self.dispatched if self.dispatched else 0.0,
+                'maxQueueWait': self.maxWait, }
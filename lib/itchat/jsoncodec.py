@@ -0,0 +1,50 @@
+''' json of requests and responses
+    orjson is used if installed, otherwise the standard library
+        - loads takes the raw bytes of a response, undecodable bytes are replaced
+        - dumps returns utf8 bytes, characters are not escaped
+    set ITCHAT_JSON_CODEC=json to use the standard library anyway
+'''
+import json, logging
+
+from . import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('itchat')
+
+def std_loads(s):
+    if isinstance(s, bytes):
+        s = s.decode('utf8', 'replace')
+    return json.loads(s)
+
+def std_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False).encode('utf8', 'replace')
+
+def orjson_loads(s):
+    try:
+        return orjson.loads(s)
+    except orjson.JSONDecodeError:
+        # orjson refuses invalid utf8 which the standard library gets replaced
+        return std_loads(s)
+
+def orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # keys other than str, integers over 64 bits, lone surrogates
+        return std_dumps(obj)
+
+CODECS = {'json': (std_loads, std_dumps)}
+if orjson is not None:
+    CODECS['orjson'] = (orjson_loads, orjson_dumps)
+
+if config.JSON_CODEC in CODECS:
+    name = config.JSON_CODEC
+else:
+    name = 'json'
+    if config.JSON_CODEC != 'orjson':
+        logger.warning('JSON codec %s is not available, json is used.' % config.JSON_CODEC)
+loads, dumps = CODECS[name]
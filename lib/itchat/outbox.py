@@ -0,0 +1,214 @@
+import logging, threading, time, traceback
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+
+from . import config
+from .returnvalues import ReturnValue
+
+logger = logging.getLogger('itchat')
+
+# Ret of webwxsendmsg when messages are sent too fast
+RETRY_RETS = frozenset((1205,))
+
+class TokenBucket(object):
+    ''' rate tokens a second, at most burst of them saved up '''
+    def __init__(self, rate, burst):
+        self.rate, self.burst = float(rate), max(1, burst)
+        self.tokens, self.last = float(self.burst), time.time()
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+    def delay(self, now):
+        ''' seconds till a token is available, 0 if there is one '''
+        self._refill(now)
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0
+        return (1 - self.tokens) / self.rate
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+class OutMessage(object):
+    ''' a queued message, msgType is None for messages sent through core.send '''
+    def __init__(self, msgType, content, mediaId=None):
+        self.msgType, self.content, self.mediaId = msgType, content, mediaId
+        self.futures = [Future()]
+        self.clientMsgId = None
+        self.enqueuedTime = time.time()
+
+class Outbox(object):
+    ''' send messages on a pool of worker threads, callers get a Future of the ReturnValue
+        - messages to the same user are sent one by one in FIFO order
+        - sending is paced by a token bucket shared by all users and one bucket per user
+        - short texts queued one after another for the same user are joined into one message,
+          their futures all get the result of it
+        - texts failed by the network or by the frequency limit are retried with the
+          same ClientMsgId, so a retry of a message the server did get is not shown twice
+        other messages are sent once, their uploads retry by themselves
+            - workerCount: number of worker threads, config.SEND_WORKERS by default
+    '''
+    def __init__(self, core, workerCount=None):
+        self.core = core
+        self.workerCount = workerCount or config.SEND_WORKERS
+        self.lock = threading.Condition()
+        self.pending = {} # toUserName -> deque of OutMessage
+        self.ready = deque() # users with pending messages and no message being sent
+        self.running = set()
+        self.bucket = TokenBucket(config.SEND_RATE, config.SEND_BURST)
+        self.userBuckets = {}
+        self.workers = []
+        self.alive = False
+        self.sent = self.failed = self.retried = self.coalesced = self.throttled = 0
+        self.totalWait = self.maxWait = 0.0
+    def start(self):
+        with self.lock:
+            if self.alive:
+                return self
+            self.alive = True
+        for i in range(self.workerCount):
+            worker = threading.Thread(target=self._work, name='itchat-outbox-%s' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+        return self
+    def stop(self, timeout=None):
+        ''' stop once the queued messages are sent '''
+        with self.lock:
+            self.alive = False
+            self.lock.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+    def submit_msg(self, msg, toUserName):
+        ''' queue a text message, returns a Future '''
+        with self.lock:
+            queue = self.pending.get(toUserName)
+            last = queue[-1] if queue else None
+            if last is not None and last.msgType == 1 and \
+                    len(last.content) + len(msg) + 1 <= config.SEND_COALESCE_SIZE:
+                last.content += '\n' + msg
+                last.futures.append(Future())
+                self.coalesced += 1
+                return last.futures[-1]
+        return self._submit(toUserName, OutMessage(1, msg))
+    def submit(self, msg, toUserName, mediaId=None):
+        ''' queue msg in the format of core.send, returns a Future '''
+        if msg and msg[:5] not in ('@fil@', '@img@', '@msg@', '@vid@'):
+            return self.submit_msg(msg, toUserName)
+        elif msg and msg[:5] == '@msg@':
+            return self.submit_msg(msg[5:], toUserName)
+        return self._submit(toUserName, OutMessage(None, msg, mediaId))
+    def _submit(self, toUserName, outMessage):
+        self.start()
+        with self.lock:
+            queue = self.pending.setdefault(toUserName, deque())
+            queue.append(outMessage)
+            if toUserName not in self.running and len(queue) == 1:
+                self.ready.append(toUserName)
+                self.lock.notify()
+        return outMessage.futures[0]
+    def _bucket_of(self, toUserName):
+        bucket = self.userBuckets.get(toUserName)
+        if bucket is None:
+            bucket = self.userBuckets[toUserName] = TokenBucket(
+                config.SEND_USER_RATE, config.SEND_USER_BURST)
+        return bucket
+    def _take(self):
+        ''' pop a user allowed to send now, or return the seconds to wait for one '''
+        now = time.time()
+        wait = self.bucket.delay(now)
+        if wait:
+            return None, wait
+        for i in range(len(self.ready)):
+            toUserName = self.ready[0]
+            bucket = self._bucket_of(toUserName)
+            delay = bucket.delay(now)
+            if not delay:
+                self.ready.popleft()
+                self.bucket.take(now)
+                bucket.take(now)
+                return toUserName, 0
+            self.ready.rotate(-1)
+            wait = min(wait or delay, delay)
+        return None, wait
+    def _work(self):
+        while True:
+            with self.lock:
+                while 1:
+                    if not self.ready:
+                        if not self.alive:
+                            return
+                        self.lock.wait()
+                        continue
+                    toUserName, wait = self._take()
+                    if toUserName is not None:
+                        break
+                    self.throttled += 1
+                    self.lock.wait(wait)
+                outMessage = self.pending[toUserName].popleft()
+                self.running.add(toUserName)
+                wait = time.time() - outMessage.enqueuedTime
+                self.totalWait += wait
+                self.maxWait = max(self.maxWait, wait)
+            try:
+                r = self._send(toUserName, outMessage)
+            except:
+                logger.warning(traceback.format_exc())
+                r = ReturnValue({'BaseResponse': {
+                    'ErrMsg': 'Failed to send the message.',
+                    'Ret': -1003, }})
+            with self.lock:
+                self.running.discard(toUserName)
+                if r:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                if self.pending[toUserName]:
+                    self.ready.append(toUserName)
+                else:
+                    del self.pending[toUserName]
+                    if self._bucket_of(toUserName).full(time.time()):
+                        del self.userBuckets[toUserName]
+                self.lock.notify_all()
+            for future in outMessage.futures:
+                future.set_result(r)
+    def _send(self, toUserName, outMessage):
+        if outMessage.msgType is None:
+            return self.core.send(outMessage.content, toUserName, outMessage.mediaId)
+        outMessage.clientMsgId = int(time.time() * 1e4)
+        for retry in range(config.SEND_RETRIES + 1):
+            if retry:
+                time.sleep(0.5 * 2 ** retry)
+                with self.lock:
+                    self.retried += 1
+            try:
+                r = self.core.send_raw_msg(outMessage.msgType, outMessage.content,
+                    toUserName, outMessage.clientMsgId)
+            except requests.exceptions.RequestException as e:
+                r = ReturnValue({'BaseResponse': {
+                    'ErrMsg': 'Failed to send the message: %s' % e,
+                    'Ret': -1003, }})
+                continue
+            if r['BaseResponse'].get('Ret') not in RETRY_RETS:
+                return r
+        logger.warning('Failed to send a message to %s after %s retries: %s' % (
+            toUserName, config.SEND_RETRIES, r['BaseResponse'].get('RawMsg')))
+        return r
+    def stats(self):
+        with self.lock:
+            done = self.sent + self.failed
+            return {
+                'workers': self.workerCount,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'coalesced': self.coalesced,
+                'throttled': self.throttled,
+                'queued': sum(len(q) for q in self.pending.values()),
+                'avgQueueWait': self.totalWait / done if done else 0.0,
+                'maxQueueWait': self.maxWait, }
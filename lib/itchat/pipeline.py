@@ -0,0 +1,83 @@
+import logging, threading, time, traceback
+from collections import deque
+
+from . import config
+
+logger = logging.getLogger('itchat')
+
+class Stage(object):
+    ''' one worker thread calling handler on the items put, in FIFO order
+        put() blocks while maxSize items are queued, holding back the stage before it
+            - name: shown in logs and stats
+            - maxSize: max queued items, config.RECEIVE_QUEUE_SIZE by default
+    '''
+    def __init__(self, name, handler, maxSize=None):
+        self.name = name
+        self.handler = handler
+        self.maxSize = maxSize or config.RECEIVE_QUEUE_SIZE
+        self.lock = threading.Condition()
+        self.queue = deque() # (item, enqueuedTime)
+        self.thread = None
+        self.alive = False
+        self.processed = self.failed = self.blocked = self.maxQueued = 0
+        self.totalWait = self.maxWait = self.totalTime = 0.0
+    def start(self):
+        with self.lock:
+            if self.alive:
+                return self
+            self.alive = True
+        self.thread = threading.Thread(target=self._work, name='itchat-%s' % self.name)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return self
+    def stop(self, timeout=None):
+        ''' stop once the queued items are handled '''
+        with self.lock:
+            self.alive = False
+            self.lock.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+    def put(self, item):
+        with self.lock:
+            if self.alive and self.maxSize <= len(self.queue):
+                self.blocked += 1
+                if self.blocked % 100 == 1:
+                    logger.warning('%s stage is full, waiting for it to catch up (%s times so far).' % (
+                        self.name, self.blocked))
+                while self.alive and self.maxSize <= len(self.queue):
+                    self.lock.wait()
+            self.queue.append((item, time.time()))
+            self.maxQueued = max(self.maxQueued, len(self.queue))
+            self.lock.notify_all()
+    def _work(self):
+        while True:
+            with self.lock:
+                while self.alive and not self.queue:
+                    self.lock.wait()
+                if not self.queue:
+                    return
+                item, enqueuedTime = self.queue.popleft()
+                self.lock.notify_all()
+                wait = time.time() - enqueuedTime
+                self.totalWait += wait
+                self.maxWait = max(self.maxWait, wait)
+            start = time.time()
+            try:
+                self.handler(item)
+            except:
+                self.failed += 1
+                logger.warning(traceback.format_exc())
+            with self.lock:
+                self.processed += 1
+                self.totalTime += time.time() - start
+    def stats(self):
+        with self.lock:
+            return {
+                'processed': self.processed,
+                'failed': self.failed,
+                'queued': len(self.queue),
+                'maxQueued': self.maxQueued,
+                'blocked': self.blocked,
+                'avgQueueWait': self.totalWait / self.processed if self.processed else 0.0,
+                'maxQueueWait': self.maxWait,
+                'avgTime': self.totalTime / self.processed if self.processed else 0.0, }
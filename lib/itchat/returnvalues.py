@@ -1,4 +1,6 @@
 #coding=utf8
+from . import jsoncodec
+
 TRANSLATE = 'Chinese'
 
 class ReturnValue(dict):
@@ -22,7 +24,7 @@ class ReturnValue(dict):
     def __init__(self, returnValueDict={}, rawResponse=None):
         if rawResponse:
             try:
-                returnValueDict = rawResponse.json()
+                returnValueDict = jsoncodec.loads(rawResponse.content)
             except ValueError:
                 returnValueDict = {
                     'BaseResponse': {
@@ -3,8 +3,12 @@ from threading import Lock
 
 from .messagequeue import Queue
 from .templates import (
-    ContactList, AbstractUserDict, User,
+    ContactList, IndexedContactList, AbstractUserDict, User,
     MassivePlatform, Chatroom, ChatroomMember)
+from .contactindex import ContactIndex
+from .statestore import StateStore
+
+FRIEND_FIELDS = ('RemarkName', 'NickName', 'Alias')
 
 def contact_change(fn):
     def _contact_change(core, *args, **kwargs):
@@ -17,16 +21,19 @@ class Storage(object):
         self.userName          = None
         self.nickName          = None
         self.updateLock        = Lock()
-        self.memberList        = ContactList()
-        self.mpList            = ContactList()
-        self.chatroomList      = ContactList()
+        self.memberList        = IndexedContactList()
+        self.mpList            = IndexedContactList()
+        self.chatroomList      = IndexedContactList()
         self.msgList           = Queue(-1)
         self.lastInputUserName = None
         self.memberList.set_default_value(contactClass=User)
+        self.memberList.set_index(FRIEND_FIELDS)
         self.memberList.core = core
         self.mpList.set_default_value(contactClass=MassivePlatform)
+        self.mpList.set_index(gramField='NickName')
         self.mpList.core = core
         self.chatroomList.set_default_value(contactClass=Chatroom)
+        self.chatroomList.set_index(gramField='NickName')
         self.chatroomList.core = core
     def dumps(self):
         return {
@@ -59,15 +66,27 @@ class Storage(object):
                 chatroom['Self'].core = chatroom.core
                 chatroom['Self'].chatroom = chatroom
         self.lastInputUserName = j.get('lastInputUserName', None)
+    def reindex(self, contact):
+        ''' refresh indexes and snapshots of a contact changed in place
+            must be called with updateLock held '''
+        for contactList in (self.memberList, self.chatroomList, self.mpList):
+            contactList.reindex(contact)
+    def search_contact(self, userName):
+        ''' find a friend, chatroom or mp by userName without copying it
+            must be called with updateLock held '''
+        for contactList in (self.memberList, self.chatroomList, self.mpList):
+            contact = contactList.contactIndex.get(userName)
+            if contact is not None:
+                return contact
     def search_friends(self, name=None, userName=None, remarkName=None, nickName=None,
             wechatAccount=None):
         with self.updateLock:
             if (name or userName or remarkName or nickName or wechatAccount) is None:
-                return copy.deepcopy(self.memberList[0]) # my own account
+                return self.memberList.contactIndex.view(self.memberList[0]) # my own account
             elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.memberList.contactIndex.get(userName)
+                if m is not None:
+                    return self.memberList.contactIndex.view(m)
             else:
                 matchDict = {
                     'RemarkName' : remarkName,
@@ -77,41 +96,30 @@ class Storage(object):
                     if matchDict[k] is None:
                         del matchDict[k]
                 if name: # select based on name
-                    contact = []
-                    for m in self.memberList:
-                        if any([m.get(k) == name for k in ('RemarkName', 'NickName', 'Alias')]):
-                            contact.append(m)
+                    contact = self.memberList.contactIndex.find_any(FRIEND_FIELDS, name)
+                elif matchDict: # narrow down with one of the conditions
+                    contact = self.memberList.contactIndex.find(*next(iter(matchDict.items())))
                 else:
                     contact = self.memberList[:]
                 if matchDict: # select again based on matchDict
-                    friendList = []
-                    for m in contact:
-                        if all([m.get(k) == v for k, v in matchDict.items()]):
-                            friendList.append(m)
-                    return copy.deepcopy(friendList)
-                else:
-                    return copy.deepcopy(contact)
+                    contact = [m for m in contact
+                        if all([m.get(k) == v for k, v in matchDict.items()])]
+                return [self.memberList.contactIndex.view(m) for m in contact]
     def search_chatrooms(self, name=None, userName=None):
         with self.updateLock:
             if userName is not None:
-                for m in self.chatroomList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.chatroomList.contactIndex.get(userName)
+                if m is not None:
+                    return self.chatroomList.contactIndex.view(m)
             elif name is not None:
-                matchList = []
-                for m in self.chatroomList:
-                    if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
-                return matchList
+                return [self.chatroomList.contactIndex.view(m)
+                    for m in self.chatroomList.contactIndex.search(name)]
     def search_mps(self, name=None, userName=None):
         with self.updateLock:
             if userName is not None:
-                for m in self.mpList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.mpList.contactIndex.get(userName)
+                if m is not None:
+                    return self.mpList.contactIndex.view(m)
             elif name is not None:
-                matchList = []
-                for m in self.mpList:
-                    if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
-                return matchList
+                return [self.mpList.contactIndex.view(m)
+                    for m in self.mpList.contactIndex.search(name)]
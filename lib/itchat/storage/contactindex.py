@@ -0,0 +1,99 @@
+import copy
+
+class ContactIndex(object):
+    ''' hash indexes over a list of contact dicts
+        - UserName and every key in fields are matched exactly in O(1)
+        - gramField is matched by substring through a character & bigram index
+        - snapshot() hands out one frozen copy of a contact until it is updated
+          and view() a writable copy of that snapshot for one reader
+        contacts changed in place must be passed to update() again
+    '''
+    def __init__(self, fields=(), gramField=None):
+        self.fields = tuple(fields)
+        self.gramField = gramField
+        self.clear()
+    def clear(self):
+        self.entries = {} # id(contact) -> (seq, contact, indexed keys)
+        self.userNames = {}
+        self.values = dict((field, {}) for field in self.fields)
+        self.grams = {}
+        self.snapshots = {}
+        self.seq = 0
+    def rebuild(self, contacts):
+        self.clear()
+        for contact in contacts:
+            self.update(contact)
+    def update(self, contact):
+        ''' add contact to the index or refresh its entry '''
+        contactId = id(contact)
+        entry = self.entries.get(contactId)
+        if entry is None:
+            seq = self.seq
+            self.seq += 1
+        else:
+            seq = entry[0]
+            self._unlink(contactId, entry[2])
+            # readers holding the old snapshot keep it, new readers get a new version
+            self.snapshots.pop(contactId, None)
+        keys = (contact.get('UserName'),
+            tuple(contact.get(field) for field in self.fields),
+            self._split_grams(contact.get(self.gramField)) if self.gramField else ())
+        self.entries[contactId] = (seq, contact, keys)
+        self.userNames.setdefault(keys[0], set()).add(contactId)
+        for field, value in zip(self.fields, keys[1]):
+            self.values[field].setdefault(value, set()).add(contactId)
+        for gram in keys[2]:
+            self.grams.setdefault(gram, set()).add(contactId)
+    def _unlink(self, contactId, keys):
+        tables = [(self.userNames, keys[0])] + \
+            [(self.values[field], value) for field, value in zip(self.fields, keys[1])] + \
+            [(self.grams, gram) for gram in keys[2]]
+        for table, key in tables:
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(contactId)
+                if not bucket:
+                    del table[key]
+    @staticmethod
+    def _split_grams(text):
+        text = text or ''
+        return set(text) | set(text[i:i+2] for i in range(len(text) - 1))
+    def _contacts(self, contactIds):
+        ''' contacts in list order '''
+        return [entry[1] for entry in sorted(self.entries[i] for i in contactIds)]
+    def snapshot(self, contact):
+        ''' a frozen copy of contact shared by all readers until contact is updated '''
+        contactId = id(contact)
+        r = self.snapshots.get(contactId)
+        if r is None:
+            r = copy.deepcopy(contact)
+            r.freeze()
+            if contactId in self.entries:
+                self.snapshots[contactId] = r
+        return r
+    def view(self, contact):
+        ''' a copy of contact for one reader, sharing the snapshot until it is changed '''
+        return self.snapshot(contact).writable_copy()
+    def contains(self, contact):
+        return id(contact) in self.entries
+    def get(self, userName):
+        ''' the first contact with userName, or None '''
+        bucket = self.userNames.get(userName)
+        return self._contacts(bucket)[0] if bucket else None
+    def find(self, field, value):
+        return self._contacts(self.values[field].get(value, ()))
+    def find_any(self, fields, value):
+        ''' contacts whose value of any of fields equals value '''
+        contactIds = set()
+        for field in fields:
+            contactIds.update(self.values[field].get(value, ()))
+        return self._contacts(contactIds)
+    def search(self, text):
+        ''' contacts whose gramField contains text '''
+        if not text:
+            return self._contacts(self.entries)
+        grams = [text] if len(text) == 1 else [text[i:i+2] for i in range(len(text) - 1)]
+        buckets = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        contactIds = buckets[0].intersection(*buckets[1:])
+        return [c for c in self._contacts(contactIds)
+            if text in (c.get(self.gramField) or '')]
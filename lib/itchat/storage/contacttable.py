@@ -0,0 +1,119 @@
+import sys
+from array import array
+
+from ..utils import friendInfoTemplate
+
+STRING_FIELDS = tuple(k for k, v in friendInfoTemplate.items() if v == '')
+NUMBER_FIELDS = tuple(k for k, v in friendInfoTemplate.items() if v == 0) + ('MemberStatus',)
+
+class ContactTable(object):
+    ''' columnar storage of contact dicts
+        - string fields are interned and kept in one list per field
+        - numeric fields are kept in one array per field
+        - a column is only created once some row has a non-empty value for that field,
+          until then the rows having the field only set its bit in present
+        - other keys, and values of unexpected types, are kept per row in extras
+    '''
+    fieldBits = dict((k, 1 << i) for i, k in enumerate(STRING_FIELDS + NUMBER_FIELDS))
+    numberFields = frozenset(NUMBER_FIELDS)
+    def __init__(self):
+        self.columns = {}
+        self.emptyFields = {} # fields set by some row but only with the empty value
+        self.present = array('Q') # bit mask of the column fields each row has
+        self.extras = {} # row -> {key: value}
+        self.rowOf = {} # UserName -> row
+    def __len__(self):
+        return len(self.present)
+    def _empty(self, field):
+        return 0 if field in self.numberFields else ''
+    def _column(self, field):
+        column = self.columns.get(field)
+        if column is None:
+            if field in self.numberFields:
+                column = array('q', [0]) * len(self)
+            else:
+                column = [''] * len(self)
+            self.columns[field] = column
+            self.emptyFields.pop(field, None)
+        return column
+    def _fits(self, field, value):
+        if field in self.numberFields:
+            return type(value) is int and -2 ** 63 <= value < 2 ** 63
+        return type(value) is str
+    def append(self, d):
+        row = len(self)
+        self.present.append(0)
+        for field, column in self.columns.items():
+            column.append(self._empty(field))
+        for k, v in d.items():
+            self.set(row, k, v)
+        return row
+    def set(self, row, k, v):
+        if k == 'MemberList':
+            return
+        if k == 'UserName':
+            oldUserName = self.get(row, 'UserName')
+            if self.rowOf.get(oldUserName) == row:
+                del self.rowOf[oldUserName]
+            self.rowOf[v] = row
+        bit = self.fieldBits.get(k)
+        if bit is not None and self._fits(k, v):
+            if k in self.columns or v != self._empty(k):
+                self._column(k)[row] = v if k in self.numberFields else sys.intern(v)
+            else:
+                self.emptyFields[k] = v
+            self.present[row] |= bit
+            extras = self.extras.get(row)
+            if extras and k in extras:
+                del extras[k]
+        else:
+            if bit is not None:
+                self.present[row] &= ~bit
+            self.extras.setdefault(row, {})[k] = v
+    def unset(self, row, k):
+        bit = self.fieldBits.get(k)
+        if bit is not None:
+            self.present[row] &= ~bit
+        extras = self.extras.get(row)
+        if extras and k in extras:
+            del extras[k]
+        if k == 'UserName':
+            self.rowOf = dict((u, r) for u, r in self.rowOf.items() if r != row)
+    def update(self, row, d):
+        ''' update a row like utils.update_info_dict, only changed fields are written '''
+        for k, v in d.items():
+            if isinstance(v, (tuple, list, dict)):
+                continue
+            oldValue = self.get(row, k)
+            if oldValue != v and (oldValue is None or v not in (None, '', '0', 0)):
+                self.set(row, k, v)
+    def get(self, row, k, d=None):
+        bit = self.fieldBits.get(k)
+        if bit is not None and self.present[row] & bit:
+            return self.columns[k][row] if k in self.columns else self._empty(k)
+        return self.extras.get(row, {}).get(k, d)
+    def row_dict(self, row):
+        bits = self.present[row]
+        d = dict((k, column[row]) for k, column in self.columns.items()
+            if bits & self.fieldBits[k])
+        for k, v in self.emptyFields.items():
+            if bits & self.fieldBits[k]:
+                d[k] = v
+        d.update(self.extras.get(row, ()))
+        return d
+    def take(self, rows):
+        ''' a new table holding the given rows in the given order '''
+        r = ContactTable()
+        rows = list(rows)
+        for k, column in self.columns.items():
+            values = [column[i] for i in rows]
+            r.columns[k] = array('q', values) if k in self.numberFields else values
+        r.emptyFields = dict(self.emptyFields)
+        r.present = array('Q', [self.present[i] for i in rows])
+        for newRow, oldRow in enumerate(rows):
+            if oldRow in self.extras:
+                r.extras[newRow] = dict(self.extras[oldRow])
+            userName = r.get(newRow, 'UserName')
+            if userName is not None:
+                r.rowOf[userName] = newRow
+        return r
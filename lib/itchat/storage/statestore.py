@@ -0,0 +1,268 @@
+import os, pickle, struct, threading, logging, traceback
+from collections import OrderedDict
+
+from .. import config
+from .templates import CompactContactList
+
+logger = logging.getLogger('itchat')
+
+MAGIC = b'ITCHATS2'
+TRAILER = struct.Struct('<Q') # offset of the header
+LIST_NAMES = ('memberList', 'mpList', 'chatroomList')
+
+def plain_contact(contact):
+    ''' contact as a dict to be pickled, members are stored apart '''
+    return dict((k, v) for k, v in contact.items() if k != 'MemberList')
+
+class SnapshotFile(object):
+    ''' an opened snapshot, member tables are read from it on demand '''
+    def __init__(self, fileDir):
+        self.f = open(fileDir, 'rb')
+        self.lock = threading.Lock()
+    def read(self, offset, length):
+        with self.lock:
+            self.f.seek(offset)
+            return self.f.read(length)
+
+class MemberPage(object):
+    ''' loader of the member table of a chatroom kept in a snapshot '''
+    def __init__(self, snapshot, offset, length):
+        self.snapshot, self.offset, self.length = snapshot, offset, length
+    def raw(self):
+        return self.snapshot.read(self.offset, self.length)
+    def __call__(self):
+        return pickle.loads(self.raw())
+
+class StateStore(object):
+    ''' hot reload status kept as a snapshot plus an append-only journal
+        - the snapshot holds login status and contacts, the member table of
+          each chatroom is stored apart and only paged in on first access
+        - the journal holds contacts changed since the snapshot, it is appended
+          every config.HOTRELOAD_FLUSH_INTERVAL seconds by a background thread
+        - once the journal outgrows the snapshot, both are rewritten as a new snapshot
+        snapshot and journal carry a generation, a journal of another generation is ignored
+    '''
+    def __init__(self, core, fileDir):
+        self.core = core
+        self.fileDir = fileDir
+        self.journalDir = fileDir + '.journal'
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.generation = self.snapshotSize = 0
+        self.journalSize = None # None until a journal of this generation exists
+        self.session = None # pickled session last written
+        self.thread = None
+        self.stopEvent = threading.Event()
+    @property
+    def alive(self):
+        return self.thread is not None
+    def read(self):
+        ''' read snapshot and journal without touching core
+            returns the status, or None if fileDir is not a snapshot of this format
+        '''
+        with open(self.fileDir, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            f.seek(-TRAILER.size, os.SEEK_END)
+            size = f.tell() + TRAILER.size
+            f.seek(TRAILER.unpack(f.read(TRAILER.size))[0])
+            status = pickle.load(f)
+            f.seek(status['contacts'][0])
+            session, lists = pickle.loads(f.read(status['contacts'][1]))
+        status['size'], status['session'] = size, session
+        for name in LIST_NAMES:
+            status[name] = OrderedDict((c.get('UserName'), c) for c in lists[name])
+        self._replay(status)
+        return status
+    def _replay(self, status):
+        self.journalSize = None
+        try:
+            f = open(self.journalDir, 'rb')
+        except IOError:
+            return
+        with f:
+            try:
+                if pickle.load(f) != ('generation', status['generation']):
+                    logger.debug('Journal of another generation is ignored.')
+                    return
+                self.journalSize = f.tell()
+                while 1:
+                    for record in pickle.load(f):
+                        self._apply(status, record)
+                    self.journalSize = f.tell()
+            except EOFError:
+                pass
+            except Exception:
+                logger.warning('Journal is cut short at %s bytes, the rest is ignored.' %
+                    self.journalSize)
+    def _apply(self, status, record):
+        if record[0] == 'session':
+            status['session'] = pickle.loads(record[1])
+        elif record[0] == 'put':
+            name, contact, members = record[1:]
+            status[name][contact.get('UserName')] = contact
+            if members is not None:
+                status['members'][contact.get('UserName')] = members
+        elif record[0] == 'del':
+            name, userName = record[1:]
+            status[name].pop(userName, None)
+            if name == 'chatroomList':
+                status['members'].pop(userName, None)
+    def restore(self, status):
+        ''' load the status returned by read() into core
+            members of chatrooms stay on disk until they are accessed
+        '''
+        storage = self.core.storageClass
+        self.snapshot = SnapshotFile(self.fileDir)
+        self.generation, self.snapshotSize = status['generation'], status['size']
+        with storage.updateLock:
+            for k, v in status['session']['storage'].items():
+                setattr(storage, k, v)
+            for name in LIST_NAMES:
+                contactList = getattr(storage, name)
+                del contactList[:]
+                for contact in status[name].values():
+                    contactList.append(contact)
+            for chatroom in storage.chatroomList:
+                members = status['members'].get(chatroom['UserName'])
+                if isinstance(members, tuple):
+                    chatroom['MemberList'].set_loader(MemberPage(self.snapshot, *members))
+                elif members is not None:
+                    chatroom['MemberList'].table = members
+                if 'Self' in chatroom:
+                    chatroom['Self'].core = chatroom.core
+                    chatroom['Self'].chatroom = chatroom
+            self._track()
+    def _track(self):
+        for name in LIST_NAMES:
+            getattr(self.core.storageClass, name).changes = {}
+    def _session(self):
+        storage = self.core.storageClass
+        return {
+            'loginInfo' : self.core.loginInfo,
+            'cookies'   : self.core.s.cookies.get_dict(),
+            'storage'   : {
+                'userName'          : storage.userName,
+                'nickName'          : storage.nickName,
+                'lastInputUserName' : storage.lastInputUserName, }, }
+    def flush(self):
+        ''' append the contacts changed since last flush to the journal
+            the first flush writes the snapshot instead
+        '''
+        with self.lock:
+            if self.snapshot is None or self.journalSize is None:
+                return self._checkpoint()
+            storage = self.core.storageClass
+            with storage.updateLock:
+                records = []
+                session = pickle.dumps(self._session(), -1)
+                if session != self.session:
+                    records.append(('session', session))
+                for name in LIST_NAMES:
+                    contactList = getattr(storage, name)
+                    changes, contactList.changes = contactList.changes or {}, {}
+                    for userName, contact in changes.items():
+                        if contact is None:
+                            records.append(('del', name, userName))
+                            continue
+                        memberList = contact.get('MemberList')
+                        # members not paged in since the snapshot did not change
+                        members = memberList.table if isinstance(memberList,
+                            CompactContactList) and memberList.loader is None else None
+                        records.append(('put', name, plain_contact(contact), members))
+                # tables are changed in place, so they are pickled inside the lock
+                data = pickle.dumps(records, -1) if records else None
+            if data is None:
+                return
+            with open(self.journalDir, 'r+b') as f:
+                f.seek(self.journalSize)
+                f.truncate()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.journalSize += len(data)
+            self.session = session
+            logger.debug('%s contact changes appended to journal.' % len(records))
+    def checkpoint(self):
+        with self.lock:
+            self._checkpoint()
+    def _checkpoint(self):
+        storage = self.core.storageClass
+        with storage.updateLock:
+            status = self._session()
+            session = pickle.dumps(status, -1)
+            contacts = pickle.dumps((status, dict((name,
+                [plain_contact(c) for c in getattr(storage, name)]) for name in LIST_NAMES)), -1)
+            members = OrderedDict()
+            for chatroom in storage.chatroomList:
+                memberList = chatroom.get('MemberList')
+                if not isinstance(memberList, CompactContactList):
+                    continue
+                # pages of the old snapshot are copied without being unpickled
+                members[chatroom['UserName']] = memberList.loader or \
+                    pickle.dumps(memberList.table, -1)
+            self._track()
+        generation = self.generation + 1
+        offsets = {}
+        tmpDir = self.fileDir + '.tmp'
+        with open(tmpDir, 'wb') as f:
+            f.write(MAGIC)
+            for userName, blob in members.items():
+                if isinstance(blob, MemberPage):
+                    blob = blob.raw()
+                offsets[userName] = (f.tell(), len(blob))
+                f.write(blob)
+            contactsOffset = f.tell()
+            f.write(contacts)
+            headerOffset = f.tell()
+            pickle.dump({
+                'version'    : config.VERSION,
+                'generation' : generation,
+                'contacts'   : (contactsOffset, len(contacts)),
+                'members'    : offsets, }, f, -1)
+            f.write(TRAILER.pack(headerOffset))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmpDir, self.fileDir)
+        journal = pickle.dumps(('generation', generation), -1)
+        with open(self.journalDir + '.tmp', 'wb') as f:
+            f.write(journal)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.journalDir + '.tmp', self.journalDir)
+        snapshot = SnapshotFile(self.fileDir)
+        with storage.updateLock:
+            for chatroom in storage.chatroomList:
+                memberList = chatroom.get('MemberList')
+                page = members.get(chatroom['UserName'])
+                if isinstance(page, MemberPage) and memberList.loader is page:
+                    memberList.set_loader(MemberPage(snapshot, *offsets[chatroom['UserName']]))
+        self.snapshot, self.generation = snapshot, generation
+        self.snapshotSize, self.journalSize = size, len(journal)
+        self.session = session
+        logger.debug('Snapshot of generation %s written, %s bytes.' % (generation, size))
+    def start(self):
+        if self.thread is None:
+            self.stopEvent.clear()
+            self.thread = threading.Thread(target=self._run, name='itchat-hotreload')
+            self.thread.setDaemon(True)
+            self.thread.start()
+        return self
+    def stop(self, timeout=None):
+        ''' stop the background thread, later changes are not recorded '''
+        self.stopEvent.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+        with self.core.storageClass.updateLock:
+            for name in LIST_NAMES:
+                getattr(self.core.storageClass, name).changes = None
+    def _run(self):
+        while not self.stopEvent.wait(config.HOTRELOAD_FLUSH_INTERVAL):
+            try:
+                self.flush()
+                if self.journalSize > max(config.HOTRELOAD_JOURNAL_MIN, self.snapshotSize):
+                    self.checkpoint()
+            except Exception:
+                logger.warning(traceback.format_exc())
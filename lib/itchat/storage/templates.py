@@ -1,8 +1,10 @@
-import logging, copy, pickle
+import logging, copy, pickle, threading
 from weakref import ref
 
 from ..returnvalues import ReturnValue
 from ..utils import update_info_dict
+from .contactindex import ContactIndex
+from .contacttable import ContactTable
 
 logger = logging.getLogger('itchat')
 
@@ -20,6 +22,10 @@ class AttributeDict(dict):
         except KeyError:
             return d
 
+def raise_frozen(obj):
+    raise TypeError('%s is a read-only snapshot, use copy.deepcopy to get a writable copy' % \
+        obj.__class__.__name__.split('.')[-1])
+
 class UnInitializedItchat(object):
     def _raise_error(self, *args, **kwargs):
         logger.warning('An itchat instance is called before initialized')
@@ -28,6 +34,7 @@ class UnInitializedItchat(object):
 
 class ContactList(list):
     ''' when a dict is append, init function will be called to format that dict '''
+    frozen = False
     def __init__(self, *args, **kwargs):
         super(ContactList, self).__init__(*args, **kwargs)
         self.__setstate__(None)
@@ -43,11 +50,66 @@ class ContactList(list):
         if hasattr(contactClass, '__call__'):
             self.contactClass = contactClass
     def append(self, value):
+        if self.frozen:
+            raise_frozen(self)
         contact = self.contactClass(value)
         contact.core = self.core
         if self.contactInitFn is not None:
             contact = self.contactInitFn(self, contact) or contact
         super(ContactList, self).append(contact)
+    def freeze(self):
+        self.frozen = True
+        for contact in self:
+            if hasattr(contact, 'freeze'):
+                contact.freeze()
+    def writable_copy(self):
+        ''' a writable copy of a frozen list, see AbstractUserDict.writable_copy '''
+        r = self.__class__([v.writable_copy() if hasattr(v, 'writable_copy') else copy.deepcopy(v)
+            for v in self])
+        r.contactInitFn = self.contactInitFn
+        r.contactClass = self.contactClass
+        r.core = self.core
+        return r
+    def __setitem__(self, key, value):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).__setitem__(key, value)
+    def __delitem__(self, key):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).__delitem__(key)
+    def __iadd__(self, value):
+        if self.frozen:
+            raise_frozen(self)
+        return super(ContactList, self).__iadd__(value)
+    def extend(self, value):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).extend(value)
+    def insert(self, index, value):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).insert(index, value)
+    def remove(self, value):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).remove(value)
+    def pop(self, *args):
+        if self.frozen:
+            raise_frozen(self)
+        return super(ContactList, self).pop(*args)
+    def clear(self):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).clear()
+    def sort(self, *args, **kwargs):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).sort(*args, **kwargs)
+    def reverse(self):
+        if self.frozen:
+            raise_frozen(self)
+        super(ContactList, self).reverse()
     def __deepcopy__(self, memo):
         r = self.__class__([copy.deepcopy(v) for v in self])
         r.contactInitFn = self.contactInitFn
@@ -65,9 +127,276 @@ class ContactList(list):
         return '<%s: %s>' % (self.__class__.__name__.split('.')[-1],
             self.__str__())
 
+class IndexedContactList(ContactList):
+    ''' ContactList keeping a ContactIndex of its items
+        appending and deleting keep the index in sync by themselves
+        contacts updated in place have to be passed to reindex()
+        while changes is a dict, every change is recorded in it
+        as UserName -> contact, or None once the contact is deleted
+    '''
+    changes = None
+    def set_index(self, fields=(), gramField=None):
+        self.contactIndex = ContactIndex(fields, gramField)
+        self.contactIndex.rebuild(self)
+    def append(self, value):
+        super(IndexedContactList, self).append(value)
+        self.contactIndex.update(self[-1])
+        if self.changes is not None:
+            self.changes[self[-1].get('UserName')] = self[-1]
+    def __setitem__(self, key, value):
+        oldContacts = self._tracked()
+        super(IndexedContactList, self).__setitem__(key, value)
+        self.contactIndex.rebuild(self)
+        self._record(oldContacts)
+    def __delitem__(self, key):
+        oldContacts = self._tracked()
+        super(IndexedContactList, self).__delitem__(key)
+        self.contactIndex.rebuild(self)
+        self._record(oldContacts)
+    def _tracked(self):
+        if self.changes is not None:
+            return dict((id(c), c) for c in self)
+    def _record(self, oldContacts):
+        if oldContacts is None:
+            return
+        contacts = dict((id(c), c) for c in self)
+        for contactId, contact in oldContacts.items():
+            if contactId not in contacts:
+                self.changes[contact.get('UserName')] = None
+        for contactId, contact in contacts.items():
+            if contactId not in oldContacts:
+                self.changes[contact.get('UserName')] = contact
+    def reindex(self, contact):
+        ''' refresh the index entry of a contact changed in place
+            contacts not in this list are ignored '''
+        if self.contactIndex.contains(contact):
+            self.contactIndex.update(contact)
+            if self.changes is not None:
+                self.changes[contact.get('UserName')] = contact
+    def __deepcopy__(self, memo):
+        r = super(IndexedContactList, self).__deepcopy__(memo)
+        r.set_index(self.contactIndex.fields, self.contactIndex.gramField)
+        return r
+    def __setstate__(self, state):
+        super(IndexedContactList, self).__setstate__(state)
+        self.contactIndex = ContactIndex()
+        self.contactIndex.rebuild(self)
+
+class CompactContactList(object):
+    ''' list of contacts kept in a columnar ContactTable instead of one dict each
+        contacts are materialized as contactClass dicts on access
+        and writes to them are passed through to the table
+        it is used for chatroom members, by far the most numerous contacts
+        the table may be paged in on first access, see set_loader()
+        a writable_copy() shares the table of its snapshot until it is changed
+    '''
+    frozen = False
+    shared = False
+    loadLock = threading.Lock()
+    def __init__(self, values=()):
+        self._table, self.loader = ContactTable(), None
+        self.__setstate__(None)
+        for value in values:
+            self.append(value)
+    @property
+    def table(self):
+        if self._table is None:
+            with self.loadLock:
+                if self._table is None:
+                    self._table, self.loader = self.loader(), None
+        return self._table
+    @table.setter
+    def table(self, value):
+        self._table, self.loader, self.shared = value, None, False
+    def _own(self):
+        ''' copy the table shared with a snapshot before changing it '''
+        if self.shared:
+            self.table = self.table.take(range(len(self.table)))
+    def set_loader(self, loader):
+        ''' drop the table, loader() is called to return it on first access '''
+        self._table, self.loader = None, loader
+    @property
+    def core(self):
+        return getattr(self, '_core', lambda: fakeItchat)() or fakeItchat
+    @core.setter
+    def core(self, value):
+        self._core = ref(value)
+    @property
+    def contactIndex(self):
+        ''' looked up by UserName like IndexedContactList.contactIndex '''
+        return self
+    def set_default_value(self, initFunction=None, contactClass=None):
+        if hasattr(initFunction, '__call__'):
+            self.contactInitFn = initFunction
+        if hasattr(contactClass, '__call__'):
+            self.contactClass = contactClass
+    def _materialize(self, row):
+        contact = self.contactClass(self.table.row_dict(row))
+        contact.core = self.core
+        if self.contactInitFn is not None:
+            contact = self.contactInitFn(self, contact) or contact
+        if self.frozen:
+            contact.freeze()
+        else:
+            contact._contactList = ref(self)
+            contact._contactKey = contact.get('UserName')
+        return contact
+    def _row(self, contact):
+        return self.table.rowOf.get(contact._contactKey)
+    def set_field(self, contact, k, v):
+        ''' called by materialized contacts when they are changed '''
+        row = self._row(contact)
+        if row is not None:
+            self._own()
+            self.table.set(row, k, v)
+            if k == 'UserName':
+                contact._contactKey = v
+    def del_field(self, contact, k):
+        row = self._row(contact)
+        if row is not None:
+            self._own()
+            self.table.unset(row, k)
+    def get(self, userName):
+        row = self.table.rowOf.get(userName)
+        return None if row is None else self._materialize(row)
+    def append(self, value):
+        if self.frozen:
+            raise_frozen(self)
+        self._own()
+        self.table.append(value)
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+    def merge(self, contacts):
+        ''' merge contacts into the list by UserName without materializing them
+            new contacts are appended, known ones updated in place
+            and the ones missing from contacts removed '''
+        if self.frozen:
+            raise_frozen(self)
+        self._own()
+        existsUserNames = set()
+        for contact in contacts:
+            existsUserNames.add(contact['UserName'])
+            row = self.table.rowOf.get(contact['UserName'])
+            if row is None:
+                self.table.append(contact)
+            else:
+                self.table.update(row, contact)
+        if len(self.table) != len(existsUserNames):
+            self.table = self.table.take(row for row in range(len(self.table))
+                if self.table.get(row, 'UserName') in existsUserNames)
+    def freeze(self):
+        self.frozen = True
+    def writable_copy(self):
+        r = self.__class__()
+        r._table, r.shared = self.table, True
+        r.contactInitFn = self.contactInitFn
+        r.contactClass = self.contactClass
+        r.core = self.core
+        return r
+    def __len__(self):
+        return len(self.table)
+    def __iter__(self):
+        for row in range(len(self.table)):
+            yield self._materialize(row)
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._materialize(row) for row in range(len(self.table))[key]]
+        return self._materialize(range(len(self.table))[key])
+    def __setitem__(self, key, value):
+        if self.frozen:
+            raise_frozen(self)
+        contacts = self[:]
+        contacts[key] = value
+        self.table = ContactTable()
+        self.extend(contacts)
+    def __delitem__(self, key):
+        if self.frozen:
+            raise_frozen(self)
+        rows = list(range(len(self.table)))
+        del rows[key]
+        self.table = self.table.take(rows)
+    def __deepcopy__(self, memo):
+        r = self.__class__()
+        r.table = self.table.take(range(len(self.table)))
+        r.contactInitFn = self.contactInitFn
+        r.contactClass = self.contactClass
+        r.core = self.core
+        return r
+    def __getstate__(self):
+        # an empty table is falsy, which would make pickle skip __setstate__
+        return {'table': self.table}
+    def __setstate__(self, state):
+        if state is not None:
+            self.table = state['table']
+        self.contactInitFn = None
+        self.contactClass = User
+    def __str__(self):
+        return '[%s]' % ', '.join([repr(v) for v in self])
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__.split('.')[-1],
+            self.__str__())
+
 class AbstractUserDict(AttributeDict):
+    frozen = False
+    _contactList = None # set on contacts materialized from a CompactContactList
     def __init__(self, *args, **kwargs):
         super(AbstractUserDict, self).__init__(*args, **kwargs)
+    def freeze(self):
+        ''' make this contact and everything in it read-only
+            snapshots behind search_* are frozen so that one copy can be shared by all readers '''
+        self.frozen = True
+        self.nestedKeys = [k for k, v in self.items()
+            if isinstance(v, (dict, list, CompactContactList)) and v is not fakeContactList]
+        for v in self.values():
+            if v is fakeContactList: # shared placeholder, not part of this contact
+                continue
+            if hasattr(v, 'freeze') and not v.frozen:
+                v.freeze()
+    def writable_copy(self):
+        ''' a writable copy of a frozen snapshot, search_* return one to every caller
+            fields are shared with the snapshot, tables of member lists are copied on first write
+            so changing the copy neither touches the snapshot nor the other callers' copies '''
+        r = self.__class__.__new__(self.__class__)
+        r.__dict__.update(self.__dict__)
+        del r.__dict__['frozen'], r.__dict__['nestedKeys']
+        dict.update(r, self)
+        for k in self.nestedKeys:
+            v = dict.__getitem__(self, k)
+            dict.__setitem__(r, k, v.writable_copy() if hasattr(v, 'writable_copy') else copy.deepcopy(v))
+        return r
+    def __setitem__(self, key, value):
+        if self.frozen:
+            raise_frozen(self)
+        super(AbstractUserDict, self).__setitem__(key, value)
+        if self._contactList is not None:
+            contactList = self._contactList()
+            if contactList is not None:
+                contactList.set_field(self, key, value)
+    def __delitem__(self, key):
+        if self.frozen:
+            raise_frozen(self)
+        super(AbstractUserDict, self).__delitem__(key)
+        if self._contactList is not None:
+            contactList = self._contactList()
+            if contactList is not None:
+                contactList.del_field(self, key)
+    def pop(self, *args):
+        if self.frozen:
+            raise_frozen(self)
+        return super(AbstractUserDict, self).pop(*args)
+    def popitem(self):
+        if self.frozen:
+            raise_frozen(self)
+        return super(AbstractUserDict, self).popitem()
+    def setdefault(self, key, default=None):
+        if self.frozen:
+            raise_frozen(self)
+        return super(AbstractUserDict, self).setdefault(key, default)
+    def clear(self):
+        if self.frozen:
+            raise_frozen(self)
+        super(AbstractUserDict, self).clear()
     @property
     def core(self):
         return getattr(self, '_core', lambda: fakeItchat)() or fakeItchat
@@ -147,7 +476,7 @@ class User(AbstractUserDict):
         self.__setstate__(None)
     def update(self):
         r = self.core.update_friend(self.userName)
-        if r:
+        if r and not self.frozen:
             update_info_dict(self, r)
         return r
     def set_alias(self, alias):
@@ -160,6 +489,10 @@ class User(AbstractUserDict):
         r = super(User, self).__deepcopy__(memo)
         r.verifyDict = copy.deepcopy(self.verifyDict)
         return r
+    def writable_copy(self):
+        r = super(User, self).writable_copy()
+        r.verifyDict = copy.deepcopy(self.verifyDict)
+        return r
     def __setstate__(self, state):
         super(User, self).__setstate__(state)
         self.verifyDict = {}
@@ -176,7 +509,7 @@ class MassivePlatform(AbstractUserDict):
 class Chatroom(AbstractUserDict):
     def __init__(self, *args, **kwargs):
         super(Chatroom, self).__init__(*args, **kwargs)
-        memberList = ContactList()
+        memberList = CompactContactList()
         userName = self.get('UserName', '')
         refSelf = ref(self)
         def init_fn(parentList, d):
@@ -194,13 +527,15 @@ class Chatroom(AbstractUserDict):
     def core(self, value):
         self._core = ref(value)
         self.memberList.core = value
-        for member in self.memberList:
-            member.core = value
+        # members of a CompactContactList take core from the list when materialized
+        if not isinstance(self.memberList, CompactContactList):
+            for member in self.memberList:
+                member.core = value
     def update(self, detailedMember=False):
         r = self.core.update_chatroom(self.userName, detailedMember)
-        if r:
+        if r and not self.frozen:
             update_info_dict(self, r)
-            self['MemberList'] = r['MemberList']
+            self['MemberList'] = copy.deepcopy(r['MemberList'])
         return r
     def set_alias(self, alias):
         return self.core.set_chatroom_name(self.userName, alias)
@@ -216,9 +551,9 @@ class Chatroom(AbstractUserDict):
             if (name or userName or remarkName or nickName or wechatAccount) is None:
                 return None
             elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m.userName == userName:
-                        return copy.deepcopy(m)
+                m = self.memberList.contactIndex.get(userName)
+                if m is not None:
+                    return copy.deepcopy(m)
             else:
                 matchDict = {
                     'RemarkName' : remarkName,
@@ -0,0 +1,117 @@
+import logging, threading, time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import config
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+logger = logging.getLogger('itchat')
+
+# endpoints are told apart by the last segment of their path
+POLL_ENDPOINTS = frozenset(('login', 'synccheck', 'webwxsync'))
+MEDIA_ENDPOINTS = frozenset(('qrcode', 'webwxuploadmedia', 'webwxgetmsgimg', 'webwxgetvoice',
+    'webwxgetvideo', 'webwxgetmedia', 'webwxgeticon', 'webwxgetheadimg'))
+
+class Transport(object):
+    ''' drop-in for the requests.Session of core.s
+        requests go out through one session per channel, all sharing the cookies
+            - poll: long polls of login and receiving, they hold a connection for up to a minute
+            - api: everything else, sending included
+            - media: uploads and downloads of files
+        so long polls and big files never take the connections of api calls
+        each channel has its own pool size and default timeout (see config)
+        stats() reports latency of each endpoint and connection reuse of each channel
+    '''
+    def __init__(self):
+        self.sessions = {}
+        for channel, poolSize in (('poll', config.POLL_POOL_SIZE),
+                ('api', config.API_POOL_SIZE), ('media', config.MEDIA_POOL_SIZE)):
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=poolSize)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            self.sessions[channel] = s
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.timeouts = {
+            'poll'  : config.POLL_TIMEOUT,
+            'api'   : config.API_TIMEOUT,
+            'media' : config.MEDIA_TIMEOUT, }
+        self.lock = threading.Lock()
+        self.endpoints = {} # endpoint -> [requests, errors, totalTime, maxTime]
+    @property
+    def cookies(self):
+        return self._cookies
+    @cookies.setter
+    def cookies(self, value):
+        self._cookies = value
+        for s in self.sessions.values():
+            s.cookies = value
+    @staticmethod
+    def endpoint_of(url):
+        return urlparse(url).path.rstrip('/').rsplit('/', 1)[-1]
+    @staticmethod
+    def channel_of(endpoint):
+        if endpoint in POLL_ENDPOINTS:
+            return 'poll'
+        elif endpoint in MEDIA_ENDPOINTS:
+            return 'media'
+        return 'api'
+    def request(self, method, url, **kwargs):
+        endpoint = self.endpoint_of(url)
+        channel = self.channel_of(endpoint)
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeouts[channel]
+        start = time.time()
+        try:
+            r = self.sessions[channel].request(method, url, **kwargs)
+        except:
+            self._record(endpoint, time.time() - start, True)
+            raise
+        self._record(endpoint, time.time() - start, False)
+        return r
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+    def _record(self, endpoint, elapsed, failed):
+        with self.lock:
+            counters = self.endpoints.setdefault(endpoint, [0, 0, 0.0, 0.0])
+            counters[0] += 1
+            counters[1] += failed
+            counters[2] += elapsed
+            counters[3] = max(counters[3], elapsed)
+    def _pools(self, channel):
+        pools = self.sessions[channel].get_adapter('https://').poolmanager.pools
+        for key in pools.keys():
+            try:
+                yield pools[key]
+            except KeyError: # dropped meanwhile
+                pass
+    def stats(self):
+        ''' latency is measured till the response headers for streamed responses '''
+        with self.lock:
+            endpoints = dict((endpoint, {
+                'requests': n,
+                'errors': errors,
+                'avgLatency': total / n,
+                'maxLatency': maxTime, })
+                for endpoint, (n, errors, total, maxTime) in self.endpoints.items())
+        channels = {}
+        for channel in self.sessions:
+            sent = connections = 0
+            for pool in self._pools(channel):
+                sent += pool.num_requests
+                connections += pool.num_connections
+            channels[channel] = {
+                'requests': sent,
+                'connections': connections,
+                'reused': sent - connections, }
+        return {'endpoints': endpoints, 'channels': channels}
+    def close(self):
+        for s in self.sessions.values():
+            s.close()
@@ -113,7 +113,10 @@ def struct_friend_info(knownInfo):
 
 def search_dict_list(l, key, value):
     ''' Search a list of dict
-        * return dict with specific value & key '''
+        * return dict with specific value & key
+        * lists with a contact index are searched by UserName in O(1) '''
+    if key == 'UserName' and hasattr(l, 'contactIndex'):
+        return l.contactIndex.get(value)
     for i in l:
         if i.get(key) == value:
             return i
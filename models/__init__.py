@@ -1 +1,4 @@
-from .openai import openai_client
\ No newline at end of file
+from .openai import openai_client, async_openai_client, async_twin, client_stats, close_clients
+from .event_loop import get_event_loop, run_coroutine
+from .scheduler import get_scheduler, scheduler_stats
+from .retry import get_retry_policy, retry_stats
@@ -0,0 +1,83 @@
+import asyncio
+import atexit
+import threading
+import logging
+
+
+class LLMEventLoop:
+    """
+    进程内唯一的后台事件循环线程，所有异步LLM调用都在该循环上执行，
+    从而可以同时挂起大量请求而不需要为每个请求占用一个线程
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None or self.loop.is_closed():
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever,
+                                               name="llm-event-loop", daemon=True)
+                self.thread.start()
+                logging.info("LLM event loop started.")
+            return self.loop
+
+    def is_running(self):
+        return self.loop is not None and self.loop.is_running()
+
+    def in_loop(self):
+        """
+        判断当前线程是否就是事件循环所在线程
+        """
+        return self.thread is threading.current_thread()
+
+    def run_coroutine(self, coro):
+        """
+        在共享事件循环上执行协程（线程安全）
+        :return: concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def stop(self):
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.loop = self.thread = None
+        if loop is None:
+            return
+        if loop.is_running() and thread is not threading.current_thread():
+            # 先取消尚未完成的任务（如等待过期的聊天），再停止事件循环
+            try:
+                asyncio.run_coroutine_threadsafe(cancel_pending_tasks(), loop).result(timeout=5)
+            except Exception as e:
+                logging.warning(f"Failed to cancel pending LLM tasks: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not threading.current_thread():
+            thread.join(timeout=5)
+        if not loop.is_running():
+            loop.close()
+
+
+async def cancel_pending_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+event_loop = LLMEventLoop()
+atexit.register(event_loop.stop)
+
+
+def get_event_loop():
+    return event_loop.get_loop()
+
+
+def run_coroutine(coro):
+    """
+    在共享事件循环上执行协程，供同步代码调用
+    :param coro: 协程对象
+    :return: concurrent.futures.Future，可通过result()等待结果
+    """
+    return event_loop.run_coroutine(coro)
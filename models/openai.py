@@ -1,21 +1,237 @@
-import httpx
-from openai import OpenAI
+import atexit
+import threading
+import time
 import logging
 
-def openai_client(config):
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from .event_loop import event_loop
+
+# 不同调用场景的超时配置，作为客户端复用的键之一
+TIMEOUT_PROFILES = {
+    "default": httpx.Timeout(60.0, connect=10.0),
+    "interactive": httpx.Timeout(30.0, connect=5.0),
+    "background": httpx.Timeout(120.0, connect=10.0),
+}
+
+
+def proxy_url(config):
+    """
+    根据配置生成OpenAI使用的HTTP代理地址
+    :param config: configuration dictionary
+    :return: 代理地址，未配置时返回None
+    """
+    if not config["Connection"].get("http_port", None):
+        return None
+    if config["Connection"].get("proxy_username", None):
+        return f"http://{config['Connection']['proxy_username']}:{config['Connection']['proxy_password']}@{config['Connection']['proxy']}:{config['Connection']['http_port']}"
+    return f"http://{config['Connection']['proxy']}:{config['Connection']['http_port']}"
+
+
+def pool_limits(config):
     """
-    Initialize OpenAI client with proxy settings
+    根据配置生成连接池参数（保持长连接，避免每次调用都重新握手）
     :param config: configuration dictionary
     """
-# OpenAI proxy settings
-    if config["Connection"].get("http_port", None):
-        if config["Connection"].get("proxy_username", None):
-            http_proxy = f"http://{config['Connection']['proxy_username']}:{config['Connection']['proxy_password']}@{config['Connection']['proxy']}:{config['Connection']['http_port']}"
-        else:
-            http_proxy = f"http://{config['Connection']['proxy']}:{config['Connection']['http_port']}"
-        httpx_client = httpx.Client(proxies={"http://": http_proxy, "https://": http_proxy})
-        logging.info(f"Using proxy: {http_proxy}")
-    else:
-        httpx_client = None
-    openai_client = OpenAI(api_key=config["OpenAI"]["api_key"], http_client=httpx_client)
-    return openai_client
\ No newline at end of file
+    connection = config["Connection"]
+    return httpx.Limits(max_connections=int(connection.get("max_connections", 20)),
+                        max_keepalive_connections=int(connection.get("max_keepalive_connections", 10)),
+                        keepalive_expiry=float(connection.get("keepalive_expiry", 60)))
+
+
+class ConnectionStats:
+    """
+    统计连接复用情况：新建连接与复用连接的请求数及各自的平均耗时
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.new_connection_time = 0.0
+        self.reused_time = 0.0
+
+    def record(self, new_connection, elapsed):
+        with self.lock:
+            self.requests += 1
+            if new_connection:
+                self.new_connections += 1
+                self.new_connection_time += elapsed
+            else:
+                self.reused_time += elapsed
+
+    def snapshot(self):
+        with self.lock:
+            reused = self.requests - self.new_connections
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_ratio": reused / self.requests if self.requests else 0.0,
+                "avg_new_connection_latency": self.new_connection_time / self.new_connections if self.new_connections else 0.0,
+                "avg_reused_latency": self.reused_time / reused if reused else 0.0,
+            }
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """
+    带连接复用统计的HTTP传输层，通过httpcore的trace事件判断本次请求是否新建了TCP连接
+    """
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request):
+        connected = []
+
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                connected.append(True)
+        request.extensions["trace"] = trace
+        start = time.monotonic()
+        try:
+            return super().handle_request(request)
+        finally:
+            self.stats.record(bool(connected), time.monotonic() - start)
+
+
+class AsyncPooledTransport(httpx.AsyncHTTPTransport):
+    """
+    PooledTransport的异步版本，供AsyncOpenAI使用
+    """
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request):
+        connected = []
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                connected.append(True)
+        request.extensions["trace"] = trace
+        start = time.monotonic()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.stats.record(bool(connected), time.monotonic() - start)
+
+
+class OpenAIClientRegistry:
+    """
+    进程内共享的OpenAI客户端注册表，按 (api_key, 接口地址, 代理, 超时配置) 复用同一个线程安全的客户端
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.stats = {}
+        # 同步客户端 -> 创建它的(config, 超时配置)，用于获取配置相同的异步客户端
+        self.origins = {}
+
+    def get(self, config, timeout_profile="default", is_async=False):
+        api_key = config["OpenAI"]["api_key"]
+        # 未配置时使用OPENAI_BASE_URL环境变量或官方地址
+        base_url = config["OpenAI"].get("base_url") or None
+        http_proxy = proxy_url(config)
+        key = (api_key, base_url, http_proxy, timeout_profile, is_async)
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+        with self.lock:
+            if key not in self.clients:
+                stats = ConnectionStats()
+                timeout = TIMEOUT_PROFILES[timeout_profile]
+                if is_async:
+                    # 异步客户端绑定在共享事件循环上，只能在该循环中使用
+                    transport = AsyncPooledTransport(stats, proxy=http_proxy, limits=pool_limits(config))
+                    httpx_client = httpx.AsyncClient(transport=transport, timeout=timeout)
+                    client_class = AsyncOpenAI
+                else:
+                    transport = PooledTransport(stats, proxy=http_proxy, limits=pool_limits(config))
+                    httpx_client = httpx.Client(transport=transport, timeout=timeout)
+                    client_class = OpenAI
+                self.clients[key] = client_class(api_key=api_key, base_url=base_url, http_client=httpx_client, timeout=timeout)
+                self.stats[key] = stats
+                if not is_async:
+                    self.origins[id(self.clients[key])] = (config, timeout_profile)
+                logging.info(f"{client_class.__name__} client created ({timeout_profile}), proxy: {http_proxy}")
+            return self.clients[key]
+
+    def async_twin(self, client):
+        """
+        获取与同步客户端配置相同（api_key、接口地址、代理、超时配置）的共享异步客户端
+        :return: AsyncOpenAI客户端，client不是由注册表创建时返回None
+        """
+        origin = self.origins.get(id(client))
+        if origin is None:
+            return None
+        return self.get(origin[0], origin[1], is_async=True)
+
+    def get_stats(self):
+        with self.lock:
+            items = list(self.stats.items())
+        # 不在统计结果中暴露完整的api_key
+        return {f"***{api_key[-4:]}|{base_url or 'default'}|{http_proxy or 'direct'}|{profile}{'|async' if is_async else ''}": stats.snapshot()
+                for (api_key, base_url, http_proxy, profile, is_async), stats in items}
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            # 统计和来源随客户端一起清除，重新创建的客户端从零开始统计
+            self.clients.clear()
+            self.stats.clear()
+            self.origins.clear()
+        for client in clients:
+            try:
+                if isinstance(client, AsyncOpenAI):
+                    if event_loop.is_running() and not event_loop.in_loop():
+                        event_loop.run_coroutine(client.close()).result(timeout=5)
+                else:
+                    client.close()
+            except Exception as e:
+                logging.warning(f"Failed to close OpenAI client: {e}")
+
+
+registry = OpenAIClientRegistry()
+atexit.register(registry.close)
+
+
+def openai_client(config, timeout_profile="default"):
+    """
+    获取共享的OpenAI客户端（带代理与长连接池）
+    :param config: configuration dictionary
+    :param timeout_profile: 超时配置名称，见TIMEOUT_PROFILES
+    """
+    return registry.get(config, timeout_profile)
+
+
+def async_openai_client(config, timeout_profile="default"):
+    """
+    获取共享的AsyncOpenAI客户端，只能在共享事件循环（models.event_loop）中使用
+    :param config: configuration dictionary
+    :param timeout_profile: 超时配置名称，见TIMEOUT_PROFILES
+    """
+    return registry.get(config, timeout_profile, is_async=True)
+
+
+def async_twin(client):
+    """
+    获取与同步客户端配置相同的共享AsyncOpenAI客户端，只能在共享事件循环中使用
+    :param client: openai_client返回的同步客户端
+    :return: AsyncOpenAI客户端，client不是由openai_client创建时返回None
+    """
+    return registry.async_twin(client)
+
+
+def client_stats():
+    """
+    获取各共享客户端的连接复用统计
+    """
+    return registry.get_stats()
+
+
+def close_clients():
+    """
+    关闭所有共享客户端，释放连接池
+    """
+    registry.close()
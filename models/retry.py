@@ -0,0 +1,188 @@
+import asyncio
+import random
+import threading
+import time
+import logging
+from collections import deque
+
+from openai import RateLimitError, APIConnectionError, InternalServerError
+
+from .scheduler import INTERACTIVE, MEETING, BACKGROUND, retry_after_seconds
+
+# 各类调用的总时间预算（秒），包括排队、重试和退避等待
+DEFAULT_DEADLINES = {INTERACTIVE: 30.0, MEETING: 60.0, BACKGROUND: 180.0}
+# 可以重试的错误：429、连接错误（包括超时）及服务端错误
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """
+    带随机抖动的指数退避（full jitter），避免大量请求在同一时刻重试
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """
+    记录最近的调用耗时，用于计算对冲请求的触发时间（p95）
+    """
+    def __init__(self, window=200, min_samples=20):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, elapsed):
+        with self.lock:
+            self.samples.append(elapsed)
+
+    def percentile(self, p):
+        """
+        :return: 第p百分位的耗时，样本不足时返回None
+        """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            values = sorted(self.samples)
+        return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class RetryPolicy:
+    """
+    按调用类型分配时间预算，在预算内以带抖动的指数退避重试；实时回复可选地在耗时超过p95时发出对冲请求，
+    先返回的结果胜出，另一个请求被取消。对冲请求的数量不超过总请求数的hedge_budget比例。
+    """
+    def __init__(self, deadlines=None, max_attempts=4, hedge=False, hedge_budget=0.1, hedge_min_delay=1.0):
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.hedge_min_delay = hedge_min_delay
+        self.lock = threading.Lock()
+        self.trackers = {}
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def deadline(self, priority):
+        with self.lock:
+            self.requests += 1
+        return Deadline(self.deadlines[priority])
+
+    def tracker(self, model, priority):
+        with self.lock:
+            return self.trackers.setdefault((model, priority), LatencyTracker())
+
+    def record(self, model, priority, elapsed):
+        self.tracker(model, priority).record(elapsed)
+
+    def retry_delay(self, error, attempt, deadline):
+        """
+        判断调用失败后能否在预算内重试
+        :return: 重试前需要等待的秒数，不能重试时返回None
+        """
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt + 1 >= self.max_attempts:
+            return None
+        delay = backoff_delay(attempt)
+        if isinstance(error, RateLimitError):
+            delay = max(delay, retry_after_seconds(error))
+        # 等待后至少还要留出一点时间给下一次请求
+        if delay + 1.0 >= deadline.remaining():
+            return None
+        with self.lock:
+            self.retries += 1
+        return delay
+
+    def hedge_delay(self, model, priority, stream=False):
+        """
+        :return: 发出对冲请求前等待的秒数，不使用对冲时返回None
+        """
+        # 流式回复的句子已经发出，无法再用另一个请求替换
+        if not self.hedge or priority != INTERACTIVE or stream:
+            return None
+        p95 = self.tracker(model, priority).percentile(95)
+        return max(p95, self.hedge_min_delay) if p95 is not None else None
+
+    def allow_hedge(self):
+        with self.lock:
+            if self.hedges + 1 > self.hedge_budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    async def hedged(self, request, delay):
+        """
+        执行请求，若在delay秒内未返回，则再发出一个相同的请求，取先成功的结果并取消另一个
+        :param request: 无参数的协程函数
+        """
+        primary = asyncio.ensure_future(request())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.allow_hedge():
+            return await primary
+        logging.info(f"Request exceeded {delay:.2f}s, sending a hedged request.")
+        backup = asyncio.ensure_future(request())
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            with self.lock:
+                                self.hedge_wins += 1
+                        return task.result()
+            # 两个请求都失败时抛出原请求的错误
+            return primary.result()
+        finally:
+            for task in (primary, backup):
+                if not task.done():
+                    task.cancel()
+
+    def snapshot(self):
+        with self.lock:
+            trackers = list(self.trackers.items())
+            stats = {"requests": self.requests, "retries": self.retries,
+                     "hedges": self.hedges, "hedge_wins": self.hedge_wins}
+        stats["p95"] = {f"{model}|{priority}": tracker.percentile(95) for (model, priority), tracker in trackers}
+        return stats
+
+
+retry_policy = None
+retry_policy_lock = threading.Lock()
+
+def get_retry_policy(config):
+    """
+    根据配置获取全局共享的重试策略，可选配置见 [Retry]
+    :param config: configuration dictionary
+    """
+    global retry_policy
+    with retry_policy_lock:
+        if retry_policy is None:
+            retry_config = config["Retry"] if "Retry" in config else {}
+            deadlines = {priority: float(retry_config[f"{priority}_deadline"])
+                         for priority in (INTERACTIVE, MEETING, BACKGROUND) if f"{priority}_deadline" in retry_config}
+            retry_policy = RetryPolicy(deadlines=deadlines,
+                                       max_attempts=int(retry_config.get("max_attempts", 4)),
+                                       hedge=str(retry_config.get("hedge_interactive", "false")).lower() in ("true", "1", "yes", "on"),
+                                       hedge_budget=float(retry_config.get("hedge_budget", 0.1)),
+                                       hedge_min_delay=float(retry_config.get("hedge_min_delay", 1.0)))
+        return retry_policy
+
+
+def retry_stats():
+    """
+    获取重试及对冲请求的统计，尚未创建重试策略时返回空字典
+    """
+    return retry_policy.snapshot() if retry_policy is not None else {}
@@ -0,0 +1,326 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import logging
+from contextlib import contextmanager, asynccontextmanager
+
+# 优先级：数值越小越优先
+INTERACTIVE = "interactive"
+MEETING = "meeting"
+BACKGROUND = "background"
+PRIORITIES = {INTERACTIVE: 0, MEETING: 1, BACKGROUND: 2}
+
+
+class TokenBucket:
+    """
+    令牌桶，用于每分钟请求数（RPM）和每分钟token数（TPM）限制，rate为0时不限制
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """
+        距离可以取出amount个令牌还需等待的秒数
+        """
+        if not self.capacity:
+            return 0.0
+        self.refill(now)
+        # 单次请求超过桶容量时按桶容量计算，避免永远无法执行
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+
+class Waiter:
+    """
+    排队等待执行的请求，同步请求通过Event唤醒，异步请求通过事件循环中的Future唤醒
+    """
+    def __init__(self, priority, seq, tokens, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class ModelQueue:
+    """
+    单个模型的等待队列、并发数及速率限制状态
+    """
+    def __init__(self, max_concurrency, rpm, tpm):
+        self.max_concurrency = max_concurrency
+        self.waiters = []
+        self.in_flight = 0
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # 收到429后在该时间之前不再发出新请求
+        self.blocked_until = 0.0
+
+
+class PriorityStats:
+    def __init__(self):
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait):
+        self.granted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class LLMScheduler:
+    """
+    所有模型调用的统一调度器：按优先级排队，限制每个模型的并发数、RPM和TPM，并在收到429时按Retry-After暂停。
+    后台任务（如记忆提取、聊天总结）不能占满并发，始终为实时回复保留reserved_slots个名额。
+    """
+    def __init__(self, max_concurrency=4, requests_per_minute=0, tokens_per_minute=0,
+                 reserved_slots=1, model_limits=None):
+        """
+        :param model_limits: 按模型覆盖的限制，如 {"gpt-4": {"max_concurrency": 2, "requests_per_minute": 60}}
+        """
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved_slots = reserved_slots
+        self.model_limits = model_limits or {}
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.counter = itertools.count()
+        self.timer = None
+        self.timer_deadline = None
+        self.stats = {priority: PriorityStats() for priority in PRIORITIES}
+        self.throttled = 0
+        self.rate_limited = 0
+
+    def _queue(self, model):
+        queue = self.queues.get(model)
+        if queue is None:
+            limits = self.model_limits.get(model, {})
+            queue = ModelQueue(int(limits.get("max_concurrency", self.max_concurrency)),
+                               int(limits.get("requests_per_minute", self.requests_per_minute)),
+                               int(limits.get("tokens_per_minute", self.tokens_per_minute)))
+            self.queues[model] = queue
+        return queue
+
+    def _enqueue(self, model, priority, tokens, loop=None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        with self.lock:
+            waiter = Waiter(PRIORITIES[priority], next(self.counter), tokens, loop)
+            heapq.heappush(self._queue(model).waiters, waiter)
+            self._dispatch(model)
+        return waiter
+
+    def _dispatch(self, model):
+        """
+        按优先级依次放行等待中的请求（需持有锁）。队首请求受速率限制时，后面的请求也不会插队
+        """
+        queue = self.queues[model]
+        now = time.monotonic()
+        while queue.waiters and queue.in_flight < queue.max_concurrency:
+            waiter = queue.waiters[0]
+            if waiter.priority == PRIORITIES[BACKGROUND] and queue.max_concurrency > self.reserved_slots \
+                    and queue.in_flight >= queue.max_concurrency - self.reserved_slots:
+                # 后台任务排在最后，队首是后台任务时其余也都是后台任务
+                break
+            delay = max(queue.blocked_until - now, queue.requests.delay(1, now), queue.tokens.delay(waiter.tokens, now))
+            if delay > 0:
+                self.throttled += 1
+                self._schedule(now + delay)
+                break
+            heapq.heappop(queue.waiters)
+            queue.requests.consume(1)
+            queue.tokens.consume(waiter.tokens)
+            queue.in_flight += 1
+            waiter.granted = True
+            self.stats[self._priority_name(waiter.priority)].record(now - waiter.enqueued)
+            waiter.wake()
+
+    def _dispatch_all(self):
+        with self.lock:
+            self.timer = self.timer_deadline = None
+            for model in list(self.queues):
+                self._dispatch(model)
+
+    def _schedule(self, deadline):
+        # 只保留最早的一个定时器，到期后重新检查所有模型的队列
+        if self.timer is not None and self.timer_deadline <= deadline:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(max(deadline - time.monotonic(), 0.0), self._dispatch_all)
+        self.timer.daemon = True
+        self.timer_deadline = deadline
+        self.timer.start()
+
+    @staticmethod
+    def _priority_name(value):
+        return next(name for name, number in PRIORITIES.items() if number == value)
+
+    def release(self, model):
+        with self.lock:
+            self.queues[model].in_flight -= 1
+            self._dispatch(model)
+
+    def _cancel(self, model, waiter):
+        with self.lock:
+            queue = self.queues[model]
+            if waiter.granted:
+                queue.in_flight -= 1
+            else:
+                queue.waiters.remove(waiter)
+                heapq.heapify(queue.waiters)
+            self._dispatch(model)
+
+    def acquire(self, model, priority=INTERACTIVE, tokens=0, timeout=None):
+        """
+        同步等待执行名额，使用完毕后需调用release(model)
+        :param tokens: 预计消耗的token数（用于TPM限制）
+        :param timeout: 最长等待时间（秒），超时抛出TimeoutError
+        """
+        waiter = self._enqueue(model, priority, tokens)
+        if not waiter.event.wait(timeout):
+            self._cancel(model, waiter)
+            raise TimeoutError(f"Timed out waiting for a {priority} slot on {model}")
+
+    async def acquire_async(self, model, priority=INTERACTIVE, tokens=0, timeout=None):
+        """
+        acquire的异步版本，等待期间不占用线程
+        """
+        waiter = self._enqueue(model, priority, tokens, asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self._cancel(model, waiter)
+            raise TimeoutError(f"Timed out waiting for a {priority} slot on {model}")
+        except asyncio.CancelledError:
+            self._cancel(model, waiter)
+            raise
+
+    @contextmanager
+    def slot(self, model, priority=INTERACTIVE, tokens=0, timeout=None):
+        self.acquire(model, priority, tokens, timeout)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    @asynccontextmanager
+    async def slot_async(self, model, priority=INTERACTIVE, tokens=0, timeout=None):
+        await self.acquire_async(model, priority, tokens, timeout)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def rate_limited_for(self, model, retry_after):
+        """
+        收到429时调用：在retry_after秒内暂停该模型的所有新请求
+        """
+        with self.lock:
+            self.rate_limited += 1
+            queue = self._queue(model)
+            queue.blocked_until = max(queue.blocked_until, time.monotonic() + retry_after)
+            self._schedule(queue.blocked_until)
+        logging.warning(f"Rate limited on {model}, pausing requests for {retry_after:.1f}s")
+
+    def snapshot(self):
+        """
+        队列深度、等待时间及限流统计
+        """
+        with self.lock:
+            depth = {name: 0 for name in PRIORITIES}
+            models = {}
+            for model, queue in self.queues.items():
+                for waiter in queue.waiters:
+                    depth[self._priority_name(waiter.priority)] += 1
+                models[model] = {"in_flight": queue.in_flight, "queued": len(queue.waiters)}
+            return {
+                "queue_depth": depth,
+                "wait_time": {name: {"granted": stats.granted,
+                                     "avg": stats.total_wait / stats.granted if stats.granted else 0.0,
+                                     "max": stats.max_wait}
+                              for name, stats in self.stats.items()},
+                "models": models,
+                "throttled": self.throttled,
+                "rate_limited": self.rate_limited,
+            }
+
+
+def retry_after_seconds(error, default=1.0):
+    """
+    从429响应中读取需要等待的秒数（retry-after-ms / retry-after）
+    """
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return default
+
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def get_scheduler(config):
+    """
+    根据配置获取全局共享的调度器，可选配置见 [Scheduler]，按模型覆盖时使用“模型名.配置项”，如 gpt-4.max_concurrency = 2
+    :param config: configuration dictionary
+    """
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler_config = config["Scheduler"] if "Scheduler" in config else {}
+            model_limits = {}
+            for key, value in scheduler_config.items():
+                model, _, option = key.rpartition(".")
+                if model:
+                    model_limits.setdefault(model, {})[option] = value
+            scheduler = LLMScheduler(max_concurrency=int(scheduler_config.get("max_concurrency", 4)),
+                                     requests_per_minute=int(scheduler_config.get("requests_per_minute", 0)),
+                                     tokens_per_minute=int(scheduler_config.get("tokens_per_minute", 0)),
+                                     reserved_slots=int(scheduler_config.get("reserved_interactive_slots", 1)),
+                                     model_limits=model_limits)
+        return scheduler
+
+
+def scheduler_stats():
+    """
+    获取调度器的统计信息，尚未创建调度器时返回空字典
+    """
+    return scheduler.snapshot() if scheduler is not None else {}
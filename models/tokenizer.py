@@ -0,0 +1,54 @@
+import re
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 每条消息在role、分隔符等格式上额外占用的token数（参考OpenAI的计算方式）
+MESSAGE_OVERHEAD = 4
+CJK_CHARS = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    获取模型对应的tokenizer（只加载一次），未安装tiktoken时返回None
+    """
+    if tiktoken is None:
+        logging.info("tiktoken is not installed, estimating token counts instead.")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # 首次使用时需要下载词表，无法下载时退回估算
+        logging.warning(f"Failed to load tokenizer for {model}: {e}")
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """
+    计算文本的token数，结果会被缓存，同一条消息在每次构建上下文时不会重复计算
+    :param text: 文本
+    :param model: 模型名称
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # 估算：中文字符约1个token，其他字符约4个字符1个token
+    cjk = len(CJK_CHARS.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_message_tokens(message, model="gpt-3.5-turbo"):
+    """
+    计算一条聊天消息（{"role": ..., "content": ...}）占用的token数
+    """
+    return count_tokens(message.get("content") or "", model) + MESSAGE_OVERHEAD
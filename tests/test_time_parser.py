@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+
+from utils.time_parser import parse_time_expression
+
+NOW = datetime(2026, 10, 18, 10, 0)
+
+
+# (文本, 开始时间, 时长, 是否有歧义)
+@pytest.mark.parametrize("text, start, duration, ambiguous", [
+    ("今晚8点开会", datetime(2026, 10, 18, 20, 0), None, False),
+    ("明早9点见", datetime(2026, 10, 19, 9, 0), None, False),
+    ("今晚11点开会", datetime(2026, 10, 18, 23, 0), None, False),
+    ("晚8点吃饭", datetime(2026, 10, 18, 20, 0), None, False),
+    ("晚一点再说，明天上午10点开会", datetime(2026, 10, 19, 10, 0), None, False),
+    ("明天下午3点开会，2.5小时", datetime(2026, 10, 19, 15, 0), 150, False),
+    ("1.5小时后开会", datetime(2026, 10, 18, 11, 30), None, False),
+    ("后天晚上7点到9点聚餐", datetime(2026, 10, 20, 19, 0), 120, False),
+    ("今晚12点开会", datetime(2026, 10, 19, 0, 0), None, False),
+    ("晚上12点开会", datetime(2026, 10, 19, 0, 0), None, False),
+    ("明晚12点半上线", datetime(2026, 10, 20, 0, 30), None, False),
+    ("中午12点吃饭", datetime(2026, 10, 18, 12, 0), None, False),
+    ("明天3点开会", datetime(2026, 10, 19, 15, 0), None, True),
+    ("明天下午开会", datetime(2026, 10, 19, 14, 0), None, True),
+    ("明天下午3点还是4点？", datetime(2026, 10, 19, 15, 0), None, True),
+    ("今天或者明天上午10点", datetime(2026, 10, 19, 10, 0), None, True),
+    ("2月30号下午3点开会", None, None, True),
+])
+def test_start_time(text, start, duration, ambiguous):
+    result = parse_time_expression(text, NOW)
+    assert (result["start_time"], result["duration"], result["ambiguous"]) == (start, duration, ambiguous)
+
+
+def test_invalid_date_is_not_resolved():
+    result = parse_time_expression("2月30号下午3点开会", NOW)
+    assert not result["date_resolved"] and not result["time_resolved"]
+
+
+def test_duration_ambiguous():
+    assert parse_time_expression("开会1小时，或者2小时", NOW)["duration_ambiguous"]
+
+
+def test_relative_date_after_midnight():
+    # 凌晨0点到4点之间说的“明天”指睡醒后的这一天
+    result = parse_time_expression("明天上午10点开会", datetime(2026, 10, 18, 2, 0))
+    assert result["start_time"] == datetime(2026, 10, 18, 10, 0)
@@ -0,0 +1,322 @@
+import re
+from datetime import datetime, timedelta
+
+CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+             "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+NUM = r"[0-9零〇一二两三四五六七八九十]{1,3}"
+DECIMAL = r"\d+\.\d+"
+WEEKDAYS_CN = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6,
+               "1": 0, "2": 1, "3": 2, "4": 3, "5": 4, "6": 5, "7": 6}
+WEEKDAYS_EN = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+               "friday": 4, "saturday": 5, "sunday": 6}
+# 相对日期（受凌晨0点到4点规则影响）及其偏移天数
+RELATIVE_DAYS = [
+    (r"大后天", 3), (r"后天|day after tomorrow", 2),
+    (r"明天|明日|明早|明晚|明儿|tomorrow", 1), (r"今天|今日|今晚|今早|今儿|today|tonight", 0),
+]
+RELATIVE_DAYS_ANY = re.compile("|".join(pattern for pattern, _ in RELATIVE_DAYS), re.IGNORECASE)
+# 时段及未说明具体几点时的默认小时
+# “早8点”“晚8点”中单独的早、晚也是时段（“晚一点”除外）
+CLOCK_AHEAD = r"(?=\s*[0-9零〇二两三四五六七八九十])"
+EVENING_HOUR = 19
+PERIODS = [
+    (r"凌晨", 0, 6), (r"早上|早晨|今早|明早|清晨|早" + CLOCK_AHEAD, 0, 8), (r"上午", 0, 9), (r"中午", 12, 12),
+    (r"下午", 12, 14), (r"傍晚", 12, 18), (r"晚上|今晚|明晚|夜里|tonight|(?<!傍)晚" + CLOCK_AHEAD, 12, EVENING_HOUR),
+]
+DEFAULT_HOUR = 9
+AFTER = r"(?:后|以后|之后)"
+
+DATE_ABSOLUTE = re.compile(r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*[日号]?")
+DATE_MONTH_DAY = re.compile(r"(" + NUM + r")\s*月\s*(" + NUM + r")\s*[日号]")
+DATE_DAYS_LATER = re.compile(r"(" + NUM + r")\s*天" + AFTER)
+WEEKDAY_CN = re.compile(r"(下下|下|这|本)?\s*个?\s*(?:周|星期|礼拜)([一二三四五六日天1-7])")
+WEEKDAY_EN = re.compile(r"\b(next|this)?\s*(" + "|".join(WEEKDAYS_EN) + r")\b", re.IGNORECASE)
+# “快3点了”“有一点”“早一点/晚一点”不是时间，但“今晚8点”“明早9点”中的数字要和时段一起解析
+TIME_CN = re.compile(r"(?<![有些差快慢多好\d])(?!(?<=[早晚])一\s*点)(" + NUM + r")\s*[点时](?![点儿])\s*(半|一刻|三刻|(" + NUM + r")\s*分?)?")
+TIME_COLON = re.compile(r"(?<!\d)(\d{1,2})\s*[:：]\s*(\d{2})(?!\d)")
+TIME_EN = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)", re.IGNORECASE)
+TIME_EN_AT = re.compile(r"\bat\s+(\d{1,2})(?::(\d{2}))?\b(?!\s*(?:am|pm|a\.m\.|p\.m\.))", re.IGNORECASE)
+NOON_EN = re.compile(r"\bnoon\b", re.IGNORECASE)
+RANGE_END = re.compile(r"\s*(?:到|至|-|~|—|to)\s*(" + NUM + r")\s*(?:[点时:：]\s*(半|" + NUM + r")?)?")
+OFFSET_HOURS = re.compile(r"(?<![\d.])(" + DECIMAL + "|" + NUM + r"|半)\s*个?\s*(半)?\s*(?:小时|钟头)" + AFTER)
+OFFSET_MINUTES = re.compile(r"(" + NUM + r")\s*分钟" + AFTER)
+OFFSET_EN = re.compile(r"\bin\s+(an?|\d+)\s+(hour|minute)s?\b", re.IGNORECASE)
+DURATION_HOURS = re.compile(r"(?<![\d.])(" + DECIMAL + "|" + NUM + r"|半)\s*个?\s*(半)?\s*(?:小时|钟头)(?!\s*" + AFTER + r")")
+DURATION_MINUTES = re.compile(r"(" + NUM + r")\s*分钟(?!\s*" + AFTER + r")")
+DURATION_EN = re.compile(r"(?<!in )\b(an?|\d+(?:\.\d+)?)\s*(hours?|hrs?|minutes?|mins?)\b", re.IGNORECASE)
+
+
+def cn_to_int(text):
+    """
+    将阿拉伯数字或中文数字（不超过两位数）转换为整数
+    """
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return (CN_DIGITS[tens] if tens else 1) * 10 + (CN_DIGITS[ones] if ones else 0)
+    value = 0
+    for ch in text:
+        value = value * 10 + CN_DIGITS[ch]
+    return value
+
+
+def parse_minute(text):
+    if not text:
+        return 0
+    return {"半": 30, "一刻": 15, "三刻": 45}.get(text) or cn_to_int(text.rstrip("分").strip())
+
+
+def resolve_date(text, today):
+    """
+    解析日期表达
+    :return: (日期, 是否为“明天/后天”等相对日期)，未找到时返回(None, False)
+    :raises ValueError: 日期不存在（如2月30号）
+    """
+    m = DATE_ABSOLUTE.search(text)
+    if m:
+        return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3))), False
+    m = DATE_MONTH_DAY.search(text)
+    if m:
+        date = today.replace(month=cn_to_int(m.group(1)), day=cn_to_int(m.group(2)))
+        # 已经过去的日期指明年
+        if date < today:
+            date = date.replace(year=date.year + 1)
+        return date, False
+    m = DATE_DAYS_LATER.search(text)
+    if m:
+        return today + timedelta(days=cn_to_int(m.group(1))), False
+    for pattern, days in RELATIVE_DAYS:
+        if re.search(pattern, text, re.IGNORECASE):
+            return today + timedelta(days=days), days > 0
+    m = WEEKDAY_CN.search(text)
+    prefix, weekday = (m.group(1), WEEKDAYS_CN[m.group(2)]) if m else (None, None)
+    if m is None:
+        m = WEEKDAY_EN.search(text)
+        if m:
+            prefix = {"next": "下", "this": "这"}.get((m.group(1) or "").lower())
+            weekday = WEEKDAYS_EN[m.group(2).lower()]
+    if m:
+        week_start = today - timedelta(days=today.weekday())
+        weeks = {"下": 1, "下下": 2}.get(prefix, 0)
+        date = week_start + timedelta(days=weeks * 7 + weekday)
+        # 没有说明哪一周且该天已经过去时，指下一周
+        if prefix is None and date < today:
+            date += timedelta(days=7)
+        return date, False
+    return None, False
+
+
+def find_period(text):
+    """
+    :return: 文本中第一个时段的(小时偏移, 默认小时)，没有时返回None
+    """
+    for pattern, offset, default_hour in PERIODS:
+        if re.search(pattern, text, re.IGNORECASE):
+            return offset, default_hour
+    return None
+
+
+def resolve_time(text):
+    """
+    解析一天中的时间
+    :return: (小时, 分钟, 匹配结束的位置, 是否为猜测的时间)，未找到时返回None
+             没有说明上午还是下午、或只说了时段没有具体几点时，时间是猜测的；
+             “晚上12点”是当晚结束时的午夜，小时为24（即第二天0点）
+    """
+    period = find_period(text)
+    m = TIME_EN.search(text)
+    if m:
+        hour = int(m.group(1)) % 12 + (12 if m.group(3).lower().startswith("p") else 0)
+        return hour, int(m.group(2) or 0), m.end(), False
+    m = TIME_COLON.search(text) or TIME_CN.search(text)
+    if m:
+        hour = cn_to_int(m.group(1))
+        minute = int(m.group(2)) if m.re is TIME_COLON else parse_minute(m.group(2))
+        guessed = period is None and 1 <= hour <= 6
+        if period and hour < 12:
+            # 中午只对1、2点这样的时间加12小时
+            if period[0] == 12 and (period[1] != 12 or hour <= 2):
+                hour += 12
+        elif period and period[1] == EVENING_HOUR and hour == 12:
+            # “晚上12点”是午夜，即第二天0点
+            hour = 24
+        elif guessed and m.re is TIME_CN:
+            # 没有时段说明时，“3点”开会一般指下午
+            hour += 12
+        if hour > 24 or minute > 59:
+            return None
+        return hour, minute, m.end(), guessed
+    m = TIME_EN_AT.search(text)
+    if m and int(m.group(1)) <= 12:
+        hour = int(m.group(1))
+        return hour + 12 if 1 <= hour <= 7 else hour, int(m.group(2) or 0), m.end(), 1 <= hour <= 7
+    if NOON_EN.search(text):
+        return 12, 0, None, False
+    if period:
+        return period[1], 0, None, True
+    return None
+
+
+def parse_hours(number, half):
+    if number == "半":
+        hours = 0.5
+    elif "." in number:
+        hours = float(number)
+    else:
+        hours = cn_to_int(number)
+    return int(hours * 60) + (30 if half else 0)
+
+
+def resolve_offset(text):
+    """
+    解析“半小时后”“3个小时后”“in 2 hours”等相对于当前时间的偏移
+    """
+    m = OFFSET_HOURS.search(text)
+    if m:
+        return timedelta(minutes=parse_hours(m.group(1), m.group(2)))
+    m = OFFSET_MINUTES.search(text)
+    if m:
+        return timedelta(minutes=cn_to_int(m.group(1)))
+    m = OFFSET_EN.search(text)
+    if m:
+        number = 1 if m.group(1).lower() in ("a", "an") else int(m.group(1))
+        return timedelta(hours=number) if m.group(2).lower() == "hour" else timedelta(minutes=number)
+    return None
+
+
+def match_range(text, start, time_end):
+    """
+    匹配开始时间之后的“到5点”，返回(匹配, 持续分钟数)，没有时返回(None, None)
+    """
+    if start is None or time_end is None:
+        return None, None
+    m = RANGE_END.match(text, time_end)
+    if m:
+        end_hour = cn_to_int(m.group(1))
+        # “下午3点到5点”中的结束时间沿用开始时间的时段
+        if start.hour >= 12 and end_hour < 12:
+            end_hour += 12
+        end_minute = parse_minute(m.group(2))
+        if end_hour < 24 and end_minute < 60 and start.replace(hour=end_hour, minute=end_minute) > start:
+            end = start.replace(hour=end_hour, minute=end_minute)
+            return m, int((end - start).total_seconds() // 60)
+    return None, None
+
+
+def resolve_duration(text, start=None, time_end=None):
+    """
+    解析持续时长（分钟），支持“2小时”“一个半小时”“3点到5点”等
+    """
+    _, minutes = match_range(text, start, time_end)
+    if minutes is not None:
+        return minutes
+    m = DURATION_HOURS.search(text)
+    if m:
+        return parse_hours(m.group(1), m.group(2))
+    m = DURATION_MINUTES.search(text)
+    if m:
+        return cn_to_int(m.group(1))
+    m = DURATION_EN.search(text)
+    if m:
+        number = 1 if m.group(1).lower() in ("a", "an") else float(m.group(1))
+        return int(number * 60) if m.group(2).lower().startswith("h") else int(number)
+    return None
+
+
+def find_all(patterns, text, skip=()):
+    """
+    依次用各个正则查找文本，跳过与已找到（或skip中）的片段重叠的匹配
+    :return: 匹配到的文本片段列表
+    """
+    spans, found = list(skip), []
+    for pattern in patterns:
+        for m in pattern.finditer(text):
+            if m.group(0).strip() and not any(m.start() < end and start < m.end() for start, end in spans):
+                spans.append(m.span())
+                found.append(m.group(0))
+    return found
+
+
+def is_ambiguous(text, today, skip=()):
+    """
+    文本中是否有多个不同的日期、时间或时段（如“今天或明天”“3点还是4点”“上午或下午”）
+    """
+    dates = set()
+    for found in find_all([DATE_ABSOLUTE, DATE_MONTH_DAY, DATE_DAYS_LATER, RELATIVE_DAYS_ANY, WEEKDAY_CN, WEEKDAY_EN], text):
+        try:
+            dates.add(resolve_date(found, today)[0])
+        except ValueError:
+            dates.add(found)
+    times = set()
+    for found in find_all([TIME_EN, TIME_COLON, TIME_CN, TIME_EN_AT], text, skip):
+        hour, minute = resolve_time(found)[:2]
+        times.add((hour % 12, minute))
+    periods = set(offset for pattern, offset, _ in PERIODS if re.search(pattern, text, re.IGNORECASE))
+    return len(dates) > 1 or len(times) > 1 or len(periods) > 1
+
+
+def is_duration_ambiguous(text):
+    durations = set(resolve_duration(found) for found in find_all(
+        [DURATION_HOURS, DURATION_MINUTES, DURATION_EN], text))
+    return len(durations) > 1
+
+
+def parse_time_expression(text, now=None):
+    """
+    从消息中解析会议的开始时间和持续时长（相对于收到消息的时间）
+    :param text: 消息文本
+    :param now: 收到消息的时间，默认为当前时间
+    :return: 字典，包括
+             'start_time' - 开始时间（datetime，精确到分钟），无法解析时为None
+             'duration' - 持续时长（分钟），未提及时为None
+             'date_resolved' - 是否明确提到了日期
+             'time_resolved' - 是否明确提到了时间
+             'ambiguous' - 开始时间是否有歧义（提到了多个日期、时间或时段，没有说明上午还是下午，只说了时段，
+                           或日期不存在，此时start_time为None）
+             'duration_ambiguous' - 是否提到了多个不同的时长
+    """
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    today = now.replace(hour=0, minute=0)
+    result = {"start_time": None, "duration": None, "date_resolved": False, "time_resolved": False,
+              "ambiguous": False, "duration_ambiguous": is_duration_ambiguous(text)}
+    offset = resolve_offset(text)
+    if offset is not None:
+        offsets = set(resolve_offset(found) for found in find_all([OFFSET_HOURS, OFFSET_MINUTES, OFFSET_EN], text))
+        result.update(start_time=now + offset, date_resolved=True, time_resolved=True, ambiguous=len(offsets) > 1)
+        result["duration"] = resolve_duration(text)
+        return result
+
+    try:
+        date, relative = resolve_date(text, today)
+    except ValueError:
+        # 不存在的日期（如2月30号）交给模型处理
+        result.update(ambiguous=True, duration=resolve_duration(text))
+        return result
+    # 凌晨0点到4点之间说的“明天/后天”，通常指的是睡醒后的这一天
+    if date is not None and relative and now.hour < 4:
+        date -= timedelta(days=1)
+    time_of_day = resolve_time(text)
+    if date is None and time_of_day is None:
+        result["duration"] = resolve_duration(text)
+        return result
+    hour, minute, time_end, guessed = time_of_day if time_of_day else (DEFAULT_HOUR, 0, None, False)
+    start = (date or today).replace(hour=hour % 24, minute=minute) + timedelta(days=hour // 24)
+    range_end, duration = match_range(text, start, time_end)
+    result.update(start_time=start, date_resolved=date is not None, time_resolved=time_of_day is not None,
+                  ambiguous=guessed or is_ambiguous(text, today, [range_end.span()] if range_end else ()))
+    if duration is not None:
+        result.update(duration=duration, duration_ambiguous=False)
+    else:
+        result["duration"] = resolve_duration(text)
+    return result
+
+
+# 示例使用
+if __name__ == "__main__":
+    now = datetime(2024, 5, 15, 10, 30)  # 周三
+    for text in ["明天下午2点和张三讨论日本行程", "下周三上午开会", "周五中午12点半吃饭",
+                 "后天晚上7点到9点聚餐", "一个半小时后提醒我", "3月20号下午三点面试，大概1个小时",
+                 "Let's meet tomorrow at 3pm for 30 minutes", "next Monday at 10am", "你好"]:
+        print(text, parse_time_expression(text, now))
+    print("凌晨2点说明天:", parse_time_expression("明天上午10点开会", datetime(2024, 5, 16, 2, 0)))
@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TimerHandle:
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerScheduler:
+    """
+    基于最小堆的定时器：只用一个线程等待最近到期的定时器，到期后把回调交给有界线程池执行，
+    线程数量不随定时器数量增长，没有定时器到期时不占用CPU
+    """
+    def __init__(self, max_workers=8, name="timer"):
+        self.name = name
+        self.condition = threading.Condition()
+        self.timers = []
+        self.counter = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return self
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"{self.name}-scheduler", daemon=True)
+        self.thread.start()
+        return self
+
+    def call_later(self, delay, callback, *args):
+        """
+        在delay秒后于线程池中执行callback(*args)
+        :return: TimerHandle，可通过cancel()取消
+        """
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        handle = TimerHandle(when, callback, args)
+        with self.condition:
+            heapq.heappush(self.timers, (when, next(self.counter), handle))
+            # 新定时器比当前等待的更早到期时，唤醒调度线程重新计算等待时间
+            if self.timers[0][2] is handle:
+                self.condition.notify()
+        return handle
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    # 丢弃已取消的定时器
+                    while self.timers and self.timers[0][2].cancelled:
+                        heapq.heappop(self.timers)
+                    if self.timers and self.timers[0][0] <= time.monotonic():
+                        break
+                    timeout = self.timers[0][0] - time.monotonic() if self.timers else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                _, _, handle = heapq.heappop(self.timers)
+            try:
+                self.executor.submit(self._fire, handle)
+            except RuntimeError:
+                # 线程池已关闭
+                return
+
+    @staticmethod
+    def _fire(handle):
+        if handle.cancelled:
+            return
+        try:
+            handle.callback(*handle.args)
+        except Exception:
+            logging.exception(f"Timer callback {handle.callback} failed")
+
+    def pending(self):
+        with self.condition:
+            return sum(1 for _, _, handle in self.timers if not handle.cancelled)
+
+    def stop(self, wait=True):
+        with self.condition:
+            self.running = False
+            self.timers.clear()
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.executor.shutdown(wait=wait)